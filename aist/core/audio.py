@@ -1,14 +1,307 @@
 # aist/core/audio.py
-import pyaudio
 import logging
+import os
+import threading
+import time
+import wave
+import numpy as np
+from aist.core.config_manager import config
 
 log = logging.getLogger(__name__)
 
+try:
+    import pyaudio
+except ImportError:
+    # Recorded audio sources still work without it, e.g. for headless benchmarks.
+    pyaudio = None
+
+CAPTURE_SAMPLE_RATE = 16000 # 16-bit mono PCM, what the VAD and both recognizers expect.
+CAPTURE_SAMPLE_WIDTH = 2
+
+class AudioRingBuffer:
+    """
+    A preallocated ring of int16 samples with one writer and any number of readers.
+
+    The writer never waits for the readers: it copies each chunk into the ring and then
+    advances the total number of samples written. Readers keep their own positions and get
+    zero-copy memoryview slices of the ring. A reader that falls more than the ring's
+    capacity behind skips ahead to the oldest audio still in it, and counts the overflow.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._samples = np.zeros(capacity, dtype=np.int16)
+        self._bytes = memoryview(self._samples).cast('B')
+        self._written = 0 # Total samples written. Only the writer changes it.
+        self._closed = False
+        self._data_ready = threading.Condition()
+
+    @property
+    def written(self) -> int:
+        return self._written
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def write(self, data):
+        """Copies a chunk of 16-bit PCM into the ring, overwriting the oldest audio."""
+        chunk = np.frombuffer(data, dtype=np.int16)
+        if len(chunk) > self.capacity:
+            chunk = chunk[-self.capacity:]
+        start = self._written % self.capacity
+        first = min(len(chunk), self.capacity - start)
+        self._samples[start:start + first] = chunk[:first]
+        self._samples[:len(chunk) - first] = chunk[first:]
+        # Publish the samples only once they are in place.
+        self._written += len(chunk)
+        with self._data_ready:
+            self._data_ready.notify_all()
+
+    def close(self):
+        """Wakes up all readers. Reads return whatever is left, then nothing."""
+        self._closed = True
+        with self._data_ready:
+            self._data_ready.notify_all()
+
+    def wait(self, position: int, timeout: float | None) -> bool:
+        """Waits until there are samples after `position`. Returns False on timeout or once closed."""
+        with self._data_ready:
+            return self._data_ready.wait_for(lambda: self._written > position or self._closed, timeout=timeout) and self._written > position
+
+    def view(self, position: int, count: int) -> memoryview:
+        """Returns up to `count` samples from `position` as bytes, without copying. Stops at the end of the ring."""
+        start = position % self.capacity
+        count = min(count, self.capacity - start)
+        return self._bytes[start * CAPTURE_SAMPLE_WIDTH:(start + count) * CAPTURE_SAMPLE_WIDTH]
+
+    def reader(self) -> "AudioReader":
+        """Returns a reader that starts with the next audio written."""
+        return AudioReader(self)
+
+class AudioReader:
+    """
+    One consumer's position in an AudioRingBuffer.
+
+    The memoryviews returned by `read` point into the ring itself, so they are only valid
+    until the writer laps them, `capacity` samples later. A consumer that keeps audio
+    longer than that must copy it, e.g. with bytes().
+    """
+    def __init__(self, ring: AudioRingBuffer):
+        self.ring = ring
+        self.position = ring.written
+        self.overflows = 0
+        self.dropped_samples = 0
+
+    def available(self) -> int:
+        """Returns how many samples are waiting to be read."""
+        return min(self.ring.written - self.position, self.ring.capacity)
+
+    def skip(self):
+        """Skips all audio waiting to be read, e.g. audio the consumer chose not to listen to."""
+        self.position = self.ring.written
+
+    def read(self, samples: int, timeout: float | None = None) -> memoryview:
+        """
+        Returns the next chunk of 16-bit PCM, up to `samples` samples, as soon as any audio is
+        available. Returns an empty memoryview if nothing arrived within `timeout` seconds
+        or the capture was stopped.
+        """
+        if not self.ring.wait(self.position, timeout):
+            return memoryview(b"")
+        written = self.ring.written
+        if written - self.position > self.ring.capacity:
+            # The writer lapped this reader. Skip to the oldest audio still in the ring.
+            dropped = written - self.ring.capacity - self.position
+            self.overflows += 1
+            self.dropped_samples += dropped
+            self.position = written - self.ring.capacity
+            log.warning(f"An audio consumer fell behind the microphone and lost {dropped / CAPTURE_SAMPLE_RATE:.2f} s of audio.")
+        chunk = self.ring.view(self.position, min(samples, written - self.position))
+        self.position += len(chunk) // CAPTURE_SAMPLE_WIDTH
+        return chunk
+
+    def read_exactly(self, samples: int, timeout: float | None = None) -> np.ndarray:
+        """Copies the next `samples` samples into a new array, e.g. for calibration or recording. Returns fewer on timeout."""
+        recording = np.empty(samples, dtype=np.int16)
+        filled = 0
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while filled < samples:
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                break
+            chunk = np.frombuffer(self.read(samples - filled, timeout=remaining), dtype=np.int16)
+            if len(chunk) == 0:
+                if self.ring.closed:
+                    break
+                continue
+            recording[filled:filled + len(chunk)] = chunk
+            filled += len(chunk)
+        return recording[:filled]
+
+def read_pcm_chunks(path: str, chunk_samples: int = 512):
+    """
+    Yields the audio of a WAV file as 16 kHz, 16-bit mono PCM chunks. Any other path is read as
+    raw PCM in that format while it is being written, so it can also be a named pipe.
+    """
+    if path.lower().endswith(".wav"):
+        with wave.open(path, "rb") as wav:
+            if wav.getsampwidth() != 2:
+                raise ValueError(f"'{path}' is not 16-bit PCM.")
+            samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+            channels, rate = wav.getnchannels(), wav.getframerate()
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+        if rate != CAPTURE_SAMPLE_RATE:
+            positions = np.arange(0, len(samples), rate / CAPTURE_SAMPLE_RATE)
+            samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.int16)
+        for start in range(0, len(samples), chunk_samples):
+            yield samples[start:start + chunk_samples].tobytes()
+        return
+
+    chunk_bytes = chunk_samples * CAPTURE_SAMPLE_WIDTH
+    leftover = b""
+    with open(path, "rb") as stream:
+        while True:
+            data = stream.read(chunk_bytes)
+            if not data:
+                break
+            data = leftover + data
+            usable = len(data) - len(data) % CAPTURE_SAMPLE_WIDTH
+            leftover = data[usable:]
+            if usable:
+                yield data[:usable]
+
+class FileAudioSource:
+    """
+    Replays recorded audio in place of the microphone, for benchmarks and headless runs.
+
+    The files (see `read_pcm_chunks`) are played one after the other into an AudioRingBuffer,
+    each followed by `gap_seconds` of silence so the VAD can end the utterance, at `speed`
+    times real time. With a speed of 0 it plays as fast as the slowest reader consumes the
+    audio, without ever dropping any. Each file's timings are recorded in `utterances`, and
+    `on_utterance_end(index, utterance)` is called after its gap has been played. It may block,
+    e.g. to wait for the transcript, and the replay clock restarts when it returns.
+    """
+    def __init__(self, paths: list[str], speed: float = 1.0, gap_seconds: float = 1.0,
+                 buffer_seconds: float = 10, chunk_samples: int = 512, on_utterance_end=None):
+        self.paths = list(paths)
+        self.speed = speed
+        self.gap_samples = int(gap_seconds * CAPTURE_SAMPLE_RATE)
+        self.chunk_samples = chunk_samples
+        self.on_utterance_end = on_utterance_end
+        self.ring = AudioRingBuffer(int(buffer_seconds * CAPTURE_SAMPLE_RATE))
+        self.utterances = []
+        self._readers = []
+        self._silence = bytes(chunk_samples * CAPTURE_SAMPLE_WIDTH)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._clock_start = 0.0
+        self._clock_samples = 0
+
+    def reader(self) -> AudioReader:
+        """Returns a reader that starts with the next audio played."""
+        reader = self.ring.reader()
+        self._readers.append(reader)
+        return reader
+
+    def start(self):
+        """Starts playing the files in a background thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._play, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops playing and wakes up all readers."""
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.ring.close()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Waits until all files have been played. Returns False on timeout."""
+        if self._thread:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return True
+
+    def _write(self, chunk: bytes):
+        samples = len(chunk) // CAPTURE_SAMPLE_WIDTH
+        if self.speed > 0:
+            delay = self._clock_start + (self._clock_samples + samples) / (CAPTURE_SAMPLE_RATE * self.speed) - time.perf_counter()
+            if delay > 0:
+                self._stop_event.wait(delay)
+        else:
+            # Never lap the slowest reader.
+            while self._readers and not self._stop_event.is_set():
+                slowest = min(reader.position for reader in self._readers)
+                if self.ring.written + samples - slowest <= self.ring.capacity:
+                    break
+                time.sleep(0.001)
+        self.ring.write(chunk)
+        self._clock_samples += samples
+
+    def _play(self):
+        self._clock_start = time.perf_counter()
+        try:
+            for index, path in enumerate(self.paths):
+                utterance = {"path": path, "start": time.perf_counter(), "samples": 0}
+                for chunk in read_pcm_chunks(path, self.chunk_samples):
+                    if self._stop_event.is_set():
+                        return
+                    self._write(chunk)
+                    utterance["samples"] += len(chunk) // CAPTURE_SAMPLE_WIDTH
+                utterance["speech_end"] = time.perf_counter()
+                utterance["duration"] = utterance["samples"] / CAPTURE_SAMPLE_RATE
+                self.utterances.append(utterance)
+
+                for _ in range(0, self.gap_samples, self.chunk_samples):
+                    if self._stop_event.is_set():
+                        return
+                    self._write(self._silence)
+                if self.on_utterance_end:
+                    self.on_utterance_end(index, utterance)
+                    self._clock_start, self._clock_samples = time.perf_counter(), 0
+        except Exception as e:
+            log.error(f"Error replaying audio: {e}", exc_info=True)
+        finally:
+            self.ring.close()
+            log.info(f"Finished replaying {len(self.utterances)} audio file(s).")
+
+def create_source_from_config() -> FileAudioSource | None:
+    """Creates the recorded audio source configured in config.yaml (audio.source), or None for the microphone."""
+    source_type = config.get('audio.source.type', 'microphone')
+    if source_type == "microphone":
+        return None
+    if source_type not in ("file", "pipe"):
+        log.warning(f"Unknown audio source type '{source_type}'. Using the microphone.")
+        return None
+
+    path = config.get('audio.source.path')
+    paths = [path] if isinstance(path, str) else list(path or [])
+    if source_type == "file" and len(paths) == 1 and os.path.isdir(paths[0]):
+        directory = paths[0]
+        paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.lower().endswith((".wav", ".pcm", ".raw"))]
+    if not paths:
+        log.error("No audio files or pipe configured in audio.source.path. Using the microphone.")
+        return None
+    log.info(f"Replaying audio from {len(paths)} {source_type}(s) instead of the microphone.")
+    return FileAudioSource(
+        paths,
+        speed=config.get('audio.source.speed', 1.0),
+        gap_seconds=config.get('audio.source.gap_seconds', 1.0),
+        buffer_seconds=config.get('audio.capture.buffer_seconds', 10),
+    )
+
 class AudioManager:
     """
     A singleton class to manage a single, shared PyAudio instance.
     This prevents resource conflicts that can occur when multiple parts of the
     application try to initialize PyAudio independently.
+
+    It also owns the one microphone stream. PortAudio's callback thread writes the captured
+    audio into an AudioRingBuffer, and every consumer (the VAD and recognizers, noise
+    calibration, recorders) reads it at its own pace through an AudioReader.
+    A recorded source (`use_source`, or audio.source in config.yaml) can replace the microphone.
     """
     _instance = None
     _pyaudio_instance = None
@@ -16,6 +309,14 @@ class AudioManager:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(AudioManager, cls).__new__(cls)
+            cls._instance._capture_stream = None
+            cls._instance._capture_ring = None
+            cls._instance._capture_lock = threading.Lock()
+            cls._instance.capture_overflows = 0
+            cls._instance._source = None
+            if pyaudio is None:
+                log.error("PyAudio is not installed. Only recorded audio sources are available.")
+                return cls._instance
             try:
                 log.info("Initializing shared PyAudio instance...")
                 cls._pyaudio_instance = pyaudio.PyAudio()
@@ -29,5 +330,93 @@ class AudioManager:
         """Returns the shared PyAudio instance."""
         return self._pyaudio_instance
 
+    def _capture_callback(self, in_data, frame_count, time_info, status_flags):
+        # Runs on PortAudio's thread, so it must never block.
+        if status_flags & pyaudio.paInputOverflow:
+            self.capture_overflows += 1
+        self._capture_ring.write(in_data)
+        return (None, pyaudio.paContinue)
+
+    def start_capture(self) -> AudioRingBuffer | None:
+        """Opens the microphone, if it isn't already, and returns the ring buffer it captures into."""
+        with self._capture_lock:
+            if self._capture_stream is not None:
+                return self._capture_ring
+            p = self.get_pyaudio()
+            if not p:
+                log.error("PyAudio instance not available. Cannot open the microphone.")
+                return None
+
+            seconds = config.get('audio.capture.buffer_seconds', 10)
+            frames_per_buffer = config.get('audio.capture.frames_per_buffer', 512)
+            self._capture_ring = AudioRingBuffer(int(seconds * CAPTURE_SAMPLE_RATE))
+            try:
+                self._capture_stream = p.open(
+                    format=pyaudio.paInt16,
+                    channels=1,
+                    rate=CAPTURE_SAMPLE_RATE,
+                    input=True,
+                    input_device_index=config.get('audio.capture.device_index', None),
+                    frames_per_buffer=frames_per_buffer,
+                    stream_callback=self._capture_callback,
+                )
+            except OSError as e:
+                log.fatal(f"FATAL: Could not open microphone stream: {e}")
+                log.fatal("Please ensure you have a microphone connected and configured as the default input device.")
+                self._capture_ring = None
+                return None
+            self._capture_stream.start_stream()
+            log.info(f"Microphone capture started ({seconds} s ring buffer, {frames_per_buffer} frames per buffer).")
+            return self._capture_ring
+
+    def use_source(self, source: FileAudioSource | None):
+        """
+        Replaces the microphone with a recorded audio source for readers opened from now on.
+        The caller starts the source once every consumer has opened its reader. None restores the microphone.
+        """
+        with self._capture_lock:
+            self._source = source
+
+    def open_reader(self) -> AudioReader | None:
+        """
+        Returns a new reader of the microphone audio, starting the capture if needed.
+        A recorded source configured in config.yaml replaces the microphone, and starts playing with its first reader.
+        """
+        with self._capture_lock:
+            if self._source is None:
+                self._source = create_source_from_config()
+                if self._source is not None:
+                    reader = self._source.reader()
+                    self._source.start()
+                    return reader
+            if self._source is not None:
+                return self._source.reader()
+        ring = self.start_capture()
+        return ring.reader() if ring else None
+
+    def stop_capture(self):
+        """Closes the microphone stream, or stops the recorded source, and wakes up all readers."""
+        with self._capture_lock:
+            if self._source is not None:
+                self._source.stop()
+            stream, self._capture_stream = self._capture_stream, None
+            if stream is None:
+                return
+            try:
+                stream.stop_stream()
+                stream.close()
+            except Exception as e:
+                log.warning(f"Error closing the microphone stream: {e}")
+            self._capture_ring.close()
+            log.info(f"Microphone capture stopped. {self.capture_overflows} input overflows.")
+
+    def capture_stats(self) -> dict:
+        """Returns the capture counters, for spotting audio that was lost."""
+        ring = self._capture_ring
+        return {
+            "samples_captured": ring.written if ring else 0,
+            "capture_overflows": self.capture_overflows,
+        }
+
 # Global instance that can be imported by other modules.
-audio_manager = AudioManager()
\ No newline at end of file
+audio_manager = AudioManager()
@@ -53,6 +53,19 @@ class ConfigManager:
             value = value[k]
         return value
 
+    def set(self, key: str, value: Any):
+        """
+        Overrides a configuration value for this process, using a dot-separated key.
+        Used by tools that run components with settings other than those in config.yaml.
+        """
+        keys = key.split('.')
+        section = self._config
+        for k in keys[:-1]:
+            if not isinstance(section.get(k), dict):
+                section[k] = {}
+            section = section[k]
+        section[keys[-1]] = value
+
 # Create a single, globally accessible instance of the config manager.
 # Other modules can simply `from aist.core.config_manager import config`
 config = ConfigManager()
\ No newline at end of file
@@ -1,31 +1,213 @@
 # aist/core/conversation.py
 import logging
+import threading
 from collections import deque
+from typing import Callable
 from aist.core.config_manager import config
 
 log = logging.getLogger(__name__)
 
+def estimate_tokens(text: str) -> int:
+    """A rough token count for when no tokenizer is available (about four characters per token)."""
+    return len(text) // 4 + 1
+
+class PromptBudget:
+    """
+    Splits the prompt's token budget between its parts.
+
+    Each part ('facts', 'history' and 'command') has a reserved share of the budget. The
+    history also gets whatever the facts and the command leave unused, so a short command
+    with no facts doesn't waste room that older turns could use.
+    """
+    PARTS = ("facts", "history", "command")
+
+    def __init__(self, total: int, shares: dict):
+        self.total = max(0, int(total))
+        weight = sum(max(0.0, float(shares.get(part, 0))) for part in self.PARTS) or 1.0
+        self.reserved = {part: int(self.total * max(0.0, float(shares.get(part, 0))) / weight) for part in self.PARTS}
+
+    @classmethod
+    def from_config(cls) -> "PromptBudget":
+        context_length = config.get('models.llm.context_length', 2048)
+        max_new_tokens = config.get('models.llm.max_new_tokens', 150)
+        total = config.get('models.llm.prompt_budget', context_length - max_new_tokens)
+        # The prompt and the response must both fit in the context.
+        total = min(total, context_length - max_new_tokens)
+        shares = config.get('models.llm.prompt_shares', {"facts": 0.2, "history": 0.6, "command": 0.2})
+        return cls(total, shares)
+
+def trim_history(messages: list[dict], max_tokens: int, count_tokens: Callable[[str], int] = estimate_tokens) -> list[dict]:
+    """Returns the newest messages whose tokens fit in `max_tokens`, dropping the oldest first."""
+    kept = []
+    used = 0
+    for message in reversed(messages):
+        tokens = message.get("tokens")
+        if tokens is None:
+            tokens = count_tokens(format_message(message["role"], message["content"]))
+        if used + tokens > max_tokens:
+            break
+        kept.append(message)
+        used += tokens
+    kept.reverse()
+    return kept
+
+# The role of the running summary in the history returned by ConversationManager.
+SUMMARY_ROLE = "summary"
+
+def format_message(role: str, content: str) -> str:
+    """Formats one history message for the Mistral Instruct model, as it appears in the prompt."""
+    if role == 'user':
+        return f"[INST] {content} [/INST]"
+    if role == SUMMARY_ROLE:
+        # The running summary of older turns stands in for them as one exchange.
+        return f"[INST] Here is a summary of our conversation so far: {content} [/INST]Understood.</s>"
+    return f"{content}</s>"
+
 class ConversationManager:
     """
     Manages the short-term conversation history for contextual understanding.
+
+    Every message keeps its token count, counted once when it is added, including the chat
+    template tokens that surround it in the prompt (see `format_message`). The history is
+    kept within the history's share of the prompt budget, so the prompt stays within a
+    fixed size no matter how long the conversation is.
+
+    Old turns are not simply dropped: once the history nears its limit, `summarize` folds
+    the oldest messages into a running summary, which is returned at the start of the
+    history. Summarizing calls the LLM, so the server runs it in the background after a
+    reply has been sent. Messages that overflow the limit before then wait in `_pending`
+    until the next summary.
     """
-    def __init__(self):
+    def __init__(self, token_counter: Callable[[str], int] | None = None):
         # max_history_length is the number of user/assistant *exchanges*.
-        # So, the deque will hold 2 * max_history_length items.
+        # So, the history will hold at most 2 * max_history_length messages.
         history_length = config.get('assistant.conversation_history_length', 5)
         self.max_size = history_length * 2
-        self.history = deque(maxlen=self.max_size)
-        log.info(f"ConversationManager initialized with a max history of {history_length} exchanges.")
+        self.history = deque()
+        # Counts tokens with the model's tokenizer. Set once the model is loaded.
+        self.token_counter = token_counter
+        self.budget = PromptBudget.from_config()
+        self.summary = None
+        self._pending = []
+        self._summarizing = False
+        # Bumped whenever the history is cleared, so a summary of the old history is discarded.
+        self.version = 0
+        self._lock = threading.RLock()
+        self.summary_enabled = config.get('assistant.summary.enabled', True)
+        # Summarize once the history uses this fraction of its token limit, keeping the newest
+        # messages that fit in `keep_ratio` of its token and message limits verbatim.
+        self.summary_trigger_ratio = config.get('assistant.summary.trigger_ratio', 0.8)
+        self.summary_keep_ratio = config.get('assistant.summary.keep_ratio', 0.5)
+        log.info(f"ConversationManager initialized with a max history of {history_length} exchanges and {self.budget.total} prompt tokens.")
+
+    @property
+    def token_limit(self) -> int:
+        """The number of tokens the summary and the history may use together."""
+        return self.budget.total - self.budget.reserved["facts"] - self.budget.reserved["command"]
+
+    def count_tokens(self, text: str) -> int:
+        if self.token_counter is None:
+            return estimate_tokens(text)
+        try:
+            return self.token_counter(text)
+        except Exception as e:
+            log.warning(f"Failed to count tokens, using an estimate: {e}")
+            return estimate_tokens(text)
+
+    def _used_tokens(self) -> int:
+        summary_tokens = self.summary["tokens"] if self.summary else 0
+        return summary_tokens + sum(message["tokens"] for message in self.history)
 
     def add_message(self, role: str, text: str):
-        """Adds a message to the history."""
-        self.history.append({"role": role, "content": text})
+        """
+        Adds a message to the history. The oldest messages that no longer fit in the budget
+        are moved out of the history, to be folded into the summary (or dropped, if
+        summaries are disabled).
+        """
+        message = {"role": role, "content": text, "tokens": self.count_tokens(format_message(role, text))}
+        with self._lock:
+            self.history.append(message)
+            while len(self.history) > 1 and (len(self.history) > self.max_size or self._used_tokens() > self.token_limit):
+                evicted = self.history.popleft()
+                if self.summary_enabled:
+                    self._pending.append(evicted)
+
+    def get_history(self, max_tokens: int | None = None) -> list[dict]:
+        """
+        Returns the current conversation history as a list of dicts with 'role', 'content' and 'tokens'.
+        If there is a running summary, it comes first, with the role 'summary'.
+        If `max_tokens` is given, only the newest messages that fit are returned.
+        """
+        with self._lock:
+            history = ([self.summary] if self.summary else []) + list(self.history)
+        if max_tokens is None:
+            return history
+        return trim_history(history, max_tokens, self.count_tokens)
+
+    def needs_summary(self) -> bool:
+        """Checks whether old messages are waiting to be summarized, or the history is near its limit."""
+        with self._lock:
+            if not self.summary_enabled or self._summarizing:
+                return False
+            return bool(self._pending) or self._used_tokens() >= self.token_limit * self.summary_trigger_ratio
+
+    def summarize(self, summarizer: Callable[[str | None, list[dict], int], str]) -> bool:
+        """
+        Folds the oldest messages into the running summary.
+
+        `summarizer(summary, messages, max_tokens)` returns a new summary of the previous
+        summary (or None) and the messages, in at most `max_tokens` tokens. It runs without
+        holding the lock, so messages can be added meanwhile. Returns whether the summary
+        was updated.
+        """
+        with self._lock:
+            if not self.summary_enabled or self._summarizing:
+                return False
+            version = self.version
+            keep_tokens = int(self.token_limit * self.summary_keep_ratio)
+            keep_messages = max(2, int(self.max_size * self.summary_keep_ratio))
+            messages = list(self._pending)
+            history = list(self.history)
+            # Always keep the latest exchange verbatim.
+            kept_tokens = sum(message["tokens"] for message in history[-2:])
+            split = max(0, len(history) - 2)
+            while split > 0 and len(history) - split < keep_messages and kept_tokens + history[split - 1]["tokens"] <= keep_tokens:
+                split -= 1
+                kept_tokens += history[split]["tokens"]
+            # Keep whole exchanges, so the verbatim history starts with a user message.
+            while 0 < split < len(history) and history[split]["role"] != "user":
+                split += 1
+            messages += history[:split]
+            if not messages:
+                return False
+            # The summary gets the room the summarized messages leave behind, less its template.
+            overhead = self.count_tokens(format_message(SUMMARY_ROLE, ""))
+            max_tokens = max(1, self.token_limit - kept_tokens - overhead)
+            previous = self.summary["content"] if self.summary else None
+            self._summarizing = True
+
+        try:
+            text = summarizer(previous, messages, max_tokens)
+        except Exception as e:
+            log.error(f"Failed to summarize the conversation: {e}", exc_info=True)
+            text = None
 
-    def get_history(self) -> list[dict]:
-        """Returns the current conversation history as a list of dicts."""
-        return list(self.history)
+        with self._lock:
+            self._summarizing = False
+            if not text or version != self.version:
+                return False
+            summarized = {id(message) for message in messages}
+            self._pending = [message for message in self._pending if id(message) not in summarized]
+            self.history = deque(message for message in self.history if id(message) not in summarized)
+            self.summary = {"role": SUMMARY_ROLE, "content": text, "tokens": self.count_tokens(format_message(SUMMARY_ROLE, text))}
+            log.info(f"Summarized {len(messages)} messages into {self.summary['tokens']} tokens.")
+            return True
 
     def clear(self):
-        """Clears the conversation history."""
-        self.history.clear()
-        log.info("Conversation history cleared.")
\ No newline at end of file
+        """Clears the conversation history and its summary."""
+        with self._lock:
+            self.history.clear()
+            self._pending.clear()
+            self.summary = None
+            self.version += 1
+        log.info("Conversation history cleared.")
@@ -0,0 +1,176 @@
+# aist/core/decision_cache.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from aist.core.config_manager import config
+
+log = logging.getLogger(__name__)
+
+_CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS decisions (
+    key TEXT PRIMARY KEY,
+    decision TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+class DecisionCache:
+    """
+    A bounded, persistent cache of skill-router decisions.
+
+    The router decodes greedily, so its decision only depends on the prompt: the skill
+    catalog (and model) it was built for, the command and, unless `include_history` is off,
+    the conversation history. Entries are keyed by a hash of those, kept in an in-memory
+    LRU and written through to a small SQLite database, so they survive restarts.
+    Entries expire `ttl` seconds after they were stored.
+    """
+    def __init__(self, db_path: str, max_entries: int = 512, ttl: float = 7 * 24 * 3600, include_history: bool = True):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.include_history = include_history
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> [decision, created, last_used]
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Opens the database and loads the most recently used entries that haven't expired."""
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(_CREATE_TABLE_SQL)
+            with self._conn:
+                self._conn.execute("DELETE FROM decisions WHERE created < ?", (time.time() - self.ttl,))
+            rows = self._conn.execute(
+                "SELECT key, decision, created, last_used FROM decisions ORDER BY last_used DESC LIMIT ?", (self.max_entries,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            log.warning(f"Could not open the router decision cache '{self.db_path}', caching in memory only: {e}")
+            self._conn = None
+            return
+        for key, decision, created, last_used in reversed(rows):
+            try:
+                self._entries[key] = [json.loads(decision), created, last_used]
+            except json.JSONDecodeError:
+                continue
+        log.info(f"Router decision cache loaded {len(self._entries)} entries.")
+
+    def make_key(self, catalog: str, command: str, history: list) -> str:
+        """Builds the cache key for routing `command` with the catalog fingerprint and history."""
+        history_key = [[msg.get("role"), msg.get("content")] for msg in history] if self.include_history else []
+        material = json.dumps([catalog, command, history_key], ensure_ascii=False)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        """Returns a copy of the cached decision for the key, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            entry[2] = now
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return json.loads(json.dumps(entry[0]))
+
+    def put(self, key: str, decision: dict):
+        """Stores a decision in memory and on disk, evicting the least recently used entries."""
+        if self.max_entries <= 0:
+            return
+        now = time.time()
+        evicted = []
+        with self._lock:
+            self._entries[key] = [decision, now, now]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+            if self._conn is None:
+                return
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO decisions (key, decision, created, last_used) VALUES (?, ?, ?, ?)",
+                        (key, json.dumps(decision), now, now),
+                    )
+                    self._conn.executemany("DELETE FROM decisions WHERE key = ?", [(k,) for k in evicted])
+            except sqlite3.Error as e:
+                log.warning(f"Could not persist a router decision: {e}")
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters, for tuning the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def close(self):
+        """Saves when each entry was last used, so the most used entries are loaded next time, and closes the database."""
+        with self._lock:
+            conn, self._conn = self._conn, None
+            if conn is not None:
+                try:
+                    with conn:
+                        conn.executemany(
+                            "UPDATE decisions SET last_used = ? WHERE key = ?",
+                            [(entry[2], key) for key, entry in self._entries.items()],
+                        )
+                        # Keep the database as small as the in-memory cache.
+                        conn.execute(
+                            "DELETE FROM decisions WHERE key NOT IN (SELECT key FROM decisions ORDER BY last_used DESC LIMIT ?)",
+                            (self.max_entries,),
+                        )
+                except sqlite3.Error as e:
+                    log.warning(f"Could not save the router decision cache: {e}")
+                conn.close()
+        stats = self.stats()
+        log.info(f"Router decision cache closed. {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate).")
+
+# Global instance for easy access across the application
+decision_cache = None
+_decision_cache_lock = threading.Lock()
+
+def initialize_decision_cache() -> DecisionCache | None:
+    """Initializes and opens the global router decision cache, unless it is disabled in config.yaml."""
+    global decision_cache
+    with _decision_cache_lock:
+        if decision_cache is None and config.get('models.llm.router_cache.enabled', True):
+            cache = DecisionCache(
+                config.get('models.llm.router_cache.path', 'data/cache/router_decisions.db'),
+                max_entries=config.get('models.llm.router_cache.max_entries', 512),
+                ttl=config.get('models.llm.router_cache.ttl_hours', 168) * 3600,
+                include_history=config.get('models.llm.router_cache.include_history', True),
+            )
+            cache.open()
+            decision_cache = cache
+    return decision_cache
+
+def close_decision_cache():
+    """Closes the global router decision cache, if it was opened."""
+    global decision_cache
+    with _decision_cache_lock:
+        if decision_cache is not None:
+            decision_cache.close()
+            decision_cache = None
+
+def decision_cache_stats() -> dict:
+    """Returns the counters of the global router decision cache, or an empty dictionary if it is not open."""
+    cache = decision_cache
+    return cache.stats() if cache is not None else {}
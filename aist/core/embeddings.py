@@ -0,0 +1,57 @@
+# aist/core/embeddings.py
+import logging
+import threading
+import numpy as np
+from aist.core.config_manager import config
+
+log = logging.getLogger(__name__)
+
+class Embedder:
+    """
+    Turns text into L2-normalized float32 sentence embeddings, so cosine similarity
+    between embeddings is a plain dot product.
+    Uses a small sentence-transformers model, which is fast enough to run on every command.
+    """
+    def __init__(self, model_name: str):
+        # Imported here so the rest of the application works without the optional dependency.
+        from sentence_transformers import SentenceTransformer
+        cache_dir = config.get('models.embeddings.cache_dir', 'data/models/embeddings')
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device="cpu", cache_folder=cache_dir)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Embeds a batch of texts into a (len(texts), dimension) matrix."""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        vectors = self.model.encode(texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+        return vectors.astype(np.float32, copy=False)
+
+# Global instance, loaded on first use.
+_embedder = None
+_embedder_loaded = False
+_embedder_lock = threading.Lock()
+
+def get_embedder() -> Embedder | None:
+    """
+    Returns the shared embedder, loading it on first use.
+    Returns None if embeddings are disabled or the model could not be loaded.
+    """
+    global _embedder, _embedder_loaded
+    with _embedder_lock:
+        if _embedder_loaded:
+            return _embedder
+        _embedder_loaded = True
+        if not config.get('models.embeddings.enabled', True):
+            log.info("Embeddings are disabled in config.yaml (models.embeddings.enabled).")
+            return None
+        model_name = config.get('models.embeddings.model', 'sentence-transformers/all-MiniLM-L6-v2')
+        try:
+            log.info(f"Loading embedding model '{model_name}'...")
+            _embedder = Embedder(model_name)
+            log.info(f"Embedding model loaded ({_embedder.dimension} dimensions).")
+        except ImportError:
+            log.warning("sentence-transformers is not installed. Embedding-based features are disabled.")
+        except Exception as e:
+            log.error(f"Failed to load embedding model '{model_name}': {e}", exc_info=True)
+        return _embedder
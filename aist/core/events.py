@@ -23,6 +23,8 @@ bus = pub.getDefaultPublisher()
 # Speech-to-Text (STT) Events
 STT_TRANSCRIBED = 'stt.transcribed'  # Fired when text is successfully transcribed.
                                      # Data: {'text': str}
+STT_PARTIAL = 'stt.partial'          # Fired repeatedly with the current hypothesis while the user is still speaking.
+                                     # Data: {'text': str}
 
 # Text-to-Speech (TTS) Events
 TTS_SPEAK = 'tts.speak'              # Fired to request speech synthesis.
@@ -1,31 +1,82 @@
 # core/ipc/client.py
 
 import json
+import threading
+import time
+import uuid
 import zmq
 import logging
-from typing import Dict, Any
+from typing import Callable, Dict, Any
 from aist.core.config_manager import config
+from aist.core.ipc.protocol import MSG_RESPONSE, LLM_PARTIAL_RESPONSE, MSG_CANCEL
 
 log = logging.getLogger(__name__)
 
+# How long to wait for the backend, in seconds. For streamed commands this is measured
+# from the last message received, so a long generation doesn't time out while tokens keep arriving.
+RESPONSE_TIMEOUT = 10
+
 class IPCClient:
     """
     The ZMQ client that connects to the backend server.
     It sends user commands and state, and receives structured JSON responses.
+
+    Commands and events use separate DEALER sockets, so events can be sent at any time,
+    even while a command is waiting for its response. Cancellations go over the event
+    socket for the same reason.
     """
     def __init__(self):
-        
+
         self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.REQ)
-        # Set socket timeout to prevent indefinite hangs (10 second timeout)
-        self.socket.setsockopt(zmq.RCVTIMEO, 10000)
-        self.socket.setsockopt(zmq.SNDTIMEO, 10000)
         port = config.get('ipc.command_port', 5555)
-        self.socket.connect(f"tcp://localhost:{port}")
+        self.socket = self._connect(port)
+        self.event_socket = self._connect(port)
+        # ZMQ sockets are not thread-safe, so each socket is only used while holding its lock.
+        self.command_lock = threading.Lock()
+        self.event_lock = threading.Lock()
         self.is_running = False
+        # The id of the command waiting for its response, if any.
+        self.current_request_id = None
+
+    def _connect(self, port: int):
+        socket = self.context.socket(zmq.DEALER)
+        socket.setsockopt(zmq.SNDTIMEO, RESPONSE_TIMEOUT * 1000)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(f"tcp://localhost:{port}")
+        return socket
 
-    def send_command(self, command_text: str, state: str) -> Dict[str, Any] | None:
-        """Sends a command and state to the backend and returns the response dictionary."""
+    def _receive_response(self, request_id: str, on_partial: Callable[[str], None] | None) -> Dict[str, Any]:
+        """
+        Waits for the response to the given request, passing any partial responses to `on_partial`.
+        Messages for earlier requests that timed out are discarded.
+        """
+        deadline = time.monotonic() + RESPONSE_TIMEOUT
+        while True:
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0 or not self.socket.poll(remaining_ms):
+                raise zmq.error.Again()
+            _delimiter, message_json = self.socket.recv_multipart()
+            log.debug(f"Received message from backend: {message_json}")
+            message = json.loads(message_json)
+            if message.get("request_id") != request_id:
+                log.debug("Discarding a message for an earlier request.")
+                continue
+
+            if message.get("type") == LLM_PARTIAL_RESPONSE:
+                deadline = time.monotonic() + RESPONSE_TIMEOUT
+                if on_partial:
+                    on_partial(message.get("token", ""))
+            elif message.get("type") == MSG_RESPONSE:
+                return message.get("response")
+
+    def send_command(self, command_text: str, state: str, on_partial: Callable[[str], None] | None = None, partial: bool = False) -> Dict[str, Any] | None:
+        """
+        Sends a command and state to the backend and returns the response dictionary.
+        If `on_partial` is given, the response is streamed and each generated token is
+        passed to it before the final response dictionary is returned.
+        If `partial` is True, the command is a partial transcript: the backend only handles it if
+        it matches a command that doesn't need the LLM, and marks that response with "partial".
+        """
         if not self.is_running:
             log.warning("IPC client is not running. Cannot send command.")
             return None
@@ -33,21 +84,26 @@ class IPCClient:
         if not command_text:
             return None
 
+        request_id = uuid.uuid4().hex
         try:
-            request_data = {"type": "command", "payload": {"text": command_text, "state": state}}
+            request_data = {"type": "command", "request_id": request_id, "payload": {"text": command_text, "state": state, "partial": partial}}
+            if on_partial:
+                request_data["stream"] = True
             request_json = json.dumps(request_data)
-            log.debug(f"Sending request to backend: {request_json}")
-            self.socket.send_string(request_json)
-            
-            response_json = self.socket.recv_string()
-            log.debug(f"Received response from backend: {response_json}")
-            
-            response_dict = json.loads(response_json)
-            return response_dict
+            with self.command_lock:
+                log.debug(f"Sending request to backend: {request_json}")
+                self.socket.send_multipart([b"", request_json.encode('utf-8')])
+                self.current_request_id = request_id
+                try:
+                    return self._receive_response(request_id, on_partial)
+                finally:
+                    self.current_request_id = None
 
         except zmq.error.Again:
-            # Timeout occurred (socket.RCVTIMEO or SNDTIMEO exceeded)
-            log.error("IPC timeout: Backend did not respond within 10 seconds. Backend may be unresponsive.")
+            # Timeout occurred (no response or send not possible within the timeout)
+            log.error(f"IPC timeout: Backend did not respond within {RESPONSE_TIMEOUT} seconds. Backend may be unresponsive.")
+            # Nobody is waiting for the answer anymore, so don't let it hold up the next command.
+            self.cancel(request_id)
             return {"action": "COMMAND", "speak": "I'm taking too long to think. Please try again."}
         except zmq.ZMQError as e:
             log.error(f"ZMQ error while communicating with backend: {e}")
@@ -57,8 +113,27 @@ class IPCClient:
             log.error(f"Unexpected error in IPC client: {e}", exc_info=True)
             return {"action": "COMMAND", "speak": "I've encountered an unexpected error."}
 
+    def cancel(self, request_id: str | None = None):
+        """
+        Asks the backend to stop working on a command, by default the one waiting for its
+        response. The waiting `send_command` call then returns {"cancelled": True}.
+        """
+        request_id = request_id or self.current_request_id
+        if not self.is_running or request_id is None:
+            return
+
+        try:
+            request_json = json.dumps({"type": MSG_CANCEL, "request_id": request_id})
+            with self.event_lock:
+                self.event_socket.send_multipart([b"", request_json.encode('utf-8')], flags=zmq.NOBLOCK)
+            log.info(f"Cancelling request '{request_id}'.")
+        except zmq.error.Again:
+            log.warning(f"Backend is not accepting messages. Could not cancel request '{request_id}'.")
+        except zmq.ZMQError as e:
+            log.error(f"ZMQ error while cancelling a request: {e}")
+
     def send_event(self, event_type: str, payload: dict):
-        """Sends an event to the backend for broadcasting."""
+        """Sends an event to the backend for broadcasting. Events are not acknowledged."""
         if not self.is_running:
             log.warning("IPC client is not running. Cannot send event.")
             return
@@ -66,9 +141,10 @@ class IPCClient:
         try:
             request_data = {"type": "event", "event_type": event_type, "payload": payload}
             request_json = json.dumps(request_data)
-            self.socket.send_string(request_json)
-            # Wait for the empty ack from the server
-            self.socket.recv_string()
+            with self.event_lock:
+                self.event_socket.send_multipart([b"", request_json.encode('utf-8')], flags=zmq.NOBLOCK)
+        except zmq.error.Again:
+            log.warning(f"Backend is not accepting events. Dropped event '{event_type}'.")
         except zmq.ZMQError as e:
             log.error(f"ZMQ error while sending event to backend: {e}")
         except Exception as e:
@@ -87,6 +163,8 @@ class IPCClient:
         log.info("Stopping IPC client...")
         self.is_running = False
         # ZMQ sockets should be closed before terminating the context
-        self.socket.close()
+        with self.command_lock, self.event_lock:
+            self.socket.close()
+            self.event_socket.close()
         self.context.term()
-        log.info("IPC Client stopped.")
\ No newline at end of file
+        log.info("IPC Client stopped.")
@@ -3,6 +3,13 @@
 # Event Bus Message Types
 INIT_STATUS_UPDATE = "init_status_update"
 
+# Command Channel Message Types (sent from the backend to the client that sent the command)
+MSG_RESPONSE = "response"                    # The final response. Fields: request_id, response
+LLM_PARTIAL_RESPONSE = "llm_partial_response" # Partial LLM output for a streamed command. Fields: request_id, token
+
+# Command Channel Message Types (sent from a client to the backend)
+MSG_CANCEL = "cancel"                        # Stops the work for an earlier command, which gets the response {"cancelled": True}. Fields: request_id
+
 # Assistant States
 STATE_DORMANT = "DORMANT"
 STATE_LISTENING = "LISTENING"
@@ -2,13 +2,18 @@ import json
 import zmq
 import logging
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from aist.core.conversation import ConversationManager
 from aist.core.config_manager import config
 from aist.core.log_setup import console_log, Colors
-from aist.core.ipc.protocol import STATE_DORMANT
-from aist.skills.dispatcher import command_dispatcher # type: ignore
-from aist.core.llm import initialize_llm
+from aist.core.ipc.protocol import STATE_DORMANT, STATE_LISTENING, MSG_RESPONSE, LLM_PARTIAL_RESPONSE, MSG_CANCEL
+from aist.skills.dispatcher import command_dispatcher, match_quick_command, prime_router # type: ignore
+from aist.core.llm import initialize_llm, llm_lock, chat_history_cache, summarize_conversation, CancellationToken, GenerationCancelled, cancellation_scope, check_cancelled
+from aist.core.memory import initialize_memory_store, start_memory_maintenance, close_memory_store
+from aist.core.decision_cache import initialize_decision_cache, close_decision_cache
 from aist.skills.skill_loader import initialize_skill_manager
+from aist.skills.worker_pool import initialize_skill_worker_pool
 
 log = logging.getLogger(__name__)
 
@@ -16,18 +21,59 @@ class IPCServer:
     """
     The ZMQ server that listens for frontend requests.
     It processes commands using the skill dispatcher and returns JSON responses.
+
+    A ROUTER socket accepts requests from any number of DEALER clients. Events are broadcast
+    straight from the socket thread, while commands run on worker threads. Each client is
+    always served by the same worker, so its commands are handled in order, and a long LLM
+    generation never delays events or other clients.
+
+    Every command gets a cancellation token with a deadline. A cancel message (or the
+    deadline passing) stops its LLM work within a token or a prompt chunk, so an abandoned
+    request doesn't keep the model busy for the next one.
     """
+    REPLY_ENDPOINT = "inproc://ipc-server-replies"
+
     def __init__(self, event_broadcaster):
         self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.REP)
+        self.socket = self.context.socket(zmq.ROUTER)
         port = config.get('ipc.command_port', 5555)
         self.socket.bind(f"tcp://*:{port}")
+        # Workers can't use the ROUTER socket themselves (ZMQ sockets are not thread-safe),
+        # so they push their replies here and the socket thread forwards them.
+        self.reply_socket = self.context.socket(zmq.PULL)
+        self.reply_socket.bind(self.REPLY_ENDPOINT)
+        self._worker_sockets = threading.local()
+        self._all_worker_sockets = []
+        self._worker_sockets_lock = threading.Lock()
+        self.workers = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"ipc-worker-{i}")
+            for i in range(max(1, config.get('ipc.worker_threads', 2)))
+        ]
+        # Summarizes old conversation turns in the background, off the command workers, once no
+        # command has arrived for `summary_idle_seconds`. A command that arrives while it runs
+        # cancels it through `_summary_token`, so it never holds the LLM lock a command needs.
+        self.summary_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-summarizer")
+        self.summary_idle_seconds = config.get('assistant.summary.idle_seconds', 5)
+        self._summary_token = None
+        self._summary_scheduled = False
+        self._summary_lock = threading.Lock()
+        self._last_command = time.monotonic()
+        self._stopping = threading.Event()
+        # Cancellation tokens of the commands that are queued or running, by request id.
+        self._requests = {}
+        self._requests_lock = threading.Lock()
+        self.request_deadline = config.get('models.llm.request_deadline', 60)
         self.is_running = False
         self.thread = None
         self.llm = None
         self.conversation_manager = ConversationManager()
         self.event_broadcaster = event_broadcaster # Store the broadcaster
-        initialize_skill_manager(event_broadcaster)
+        initialize_memory_store()
+        start_memory_maintenance()
+        skill_manager = initialize_skill_manager(event_broadcaster)
+        # Start the skill workers now so the first skill call doesn't pay for process startup.
+        self.skill_worker_pool = initialize_skill_worker_pool(list(skill_manager.skills))
+        initialize_decision_cache()
 
     def start(self):
         """Starts the IPC server and attempts to load the LLM model."""
@@ -36,6 +82,9 @@ class IPCServer:
         self.llm = initialize_llm(event_broadcaster=self.event_broadcaster)
         if self.llm is None:
             log.warning("Failed to initialize LLM. AI-based skills will be disabled.")
+        else:
+            # Count the history's tokens with the model's own tokenizer.
+            self.conversation_manager.token_counter = lambda text: len(self.llm.tokenize(text, add_bos_token=False))
         
         self.is_running = True
         self.thread = threading.Thread(target=self._serve_forever, daemon=False)
@@ -44,72 +93,236 @@ class IPCServer:
         console_log(f"IPC Server started and listening on tcp://*:{port}", prefix="INIT", color=Colors.GREEN)
         return True
 
+    def _send_reply(self, identity: bytes, message: dict):
+        """Queues a message for a client. Safe to call from any worker thread."""
+        socket = getattr(self._worker_sockets, "socket", None)
+        if socket is None:
+            socket = self.context.socket(zmq.PUSH)
+            socket.connect(self.REPLY_ENDPOINT)
+            self._worker_sockets.socket = socket
+            with self._worker_sockets_lock:
+                self._all_worker_sockets.append(socket)
+        socket.send_multipart([identity, json.dumps(message).encode('utf-8')])
+
     def _serve_forever(self):
         poller = zmq.Poller()
         poller.register(self.socket, zmq.POLLIN)
+        poller.register(self.reply_socket, zmq.POLLIN)
 
         while self.is_running:
             try:
                 socks = dict(poller.poll(100))
-                if self.socket in socks and socks[self.socket] == zmq.POLLIN:
+                if self.reply_socket in socks:
+                    identity, message = self.reply_socket.recv_multipart()
+                    self.socket.send_multipart([identity, b"", message])
+
+                if self.socket in socks:
+                    identity, _delimiter, message = self.socket.recv_multipart()
                     try:
-                        message = self.socket.recv_string()
                         request = json.loads(message)
                     except json.JSONDecodeError:
                         log.error(f"Failed to decode JSON from request: {message}")
-                        self.socket.send_string(json.dumps({"error": "Invalid JSON format"}))
+                        self.socket.send_multipart([identity, b"", json.dumps({"error": "Invalid JSON format"}).encode('utf-8')])
                         continue
 
                     request_type = request.get("type", "command")
 
+                    # Events take the fast path: they are broadcast right away and never wait for a command.
                     if request_type == "event":
                         event_type = request.get("event_type")
                         payload = request.get("payload")
                         if event_type and payload:
                             self.event_broadcaster.broadcast(event_type, payload)
-                        self.socket.send_string(json.dumps({}))
                         continue
 
-                    command_text = request.get("payload", {}).get("text", "")
-                    state = request.get("payload", {}).get("state", STATE_DORMANT)
-
-                    if command_text == "__AIST_CLEAR_CONVERSATION__":
-                        log.info("Received special command to clear conversation history.")
-                        self.conversation_manager.clear()
-                        self.socket.send_string(json.dumps({}))
+                    # So do cancellations, which may come from another socket than the command.
+                    if request_type == MSG_CANCEL:
+                        self._cancel_request(request.get("request_id"))
                         continue
 
-                    console_log(f"'{command_text}' (State: {state})", prefix="RECV", color=Colors.CYAN)
+                    self._yield_background_work()
+                    deadline = time.monotonic() + self.request_deadline if self.request_deadline else None
+                    token = CancellationToken(deadline)
+                    with self._requests_lock:
+                        self._requests[request.get("request_id")] = token
+                    worker = self.workers[hash(identity) % len(self.workers)]
+                    worker.submit(self._handle_command, identity, request, token)
+            except Exception as e:
+                log.error(f"Error in IPC server loop: {e}", exc_info=True)
+
+    def _cancel_request(self, request_id: str | None):
+        """Cancels a queued or running command. Called from the socket thread."""
+        with self._requests_lock:
+            token = self._requests.get(request_id)
+        if token is None:
+            log.debug(f"Nothing to cancel for request '{request_id}'.")
+            return
+        log.info(f"Cancelling request '{request_id}'.")
+        token.cancel()
 
-                    if self.llm is None:
-                        log.warning("LLM is not available. Responding with an error message.")
-                        response = {
-                            "action": "COMMAND",
-                            "speak": "The Artificial Intelligence model is not available. Please check the logs for more details.",
-                            "intent": {"name": "llm_unavailable", "confidence": 100}
-                        }
-                        self.socket.send_string(json.dumps(response))
-                        continue
+    def _handle_command(self, identity: bytes, request: dict, token: CancellationToken | None = None):
+        """Processes a command request on a worker thread and replies to the client."""
+        request_id = request.get("request_id")
+        def reply(response: dict):
+            self._send_reply(identity, {"type": MSG_RESPONSE, "request_id": request_id, "response": response})
 
-                    self.conversation_manager.add_message(role="user", text=command_text)
-                    history = self.conversation_manager.get_history()
+        try:
+            with cancellation_scope(token):
+                self._process_command(identity, request, reply)
+        except GenerationCancelled as e:
+            log.info(f"Request '{request_id}' stopped: {e}")
+            if e.reason == "timed out":
+                reply({"action": "COMMAND", "speak": "I'm taking too long to think. Please try again."})
+            else:
+                reply({"cancelled": True})
+        finally:
+            with self._requests_lock:
+                self._requests.pop(request_id, None)
+            # The idle period before a background summary starts when the command is done.
+            self._last_command = time.monotonic()
 
-                    response = command_dispatcher(command_text, state, self.llm, history)
-                    
-                    if response is None:
-                        response = {}
+    def _process_command(self, identity: bytes, request: dict, reply):
+        """Runs a command through the dispatcher and sends its response with `reply`."""
+        request_id = request.get("request_id")
+        try:
+            # A command that was cancelled while it was queued is not run at all.
+            check_cancelled()
+            command_text = request.get("payload", {}).get("text", "")
+            state = request.get("payload", {}).get("state", STATE_DORMANT)
+            partial = request.get("payload", {}).get("partial", False)
 
-                    speak_text = response.get("speak") if response else None
-                    console_log(f"Action: {response.get('action') if response else 'None'}, Speak: '{speak_text or 'None'}'", prefix="SEND", color=Colors.MAGENTA)
-                    response_json = json.dumps(response)
-                    self.socket.send_string(response_json)
+            if command_text == "__AIST_CLEAR_CONVERSATION__":
+                log.info("Received special command to clear conversation history.")
+                self.conversation_manager.clear()
+                # Like every other change to the cache, under the LLM lock, so it can't interleave
+                # with a prompt being built on another thread.
+                with llm_lock:
+                    chat_history_cache.reset()
+                reply({})
+                return
 
-                    if speak_text:
-                        self.conversation_manager.add_message(role="assistant", text=speak_text)
-            except Exception as e:
-                log.error(f"Error processing request: {e}", exc_info=True)
-                error_response = {"action": "COMMAND", "speak": "An error occurred processing your request."}
-                self.socket.send_string(json.dumps(error_response))
+            if partial:
+                self._process_partial_command(command_text, state, reply)
+                return
+
+            console_log(f"'{command_text}' (State: {state})", prefix="RECV", color=Colors.CYAN)
+
+            if self.llm is None:
+                log.warning("LLM is not available. Responding with an error message.")
+                reply({
+                    "action": "COMMAND",
+                    "speak": "The Artificial Intelligence model is not available. Please check the logs for more details.",
+                    "intent": {"name": "llm_unavailable", "confidence": 100}
+                })
+                return
+
+            self.conversation_manager.add_message(role="user", text=command_text)
+            history = self.conversation_manager.get_history()
+
+            # Streamed commands get their tokens sent to the client as partial-response frames.
+            on_token = None
+            if request.get("stream"):
+                on_token = lambda token: self._send_reply(identity, {"type": LLM_PARTIAL_RESPONSE, "request_id": request_id, "token": token})
+
+            response = command_dispatcher(command_text, state, self.llm, history, on_token=on_token)
+            
+            if response is None:
+                response = {}
+
+            speak_text = response.get("speak") if response else None
+            console_log(f"Action: {response.get('action') if response else 'None'}, Speak: '{speak_text or 'None'}'", prefix="SEND", color=Colors.MAGENTA)
+            reply(response)
+
+            if speak_text:
+                self.conversation_manager.add_message(role="assistant", text=speak_text)
+
+            # The reply has been sent, so use the time the user spends listening to it
+            # to compress old turns if the history is near its limit, and to evaluate the
+            # router prompt up to the next command if a chat response replaced it.
+            if self.conversation_manager.needs_summary():
+                self._schedule_summary(state == STATE_LISTENING)
+            elif state == STATE_LISTENING:
+                prime_router(self.llm, self.conversation_manager.get_history())
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            log.error(f"Error processing request: {e}", exc_info=True)
+            reply({"action": "COMMAND", "speak": "An error occurred processing your request."})
+
+    def _process_partial_command(self, command_text: str, state: str, reply):
+        """
+        Answers a partial transcript, sent while the user is still speaking, if it already matches
+        a command that doesn't need the LLM. Otherwise the reply is empty and nothing is recorded,
+        and the command is handled once its final transcript arrives.
+        """
+        response = match_quick_command(command_text, state, self.llm, partial=True) if self.llm is not None else None
+        if not response:
+            reply({})
+            return
+
+        response["partial"] = True
+        speak_text = response.get("speak")
+        console_log(f"'{command_text}' (State: {state}, partial)", prefix="RECV", color=Colors.CYAN)
+        console_log(f"Action: {response.get('action')}, Speak: '{speak_text or 'None'}'", prefix="SEND", color=Colors.MAGENTA)
+        reply(response)
+
+        self.conversation_manager.add_message(role="user", text=command_text)
+        if speak_text:
+            self.conversation_manager.add_message(role="assistant", text=speak_text)
+        if self.conversation_manager.needs_summary():
+            self._schedule_summary(state == STATE_LISTENING)
+        elif state == STATE_LISTENING:
+            prime_router(self.llm, self.conversation_manager.get_history())
+
+    def _yield_background_work(self):
+        """Stops the background summary, if one is running, for a command that just arrived. Called from the socket thread."""
+        self._last_command = time.monotonic()
+        token = self._summary_token
+        if token is not None:
+            token.cancel("a command arrived")
+
+    def _schedule_summary(self, prime: bool):
+        """Queues a summary of the conversation for the next idle period, unless one is already queued."""
+        with self._summary_lock:
+            if self._summary_scheduled:
+                return
+            self._summary_scheduled = True
+        self.summary_worker.submit(self._summarize_conversation, prime)
+
+    def _summarize_conversation(self, prime: bool):
+        """
+        Waits until no command has arrived for `summary_idle_seconds` and none is running, then
+        folds old turns into the conversation summary and primes the router if asked to. If a
+        command arrives meanwhile, it is stopped and tried again at the next idle period.
+        """
+        try:
+            while not self._stopping.is_set() and self.conversation_manager.needs_summary():
+                with self._requests_lock:
+                    busy = bool(self._requests)
+                remaining = self.summary_idle_seconds - (time.monotonic() - self._last_command)
+                if busy or remaining > 0:
+                    self._stopping.wait(max(remaining, 0.1))
+                    continue
+                token = CancellationToken()
+                self._summary_token = token
+                # A command that arrived before the token was published couldn't cancel it.
+                if time.monotonic() - self._last_command < self.summary_idle_seconds:
+                    continue
+                with cancellation_scope(token):
+                    self.conversation_manager.summarize(lambda summary, messages, max_tokens: summarize_conversation(self.llm, summary, messages, max_tokens))
+                    if prime and not token.is_cancelled():
+                        prime_router(self.llm, self.conversation_manager.get_history())
+                if not token.is_cancelled():
+                    break
+                log.debug("Conversation summary yielded to a command. It will be retried when the assistant is idle.")
+        except GenerationCancelled:
+            pass
+        except Exception as e:
+            log.error(f"Error summarizing the conversation: {e}", exc_info=True)
+        finally:
+            self._summary_token = None
+            with self._summary_lock:
+                self._summary_scheduled = False
 
     def stop(self):
         """Stops the IPC server gracefully."""
@@ -117,9 +330,23 @@ class IPCServer:
         self.is_running = False
         if self.thread:
             self.thread.join()
+        # Stop any generation in progress instead of waiting for it.
+        self._stopping.set()
+        token = self._summary_token
+        if token is not None:
+            token.cancel()
+        with self._requests_lock:
+            for token in self._requests.values():
+                token.cancel()
+        for worker in self.workers:
+            worker.shutdown(wait=True, cancel_futures=True)
+        self.summary_worker.shutdown(wait=True, cancel_futures=True)
+        self.skill_worker_pool.shutdown()
+        close_memory_store()
+        close_decision_cache()
+        for socket in self._all_worker_sockets:
+            socket.close()
+        self.reply_socket.close()
         self.socket.close()
         self.context.term()
         log.info("IPC Server stopped.")
-
-
-
@@ -1,14 +1,78 @@
 # core/llm.py - Large Language Model Interaction
 
+import contextlib
+import contextvars
+import json
 import logging
 import os
+import threading
+import time
+import numpy as np
 from ctransformers import AutoModelForCausalLM
+from ctransformers.utils import utf8_split_incomplete
 from huggingface_hub.errors import RepositoryNotFoundError
 from aist.core.config_manager import config
+from aist.core.conversation import PromptBudget, SUMMARY_ROLE, format_message
 from aist.core.ipc.protocol import INIT_STATUS_UPDATE
 
 log = logging.getLogger(__name__)
 
+# The model is not thread-safe and keeps state between calls (its evaluated context),
+# so every use of it must hold this lock.
+llm_lock = threading.RLock()
+
+# Prompts are evaluated this many tokens at a time, so a cancelled request stops within one chunk.
+_EVAL_CHUNK_TOKENS = 32
+
+class GenerationCancelled(Exception):
+    """Raised inside LLM generation when its request was cancelled or ran past its deadline."""
+    def __init__(self, reason: str):
+        super().__init__(f"Generation {reason}.")
+        self.reason = reason
+
+class CancellationToken:
+    """
+    Cancels the LLM work of one request, on demand or once its deadline (a time.monotonic()
+    timestamp) has passed. Generation checks the token between tokens and prompt chunks.
+    """
+    def __init__(self, deadline: float | None = None):
+        self.deadline = deadline
+        self.reason = None
+        self._cancelled = threading.Event()
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        if not self._cancelled.is_set() and self.deadline is not None and time.monotonic() > self.deadline:
+            self.cancel("timed out")
+        return self._cancelled.is_set()
+
+    def check(self):
+        """Raises GenerationCancelled if the token was cancelled."""
+        if self.is_cancelled():
+            raise GenerationCancelled(self.reason)
+
+# The token of the request being handled on the current thread, if any.
+_current_cancellation = contextvars.ContextVar("llm_cancellation", default=None)
+
+@contextlib.contextmanager
+def cancellation_scope(token: CancellationToken | None):
+    """Makes `token` cancel the LLM calls made on this thread inside the block."""
+    reset_token = _current_cancellation.set(token)
+    try:
+        yield token
+    finally:
+        _current_cancellation.reset(reset_token)
+
+def check_cancelled():
+    """Raises GenerationCancelled if the current request was cancelled."""
+    token = _current_cancellation.get()
+    if token is not None:
+        token.check()
+
 def initialize_llm(event_broadcaster):
     """Loads the Local AI Model."""
     log.info("Loading local AI model. This can take several minutes on the first run...")
@@ -69,53 +133,201 @@ def initialize_llm(event_broadcaster):
         event_broadcaster.broadcast(INIT_STATUS_UPDATE, {"component": "llm", "status": "failed", "error": str(e)})
         return None
 
-def _format_history(history: list[tuple[str, str]]) -> str:
-    """Formats the conversation history for the LLM prompt."""
-    if not history:
-        return ""
-    # Format for Mistral Instruct model
-    formatted = "<s>"
-    for role, content in history:
-        if role == 'user':
-            formatted += f"[INST] {content} [/INST]"
-        else:
-            formatted += f"{content}</s>"
-    return formatted
+def _message_parts(message) -> tuple[str, str]:
+    """Returns the role and content of a history message, given as a dict or a (role, content) tuple."""
+    if isinstance(message, dict):
+        return message.get("role"), message.get("content", "")
+    return message
+
+# The prompt budget only depends on the config, so it is computed once.
+_prompt_budget = None
+
+def _get_prompt_budget() -> PromptBudget:
+    global _prompt_budget
+    if _prompt_budget is None:
+        _prompt_budget = PromptBudget.from_config()
+    return _prompt_budget
+
+def _count_tokens(llm, text: str) -> int:
+    return len(llm.tokenize(text, add_bos_token=False))
+
+def _fit_text(llm, text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """Cuts the text to at most `max_tokens` tokens, keeping its start, or its end with `keep_end`."""
+    tokens = llm.tokenize(text, add_bos_token=False)
+    if len(tokens) <= max_tokens:
+        return text
+    log.warning(f"Cutting text of {len(tokens)} tokens to the prompt budget of {max_tokens} tokens.")
+    return llm.detokenize(tokens[-max_tokens:] if keep_end and max_tokens > 0 else tokens[:max_tokens])
+
+def _chat_instruction(facts: list[str], query: str) -> str:
+    """Returns the instruction of a conversational prompt: the relevant facts and the user's query."""
+    facts_str = ""
+    if facts:
+        facts_str = "You have the following relevant information from your memory to help you answer:\n- " + "\n- ".join(facts) + "\n"
+    return f'[INST] {facts_str}Based on the conversation history and the provided information, answer the following user query. Be concise and direct. User query: {query} [/INST]'
+
+def fit_to_prompt(llm, prompt: str, text: str, keep_end: bool = False) -> str:
+    """
+    Returns the prompt with '{text}' replaced by the text, cut (keeping its start, or its end
+    with `keep_end`) so the prompt fits in the prompt budget when it is sent as the command of
+    `process_with_llm` with `fit_command=False`. The rest of the prompt is always kept whole.
+    """
+    overhead = _count_tokens(llm, _chat_instruction([], prompt.replace("{text}", ""))) + 1 # The BOS token.
+    return prompt.replace("{text}", _fit_text(llm, text, max(0, _get_prompt_budget().total - overhead), keep_end))
+
+def _fit_facts(llm, facts: list[str], max_tokens: int) -> list[str]:
+    """Returns the most relevant facts that fit in `max_tokens`."""
+    kept = []
+    used = 0
+    for fact in facts:
+        tokens = _count_tokens(llm, fact) + 2 # The "- " bullet and newline.
+        if used + tokens > max_tokens:
+            break
+        kept.append(fact)
+        used += tokens
+    return kept
+
+def _history_messages(conversation_history: list, command: str) -> list[tuple[str, str]]:
+    """Returns the (role, content) of the history messages, without the current command if the history already ends with it."""
+    history = [_message_parts(message) for message in conversation_history or []]
+    if history and history[-1] == ("user", command):
+        history = history[:-1]
+    return history
 
-def process_with_llm(llm, command, conversation_history, relevant_facts, system_prompt_override=None):
+class ChatHistoryCache:
+    """
+    Assembles chat prompts from a stable token layout, so consecutive turns share a prefix.
+
+    ctransformers only evaluates what follows the longest common prefix of a new prompt and
+    the tokens it evaluated last. Each history message is tokenized once, and the prompt is
+    built from those tokens, so a turn that only appends messages starts with exactly the
+    tokens of the previous turn's history and reuses them while the context still holds them.
+
+    Trimming the history to the budget moves the start of the prompt, which invalidates the
+    whole prefix. So when the history doesn't fit, it is trimmed to `low_watermark` of the
+    budget, and later turns keep the same first message for as long as it fits.
+    """
+    def __init__(self, low_watermark: float = 0.75):
+        self.low_watermark = low_watermark
+        self.segments = {}
+        self.start = None
+        self.last_prompt_tokens = 0
+        self.last_reused_tokens = 0
+
+    def reset(self):
+        """Forgets the history, e.g. when the conversation is cleared."""
+        self.segments = {}
+        self.start = None
+
+    def _segment(self, llm, message: tuple[str, str]) -> list[int]:
+        tokens = self.segments.get(message)
+        if tokens is None:
+            tokens = llm.tokenize(format_message(*message), add_bos_token=False)
+            self.segments[message] = tokens
+        return tokens
+
+    def _fit(self, llm, messages: list[tuple[str, str]], max_tokens: int) -> list[tuple[str, str]]:
+        sizes = [len(self._segment(llm, message)) for message in messages]
+        if sum(sizes) <= max_tokens:
+            return messages
+        # Keep the first message of the last trimmed history while everything after it fits.
+        if self.start in messages:
+            index = messages.index(self.start)
+            if sum(sizes[index:]) <= max_tokens:
+                return messages[index:]
+        used = 0
+        index = len(messages)
+        while index > 0 and used + sizes[index - 1] <= max_tokens * self.low_watermark:
+            index -= 1
+            used += sizes[index]
+        # Start with a whole exchange rather than a response.
+        while index < len(messages) and messages[index][0] == "assistant":
+            index += 1
+        if index < len(messages):
+            self.start = messages[index]
+        log.debug(f"Trimmed the chat history to {len(messages) - index} of {len(messages)} messages.")
+        return messages[index:]
+
+    def build(self, llm, messages: list[tuple[str, str]], instruction: str, max_tokens: int) -> list[int]:
+        """
+        Returns the prompt tokens for the history messages followed by the instruction,
+        trimming the oldest messages so the prompt fits in `max_tokens`.
+        """
+        instruction_tokens = llm.tokenize(instruction, add_bos_token=False)
+        head = llm.tokenize("<s>")
+        kept = self._fit(llm, messages, max_tokens - len(head) - len(instruction_tokens))
+        # Only the current messages stay cached, so trimmed and cleared messages are forgotten.
+        self.segments = {message: self.segments[message] for message in messages if message in self.segments}
+        if not kept:
+            return llm.tokenize(instruction)
+        tokens = list(head)
+        for message in kept:
+            tokens.extend(self._segment(llm, message))
+        tokens.extend(instruction_tokens)
+        return tokens
+
+    def record_reuse(self, llm, tokens: list[int]):
+        """Records how many of the prompt tokens the model's context already holds."""
+        # ctransformers does not expose the evaluated tokens publicly.
+        context = getattr(llm, "_context", None) or []
+        reused = 0
+        for context_token, token in zip(context, tokens):
+            if context_token != token:
+                break
+            reused += 1
+        self.last_prompt_tokens = len(tokens)
+        self.last_reused_tokens = min(reused, len(tokens) - 1)
+
+# Shared cache for the conversational chat prompts.
+chat_history_cache = ChatHistoryCache()
+
+def process_with_llm(llm, command, conversation_history, relevant_facts, system_prompt_override=None, stream=False, fit_command=True):
     """
     Sends a prompt to the LLM and gets a response.
     Can be used for general conversation or for structured tasks via a system_prompt_override.
+    If `stream` is True, a generator is returned that yields the response token by token
+    instead of the full response string.
+    The command is cut to its share of the prompt budget, unless `fit_command` is False because
+    it is a whole task prompt that the caller has already fitted (see `fit_to_prompt`).
     """
     if not command and not system_prompt_override:
-        return ""
+        return iter(()) if stream else ""
 
-    history_str = _format_history(conversation_history)
+    # The facts and the command are kept within their share of the prompt budget,
+    # and the history gets the rest, dropping the oldest messages first.
+    budget = _get_prompt_budget()
 
     # If a system prompt override is provided, it takes precedence.
     # This is used for structured tasks like skill selection.
     if system_prompt_override:
         # The system prompt contains the full instruction, including the user's command.
-        prompt = f"{history_str}[INST] {system_prompt_override} [/INST]"
+        instruction = f"[INST] {system_prompt_override} [/INST]"
         # For skill selection, we want a deterministic, low-creativity response.
         temperature = 0.0
         max_tokens = 256 # Should be enough for a JSON object
     else:
         # This is for regular, conversational chat.
-        facts_str = ""
-        if relevant_facts:
-            facts_str = "You have the following relevant information from your memory to help you answer:\n- " + "\n- ".join(relevant_facts) + "\n"
-        prompt = f'{history_str}[INST] {facts_str}Based on the conversation history and the provided information, answer the following user query. Be concise and direct. User query: {command} [/INST]'
+        query = _fit_text(llm, command, budget.reserved["command"]) if fit_command else command
+        facts = _fit_facts(llm, relevant_facts or [], budget.reserved["facts"])
+        instruction = _chat_instruction(facts, query)
         temperature = 0.7 # Standard temperature for creative/conversational responses
         max_tokens = config.get('models.llm.max_new_tokens', 150)
 
+    messages = _history_messages(conversation_history, command)
+    if stream:
+        return _stream_response(llm, messages, instruction, budget.total, max_tokens, temperature)
+
     try:
-        log.info("Sending prompt to LLM...")
-        # LLM inference with timeout awareness
-        # Note: ctransformers doesn't natively support timeouts, so we rely on config and monitoring
-        # For long-running inferences, consider using threading with timeout wrapper
-        response = llm(prompt, stream=False, max_new_tokens=max_tokens, temperature=temperature)
+        # ctransformers has no timeouts, so generation runs token by token and stops as soon
+        # as the request's cancellation token is cancelled or its deadline passes.
+        check_cancelled()
+        with llm_lock:
+            tokens = _prepare_prompt(llm, messages, instruction, budget.total)
+            log.info(f"Sending prompt to LLM ({len(tokens)} tokens, {chat_history_cache.last_reused_tokens} reused)...")
+            response = "".join(_generate_text(llm, tokens, max_tokens, temperature))
         return response
+    except GenerationCancelled:
+        raise
     except KeyboardInterrupt:
         log.warning("LLM inference interrupted by user.")
         return "I was interrupted while thinking."
@@ -123,6 +335,295 @@ def process_with_llm(llm, command, conversation_history, relevant_facts, system_
         log.error(f"Error during LLM processing: {e}", exc_info=True)
         return "I encountered an error while thinking."
 
+def _prepare_prompt(llm, messages, instruction, max_tokens) -> list[int]:
+    """Builds the prompt tokens from the chat history cache. The caller holds the llm lock."""
+    tokens = chat_history_cache.build(llm, messages, instruction, max_tokens)
+    chat_history_cache.record_reuse(llm, tokens)
+    return tokens
+
+def _eval_prompt(llm, tokens: list[int]):
+    """
+    Evaluates the part of the prompt the model's context doesn't hold yet, in chunks, checking
+    for cancellation between them. The caller holds the llm lock.
+    """
+    # Drops everything in the context after the common prefix and returns the rest.
+    remaining = llm.prepare_inputs_for_generation(tokens)
+    for start in range(0, len(remaining), _EVAL_CHUNK_TOKENS):
+        check_cancelled()
+        llm.eval(remaining[start:start + _EVAL_CHUNK_TOKENS])
+
+def _generate_tokens(llm, tokens: list[int], temperature: float):
+    """
+    Like ctransformers' `generate`, but checks for cancellation during prompt evaluation
+    and before every token. The caller holds the llm lock.
+    """
+    _eval_prompt(llm, tokens)
+    while True:
+        check_cancelled()
+        token = llm.sample(temperature=temperature)
+        llm.eval([token])
+        if llm.is_eos_token(token):
+            return
+        yield token
+
+def _generate_text(llm, tokens: list[int], max_tokens: int, temperature: float):
+    """Yields the text of the tokens generated for the prompt tokens. The caller holds the llm lock."""
+    incomplete = b""
+    for count, token in enumerate(_generate_tokens(llm, tokens, temperature), start=1):
+        # A character can span several tokens, so incomplete UTF-8 bytes wait for the next token.
+        incomplete += llm.detokenize([token], decode=False)
+        complete, incomplete = utf8_split_incomplete(incomplete)
+        if complete:
+            yield complete.decode(errors="ignore")
+        if count >= max_tokens:
+            break
+
+def _stream_response(llm, messages, instruction, max_prompt_tokens, max_tokens, temperature):
+    """Yields the LLM response token by token as it is generated."""
+    try:
+        check_cancelled()
+        with llm_lock:
+            tokens = _prepare_prompt(llm, messages, instruction, max_prompt_tokens)
+            log.info(f"Sending prompt to LLM (streaming, {len(tokens)} tokens, {chat_history_cache.last_reused_tokens} reused)...")
+            for token in _generate_text(llm, tokens, max_tokens, temperature):
+                yield token
+    except GenerationCancelled:
+        raise
+    except KeyboardInterrupt:
+        log.warning("LLM inference interrupted by user.")
+        yield "I was interrupted while thinking."
+    except Exception as e:
+        log.error(f"Error during LLM processing: {e}", exc_info=True)
+        yield "I encountered an error while thinking."
+
+class PromptPrefixCache:
+    """
+    Keeps a static prompt prefix (like the skill router's preamble) evaluated in the model's context.
+
+    ctransformers reuses the longest common prefix between a new prompt and the tokens it
+    evaluated last, so a prompt that starts with the cached prefix only needs its suffix
+    evaluated. The prefix is tokenized once per key, and `prime` re-evaluates it after other
+    prompts (e.g. chat) have replaced it in the context, together with the start of the
+    next suffix when it is already known.
+    """
+    def __init__(self):
+        self.key = None
+        self.tokens = []
+
+    def get_tokens(self, llm, key, prefix: str) -> list[int]:
+        """Returns the tokens of the prefix, tokenizing it only when the key changes."""
+        if key != self.key:
+            self.tokens = llm.tokenize(prefix)
+            self.key = key
+            log.info(f"Prompt prefix cache updated (key: {key}, {len(self.tokens)} tokens).")
+        return self.tokens
+
+    def is_evaluated(self, llm) -> bool:
+        """Checks whether the model's context still starts with the cached prefix."""
+        # ctransformers does not expose the evaluated tokens publicly.
+        context = getattr(llm, "_context", None)
+        n = len(self.tokens)
+        return context is not None and n > 0 and len(context) >= n and list(context[:n]) == self.tokens
+
+    def prime(self, llm, suffix: str = ""):
+        """
+        Evaluates the cached prefix, followed by `suffix`, now so the next prompt that
+        starts with them is cheaper.
+        """
+        if llm is None or not self.tokens:
+            return
+        try:
+            start = time.perf_counter()
+            with llm_lock:
+                tokens = self.tokens + (llm.tokenize(suffix, add_bos_token=False) if suffix else [])
+                context = getattr(llm, "_context", None)
+                if context is not None and len(context) >= len(tokens) and list(context[:len(tokens)]) == tokens:
+                    return
+                _eval_prompt(llm, tokens)
+            log.debug(f"Primed prompt prefix ({len(tokens)} tokens in {time.perf_counter() - start:.2f}s).")
+        except GenerationCancelled:
+            log.debug("Priming the prompt prefix was cancelled.")
+        except Exception as e:
+            log.warning(f"Failed to prime the prompt prefix: {e}")
+
+# Shared cache for the skill router's static system prompt.
+router_prefix_cache = PromptPrefixCache()
+
+def process_with_cached_prefix(llm, prefix_key, prefix: str, suffix: str, max_tokens: int = 256, temperature: float = 0.0) -> str:
+    """
+    Generates a response for `prefix + suffix`, where the prefix is static for a given key.
+    The prefix is looked up in the router prefix cache, so only the suffix is evaluated
+    when the model's context still holds the prefix.
+    """
+    try:
+        check_cancelled()
+        with llm_lock:
+            prefix_tokens = router_prefix_cache.get_tokens(llm, prefix_key, prefix)
+            tokens = prefix_tokens + llm.tokenize(suffix, add_bos_token=False)
+            reused = router_prefix_cache.is_evaluated(llm)
+            log.info(f"Sending prompt to LLM ({len(tokens)} tokens, prefix {'reused' if reused else 'not cached'})...")
+            generated = []
+            for token in _generate_tokens(llm, tokens, temperature):
+                generated.append(token)
+                if len(generated) >= max_tokens:
+                    break
+            return llm.detokenize(generated)
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        log.error(f"Error during LLM processing: {e}", exc_info=True)
+        return "I encountered an error while thinking."
+
+class JSONSchemaDecoder:
+    """
+    Greedy, grammar-constrained decoding of a skill-router decision.
+
+    The output always has the form {"function": "<name>", "parameters": {"<param>": "<value>", ...}},
+    where <name> is one of the schema's function names and each <param> is one of the names
+    declared for that function. At each step only the tokens that keep the output valid are
+    considered, and decoding stops as soon as the object is closed.
+    """
+    # Caps the number of tokens generated for a single parameter value.
+    MAX_VALUE_TOKENS = 48
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.vocab = [llm.detokenize([i]) for i in range(llm.vocab_size)]
+        # Index the vocabulary by first character to quickly find tokens that continue a literal.
+        self.tokens_by_first_char = {}
+        for token_id, text in enumerate(self.vocab):
+            if text:
+                self.tokens_by_first_char.setdefault(text[0], []).append(token_id)
+        # Tokens allowed inside a string value, and tokens that close it.
+        is_plain = lambda text: not any(c in text for c in '"\\\n')
+        self.value_token_ids = np.array([i for i, t in enumerate(self.vocab) if t and is_plain(t)], dtype=np.int64)
+        self.closing_token_ids = np.array([i for i, t in enumerate(self.vocab) if t.endswith('"') and is_plain(t[:-1])], dtype=np.int64)
+
+    def _logits(self) -> np.ndarray:
+        logits = self.llm.logits
+        # Read the logits buffer in place when possible instead of copying them one by one.
+        data = getattr(logits, "_data", None)
+        if data is not None:
+            return np.ctypeslib.as_array(data, shape=(len(logits),))
+        return np.fromiter(logits, dtype=np.float32, count=len(logits))
+
+    def _best(self, token_ids) -> int:
+        token_ids = np.asarray(token_ids, dtype=np.int64)
+        return int(token_ids[np.argmax(self._logits()[token_ids])])
+
+    def _choose(self, candidates: list[str]) -> str:
+        """Generates exactly one of the candidate strings, which must be prefix-free."""
+        remaining = {candidate: candidate for candidate in candidates}
+        while True:
+            allowed = set()
+            for rest in remaining.values():
+                for token_id in self.tokens_by_first_char.get(rest[0], []):
+                    if rest.startswith(self.vocab[token_id]):
+                        allowed.add(token_id)
+            check_cancelled()
+            token_id = self._best(list(allowed))
+            text = self.vocab[token_id]
+            self.llm.eval([token_id])
+            remaining = {c: rest[len(text):] for c, rest in remaining.items() if rest.startswith(text)}
+            for candidate, rest in remaining.items():
+                if not rest:
+                    return candidate
+
+    def _string_value(self) -> str:
+        """Generates the contents of a JSON string, including its closing quote."""
+        candidates = np.concatenate([self.value_token_ids, self.closing_token_ids])
+        value = ""
+        for _ in range(self.MAX_VALUE_TOKENS):
+            check_cancelled()
+            token_id = self._best(candidates)
+            text = self.vocab[token_id]
+            self.llm.eval([token_id])
+            if text.endswith('"'):
+                return value + text[:-1]
+            value += text
+        self._choose(['"'])
+        return value
+
+    def decode(self, tokens: list[int], schema: dict[str, list[str]]) -> dict:
+        """
+        Evaluates the prompt tokens and decodes a decision that matches the schema,
+        a mapping of function names to their parameter names.
+        """
+        _eval_prompt(self.llm, tokens)
+
+        self._choose(['{"function": "'])
+        function = self._choose([f'{name}"' for name in schema])[:-1]
+        self._choose([', "parameters": {'])
+
+        params = {}
+        unused = list(schema[function])
+        while unused:
+            separator = ", " if params else ""
+            keys = {f'{separator}"{name}": "': name for name in unused}
+            choice = self._choose(list(keys) + ["}"])
+            if choice == "}":
+                break
+            name = keys[choice]
+            unused.remove(name)
+            params[name] = self._string_value().strip()
+        else:
+            self._choose(["}"])
+        self._choose(["}"])
+        return {"function": function, "parameters": params}
+
+# The decoder indexes the whole vocabulary, so it is built once per model.
+_schema_decoder = None
+
+def process_with_schema(llm, prefix_key, prefix: str, suffix: str, schema: dict[str, list[str]]) -> dict | None:
+    """
+    Like `process_with_cached_prefix`, but decodes a router decision constrained to the schema
+    and returns it as a dictionary. Returns None if constrained decoding is not possible.
+    """
+    global _schema_decoder
+    try:
+        check_cancelled()
+        with llm_lock:
+            if _schema_decoder is None or _schema_decoder.llm is not llm:
+                log.info("Building vocabulary index for constrained decoding...")
+                _schema_decoder = JSONSchemaDecoder(llm)
+            prefix_tokens = router_prefix_cache.get_tokens(llm, prefix_key, prefix)
+            tokens = prefix_tokens + llm.tokenize(suffix, add_bos_token=False)
+            log.info(f"Sending prompt to LLM for constrained decoding ({len(tokens)} tokens)...")
+            decision = _schema_decoder.decode(tokens, schema)
+        log.debug(f"Constrained decoding produced: {json.dumps(decision)}")
+        return decision
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        log.error(f"Error during constrained LLM decoding: {e}", exc_info=True)
+        return None
+
+def summarize_conversation(llm, summary: str | None, messages: list, max_tokens: int) -> str | None:
+    """
+    Returns a summary of the previous summary (if any) and the messages, in at most
+    `max_tokens` tokens, for the conversation manager's running summary.
+    """
+    conversation_text = "\n".join(f"{role}: {content}" for role, content in map(_message_parts, messages))
+    previous = f"The summary of the conversation so far:\n{summary}\n\n" if summary else ""
+    prompt = f"""[INST] {previous}The conversation continued with:
+{conversation_text}
+
+Write an updated summary of the whole conversation in a few sentences. Keep the names, facts, preferences and requests that later turns may refer to. Reply with the summary only. [/INST]"""
+    # The summary never needs more than its share of the history.
+    max_tokens = min(max_tokens, config.get('assistant.summary.max_tokens', 200))
+    try:
+        log.info(f"Summarizing {len(messages)} conversation messages...")
+        check_cancelled()
+        with llm_lock:
+            response = "".join(_generate_text(llm, llm.tokenize(prompt), max_tokens, 0.0))
+        return response.strip() or None
+    except GenerationCancelled as e:
+        log.info(f"Conversation summary stopped: {e}")
+        return None
+    except Exception as e:
+        log.error(f"Error during conversation summarization: {e}", exc_info=True)
+        return None
+
 def summarize_system_output(llm, original_user_command, system_output):
     """Asks the LLM to summarize raw system command output in a natural way."""
     if not system_output:
@@ -134,10 +635,12 @@ You are an AI assistant. Your job is to interpret raw command-line output and ex
 The user originally asked: "{original_user_command}"
 The following system output was generated to answer their question:
 --- SYSTEM OUTPUT ---
-{system_output}
+{{text}}
 --- END SYSTEM OUTPUT ---
 
 Now, summarize this output and answer the user's original question naturally. Do not mention that you ran a command.
 '''
     log.info("Summarizing system output...")
-    return process_with_llm(llm, prompt, [], []) # Process without history or facts for a clean summary
+    # Only the output is cut to fit, never the instructions around it.
+    prompt = fit_to_prompt(llm, prompt, system_output)
+    return process_with_llm(llm, prompt, [], [], fit_command=False) # Process without history or facts for a clean summary
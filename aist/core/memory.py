@@ -2,7 +2,17 @@
 import sqlite3
 import logging
 import os
+import queue
+import re
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from aist.core.config_manager import config
+from aist.core.embeddings import get_embedder
+from aist.core.vector_index import VectorIndex
+from rapidfuzz import fuzz, process
 
 log = logging.getLogger(__name__)
 
@@ -10,59 +20,777 @@ log = logging.getLogger(__name__)
 DB_FOLDER = "data/memory"
 DB_PATH = os.path.join(DB_FOLDER, "memory.db")
 
-def _initialize_db():
+# Statements are written once and reused, so sqlite3's per-connection statement cache
+# only has to prepare each of them once.
+_INSERT_FACT_SQL = "INSERT INTO general_facts (content, timestamp, source) VALUES (?, ?, ?)"
+_KEYWORD_SEARCH_SQL = "SELECT rowid FROM general_facts WHERE general_facts MATCH ? ORDER BY rank LIMIT ?"
+_UNEMBEDDED_FACTS_SQL = "SELECT rowid, content FROM general_facts WHERE rowid NOT IN (SELECT fact_id FROM fact_embeddings WHERE model = ?)"
+_FACTS_AFTER_SQL = "SELECT rowid, content FROM general_facts WHERE rowid > ?"
+_MAX_ROWID_SQL = "SELECT coalesce(max(rowid), 0) FROM general_facts"
+_INSERT_EMBEDDING_SQL = "INSERT OR REPLACE INTO fact_embeddings (fact_id, model, vector) VALUES (?, ?, ?)"
+_GET_GENERATION_SQL = "SELECT value FROM memory_meta WHERE key = 'generation'"
+_BUMP_GENERATION_SQL = "UPDATE memory_meta SET value = value + 1 WHERE key = 'generation'"
+
+# Common words that would make almost every fact a keyword match.
+_STOPWORDS = frozenset("""
+a about all am an and any are as at be been but by can could did do does for from had has have
+how i if in is it its me my no not of on or our so that the their them then there these they
+this to was we were what when where which who why will with would you your
+""".split())
+
+# How strongly the rank in each result list counts in reciprocal rank fusion. 60 is the usual choice.
+_RRF_K = 60
+
+def _fts_query(text: str) -> str:
     """
-    Ensures the database and the 'general_facts' FTS5 table exist and have the correct schema.
-    If an old, invalid table is found, it is dropped and recreated.
+    Turns free text into a safe FTS5 query that matches facts containing any of its words.
+    Each word is quoted, so punctuation and FTS5 operators in the text can't cause syntax errors.
     """
-    os.makedirs(DB_FOLDER, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    try:
-        # This query is a lightweight way to check if the table exists and is a valid FTS table.
-        # It will raise an OperationalError if 'general_facts' is a standard table.
-        cursor.execute("SELECT * FROM general_facts WHERE general_facts MATCH 'test';")
-    except sqlite3.OperationalError:
-        log.warning("Memory database has an outdated schema. Recreating the 'general_facts' table...")
-        # Drop the old table if it exists, then create the new FTS5 table.
-        cursor.execute("DROP TABLE IF EXISTS general_facts;")
-        cursor.execute("""
-        CREATE VIRTUAL TABLE general_facts USING fts5(
-            content,
-            timestamp,
-            source
-        );
-        """)
-        log.info("FTS5 memory table 'general_facts' recreated successfully.")
-
-    conn.commit()
-    conn.close()
+    words = [word for word in re.findall(r"\w+", text.lower()) if word not in _STOPWORDS]
+    return " OR ".join(f'"{word}"' for word in dict.fromkeys(words))
 
-def store_fact(content: str, source: str):
-    """Stores a new fact in the general_facts FTS5 table."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO general_facts (content, timestamp, source) VALUES (?, ?, ?)",
-        (content, time.time(), source)
+def _normalize_text(text: str) -> str:
+    """Normalizes text for comparison, so texts that differ only in case and punctuation are equal."""
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+def _fuse_rankings(rankings: list[list[int]]) -> list[int]:
+    """Combines ranked lists of fact ids with reciprocal rank fusion, best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, fact_id in enumerate(ranking):
+            scores[fact_id] = scores.get(fact_id, 0.0) + 1.0 / (_RRF_K + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+class QueryCache:
+    """
+    A thread-safe LRU cache of retrieval results, tied to a generation of the database.
+
+    Every write to the facts increments the generation stored in the database, so a cached
+    result is only used while the generation it was computed for is still current, no
+    matter which thread or process made the write.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._generation = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, generation: int):
+        """Returns the cached result for the key, or None on a miss."""
+        with self._lock:
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, generation: int, result: list[str]):
+        with self._lock:
+            if generation != self._generation or self.max_entries <= 0:
+                return
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters, for tuning the cache size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+class MemoryStore:
+    """
+    The long-term memory database: an SQLite FTS5 table of facts.
+
+    Each thread gets its own connection, which is opened on first use and kept for the
+    life of the store, so queries don't pay for connecting and re-preparing statements.
+    The database runs in WAL mode, so readers don't block the writer and commits don't
+    need to rewrite the main database file.
+
+    New facts are written behind: they are queued and a writer thread inserts them in one
+    transaction per batch, after waiting `flush_interval` seconds for more facts to arrive.
+    Reads flush the queue first, so a fact is visible as soon as `store_fact` returns.
+
+    Retrieval is hybrid: a BM25 keyword search in FTS5 and, when an embedding model is
+    available, an exact cosine search over fact embeddings run in parallel, and their
+    rankings are fused. Embeddings are stored in the 'fact_embeddings' table and kept in
+    memory in a VectorIndex. The index is built on a background thread on the first search,
+    and searches use keywords only until it is ready. After that, the writer thread embeds
+    new facts: the ones it wrote itself, and the ones other processes stored past the highest
+    rowid it has seen. Searches never embed facts; they search whatever the index holds.
+    Results are cached by normalized query until the facts change.
+
+    `run_maintenance()` removes duplicate and expired facts and compacts the database.
+    `start_maintenance()` runs it periodically on a background thread.
+
+    Nothing is touched on disk until `open()` is called, and `close()` writes any queued
+    facts and closes every connection.
+    """
+    # The most facts inserted in one transaction.
+    MAX_BATCH_SIZE = 500
+    # How many times a batch is retried when its transaction fails (e.g. the database is locked
+    # by another process for longer than the busy timeout), and the delay before the first retry.
+    # The delay doubles with every retry.
+    WRITE_RETRIES = 5
+    WRITE_RETRY_DELAY = 0.5
+
+    # How many facts are embedded at a time when catching up with new facts.
+    EMBED_BATCH_SIZE = 256
+
+    # Maintenance compares at most this many new facts against the others for near-duplicates.
+    MAX_NEAR_DUPLICATE_CHECKS = 1000
+    # Maintenance deletes facts in transactions of this size, so writers are never blocked for long.
+    DELETE_BATCH_SIZE = 500
+    # Maintenance merges the full-text index this many pages per transaction, for the same reason.
+    MERGE_PAGES = 200
+    # The most merge steps of one maintenance run. The rest is merged by the next run.
+    MAX_MERGE_STEPS = 500
+    # The database is only vacuumed when no fact has been stored for this many seconds, as
+    # VACUUM holds the write lock until it is done.
+    VACUUM_IDLE_SECONDS = 60
+
+    def __init__(self, db_path: str = DB_PATH, synchronous: str = "NORMAL", write_queue_size: int = 1000, flush_interval: float = 0.5,
+                 vector_search: bool = True, min_similarity: float = 0.35, query_cache_size: int = 256):
+        self.db_path = db_path
+        self.synchronous = synchronous
+        self.write_queue_size = write_queue_size
+        self.flush_interval = flush_interval
+        self.vector_search = vector_search
+        self.min_similarity = min_similarity
+        self.is_open = False
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._writer = None
+        # The vector index is loaded on the first search, as loading the embedding model is slow.
+        self._embedder = None
+        self._vectors = None
+        self._vector_loader = None
+        # The generation of the facts the index was last synchronized with, the highest rowid
+        # it has checked for new facts, and facts written since then that may be below it
+        # (a rowid freed by a deletion can be reused).
+        self._vectors_generation = None
+        self._vectors_watermark = 0
+        self._unembedded_ids = set()
+        self._vector_lock = threading.Lock()
+        # Serializes the embedding of new facts, which runs outside the vector lock.
+        self._sync_lock = threading.Lock()
+        self._search_executor = None
+        self.query_cache = QueryCache(query_cache_size)
+        self._maintenance_thread = None
+        self._maintenance_stop = threading.Event()
+        self._last_store = 0.0
+        self.last_maintenance_stats = None
+
+    def open(self):
+        """Creates the database if needed and makes sure it has the expected schema."""
+        folder = os.path.dirname(self.db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.is_open = True
+        conn = self._connection()
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'general_facts'").fetchone()
+        if row is None or "fts5" not in (row[0] or "").lower():
+            if row is not None:
+                log.warning("Memory database has an outdated schema. Recreating the 'general_facts' table...")
+            # Drop the old table if it exists, then create the new FTS5 table.
+            with conn:
+                conn.execute("DROP TABLE IF EXISTS general_facts;")
+                conn.execute("DROP TABLE IF EXISTS fact_embeddings;")
+                conn.execute("""
+                CREATE VIRTUAL TABLE general_facts USING fts5(
+                    content,
+                    timestamp,
+                    source
+                );
+                """)
+            log.info("FTS5 memory table 'general_facts' created successfully.")
+        with conn:
+            # One float32 embedding per fact, keyed by the fact's rowid in 'general_facts'.
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS fact_embeddings (
+                fact_id INTEGER PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL
+            );
+            """)
+            # 'generation' is incremented whenever the facts change. It invalidates cached query results.
+            conn.execute("CREATE TABLE IF NOT EXISTS memory_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);")
+            conn.execute("INSERT OR IGNORE INTO memory_meta (key, value) VALUES ('generation', 0);")
+        self._start_writer()
+        log.info(f"Memory store opened at '{self.db_path}'.")
+
+    def _start_writer(self):
+        self._write_queue = queue.Queue(maxsize=self.write_queue_size)
+        self._pending = threading.Event()
+        self._closing = threading.Event()
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True, name="memory-writer")
+        self._writer.start()
+
+    def _check_process(self):
+        """
+        Connections and the writer thread must not be shared with a forked child (e.g. a skill
+        worker), so a child process starts with connections and a writer of its own.
+        """
+        if not self.is_open:
+            raise RuntimeError("The memory store is not open.")
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._connections = []
+            self._lock = threading.Lock()
+            self._vector_lock = threading.Lock()
+            self._sync_lock = threading.Lock()
+            self._vector_loader = None
+            self._search_executor = None
+            self.query_cache = QueryCache(self.query_cache.max_entries)
+            self._pid = os.getpid()
+            self._start_writer()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns the calling thread's connection, opening it on first use."""
+        self._check_process()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Only the owning thread uses a connection. Other threads only close it in close().
+            conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute(f"PRAGMA synchronous={self.synchronous};")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _writer_loop(self):
+        while True:
+            self._pending.wait()
+            # Gives more facts the chance to join the batch. Closing the store cuts the wait short.
+            self._closing.wait(self.flush_interval)
+            self._pending.clear()
+            self._write_queued()
+            if self._closing.is_set():
+                break
+            # Embeds the new facts now, so searches don't have to. This also runs when a search
+            # finds facts stored by another process.
+            if self._vectors is not None:
+                try:
+                    self._sync_vectors()
+                except Exception as e:
+                    log.error(f"Failed to embed new facts: {e}", exc_info=True)
+
+    def _write_queued(self):
+        """Inserts the queued facts on the calling thread, one transaction per batch."""
+        while True:
+            batch = []
+            while len(batch) < self.MAX_BATCH_SIZE:
+                try:
+                    batch.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._write_queue.task_done()
+
+    def _write_batch(self, batch: list[tuple]):
+        """Inserts a batch of facts in one transaction, retrying with backoff if it fails."""
+        delay = self.WRITE_RETRY_DELAY
+        for attempt in range(self.WRITE_RETRIES + 1):
+            try:
+                conn = self._connection()
+                with conn:
+                    ids = [conn.execute(_INSERT_FACT_SQL, fact).lastrowid for fact in batch]
+                    conn.execute(_BUMP_GENERATION_SQL)
+                log.debug(f"Wrote {len(batch)} facts to memory.")
+                # Facts written before the index is built are found by its scan for unembedded facts.
+                with self._vector_lock:
+                    if self._vector_loader is not None:
+                        self._unembedded_ids.update(ids)
+                return
+            except sqlite3.Error as e:
+                if attempt == self.WRITE_RETRIES:
+                    lost = "; ".join(f"[{source}] {content}" for content, _timestamp, source in batch)
+                    log.error(f"Failed to write {len(batch)} facts to memory after {attempt + 1} attempts. They are lost: {lost}", exc_info=True)
+                    return
+                log.warning(f"Failed to write {len(batch)} facts to memory ({e}). Retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                delay *= 2
+
+    def store_fact(self, content: str, source: str):
+        """Queues a new fact for the general_facts FTS5 table."""
+        self._check_process()
+        fact = (content, time.time(), source)
+        try:
+            self._write_queue.put_nowait(fact)
+        except queue.Full:
+            # The writer is falling behind, so this thread writes the backlog itself.
+            self._write_queued()
+            self._write_queue.put(fact)
+        self._pending.set()
+        self._last_store = time.monotonic()
+        log.info(f"Stored new fact from '{source}'.")
+
+    def flush(self):
+        """Writes all queued facts and waits until they are committed."""
+        self._check_process()
+        self._write_queued()
+        # Waits for a batch the writer thread may be writing right now.
+        self._write_queue.join()
+
+    def _vectors_ready(self) -> bool:
+        """
+        Returns True if the vector index can be searched. On the first call, starts loading the
+        embedding model and the index on a background thread and returns False until it is done.
+        """
+        if not self.vector_search:
+            return False
+        with self._vector_lock:
+            if self._vectors is not None:
+                if self._search_executor is None:
+                    self._search_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-search")
+                return True
+            if self._vector_loader is None:
+                self._vector_loader = threading.Thread(target=self._load_vectors, daemon=True, name="memory-vectors")
+                self._vector_loader.start()
+        return False
+
+    def _load_vectors(self):
+        """
+        Loads the embedding model and the stored embeddings of its model, and embeds the facts
+        that have none. Runs on the loader thread. The index is only published once it is
+        complete, so writers and searches never wait for it.
+        """
+        try:
+            embedder = get_embedder()
+            if embedder is None:
+                self.vector_search = False
+                log.info("No embedding model available. Memory retrieval uses keyword search only.")
+                return
+            conn = self._connection()
+            vectors = VectorIndex(embedder.dimension)
+            ids = []
+            blobs = []
+            for fact_id, blob in conn.execute("SELECT fact_id, vector FROM fact_embeddings WHERE model = ? ORDER BY fact_id", (embedder.model_name,)):
+                ids.append(fact_id)
+                blobs.append(blob)
+            if ids:
+                vectors.add(ids, np.frombuffer(b"".join(blobs), dtype=np.float32))
+            # Read before looking for unembedded facts, so facts stored during the build are
+            # caught by the next synchronization. This is the only full scan for them.
+            generation = conn.execute(_GET_GENERATION_SQL).fetchone()[0]
+            watermark = conn.execute(_MAX_ROWID_SQL).fetchone()[0]
+            missing = conn.execute(_UNEMBEDDED_FACTS_SQL, (embedder.model_name,)).fetchall()
+            self._embed_facts(embedder, vectors, missing)
+            with self._vector_lock:
+                self._embedder = embedder
+                self._vectors = vectors
+                self._vectors_generation = generation
+                self._vectors_watermark = watermark
+            log.info(f"Loaded {len(ids)} fact embeddings and embedded {len(missing)} new facts. Vector search is ready.")
+            self._sync_vectors()
+        except Exception as e:
+            if self.is_open:
+                log.error(f"Failed to load the memory vector index. Memory retrieval uses keyword search only: {e}", exc_info=True)
+                self.vector_search = False
+
+    def _embed_facts(self, embedder, vectors: VectorIndex, rows: list[tuple[int, str]]):
+        """Embeds (rowid, content) rows, stores the embeddings and adds them to the index, replacing any it has for the same ids."""
+        if not rows:
+            return
+        conn = self._connection()
+        model = embedder.model_name
+        for start in range(0, len(rows), self.EMBED_BATCH_SIZE):
+            if not self.is_open:
+                return
+            batch = rows[start:start + self.EMBED_BATCH_SIZE]
+            ids = [fact_id for fact_id, _content in batch]
+            embedded = embedder.embed([content for _fact_id, content in batch])
+            with conn:
+                conn.executemany(_INSERT_EMBEDDING_SQL, [(fact_id, model, vector.tobytes()) for fact_id, vector in zip(ids, embedded)])
+            # A rowid freed by a deletion can be reused by a new fact.
+            with self._vector_lock:
+                vectors.remove(ids)
+                vectors.add(ids, embedded)
+
+    def _sync_vectors(self):
+        """
+        Embeds the facts stored since the last synchronization: the ones this process wrote,
+        and any with a rowid above the watermark, which includes facts stored by other processes.
+        Runs on the writer thread, and only queries when the facts have changed.
+        """
+        with self._sync_lock:
+            conn = self._connection()
+            generation = conn.execute(_GET_GENERATION_SQL).fetchone()[0]
+            with self._vector_lock:
+                if generation == self._vectors_generation and not self._unembedded_ids:
+                    return
+                watermark = self._vectors_watermark
+                ids, self._unembedded_ids = self._unembedded_ids, set()
+            rows = conn.execute(_FACTS_AFTER_SQL, (watermark,)).fetchall()
+            older = sorted(fact_id for fact_id in ids if fact_id <= watermark)
+            for start in range(0, len(older), self.DELETE_BATCH_SIZE):
+                batch = older[start:start + self.DELETE_BATCH_SIZE]
+                placeholders = ", ".join("?" * len(batch))
+                rows += conn.execute(f"SELECT rowid, content FROM general_facts WHERE rowid IN ({placeholders})", batch).fetchall()
+            self._embed_facts(self._embedder, self._vectors, rows)
+            with self._vector_lock:
+                self._vectors_generation = generation
+                self._vectors_watermark = max([watermark] + [fact_id for fact_id, _content in rows])
+
+    def _vector_search(self, search_query: str, k: int) -> list[int]:
+        """Returns the ids of the facts most similar to the query, best first."""
+        query = self._embedder.embed([search_query])[0]
+        with self._vector_lock:
+            hits = self._vectors.search(query, k)
+        return [fact_id for fact_id, score in hits if score >= self.min_similarity]
+
+    def _keyword_search(self, search_query: str, k: int) -> list[int]:
+        """Returns the ids of the facts that best match the query's words by BM25, best first."""
+        fts_query = _fts_query(search_query)
+        if not fts_query:
+            return []
+        conn = self._connection()
+        return [row[0] for row in conn.execute(_KEYWORD_SEARCH_SQL, (fts_query, k))]
+
+    def retrieve_relevant_facts(self, search_query: str, top_n: int = 3) -> list[str]:
+        """Retrieves the most relevant facts from memory, combining keyword and vector search."""
+        try:
+            self.flush()
+            cache_key = (_normalize_text(search_query), top_n)
+            generation = self._connection().execute(_GET_GENERATION_SQL).fetchone()[0]
+            cached = self.query_cache.get(cache_key, generation)
+            if cached is not None:
+                return list(cached)
+
+            candidates = max(top_n * 4, 20)
+            vector_future = None
+            if self._vectors_ready():
+                if generation != self._vectors_generation:
+                    # Facts stored by another process. Wakes the writer to embed them.
+                    self._pending.set()
+                # Embedding the query and scanning the vectors runs while SQLite does the keyword search.
+                vector_future = self._search_executor.submit(self._vector_search, search_query, candidates)
+            rankings = [self._keyword_search(search_query, candidates)]
+            if vector_future is not None:
+                rankings.append(vector_future.result())
+            fact_ids = _fuse_rankings(rankings)[:top_n]
+            results = []
+            if fact_ids:
+                conn = self._connection()
+                placeholders = ", ".join("?" * len(fact_ids))
+                contents = dict(conn.execute(f"SELECT rowid, content FROM general_facts WHERE rowid IN ({placeholders})", fact_ids))
+                results = [contents[fact_id] for fact_id in fact_ids if fact_id in contents]
+            self.query_cache.put(cache_key, generation, results)
+            return list(results)
+        except sqlite3.OperationalError as e:
+            log.error(f"Error retrieving facts from memory: {e}", exc_info=True)
+            return []
+
+    def _get_meta(self, conn, key: str, default: int = 0) -> int:
+        row = conn.execute("SELECT value FROM memory_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, conn, key: str, value):
+        conn.execute("INSERT OR REPLACE INTO memory_meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _delete_facts(self, conn, fact_ids: list[int]):
+        """Deletes facts and their embeddings in small transactions."""
+        for start in range(0, len(fact_ids), self.DELETE_BATCH_SIZE):
+            batch = [(fact_id,) for fact_id in fact_ids[start:start + self.DELETE_BATCH_SIZE]]
+            with conn:
+                conn.executemany("DELETE FROM general_facts WHERE rowid = ?", batch)
+                conn.executemany("DELETE FROM fact_embeddings WHERE fact_id = ?", batch)
+                conn.execute(_BUMP_GENERATION_SQL)
+        # New facts can reuse the rowids of deleted ones, so the watermark must not be above them.
+        max_rowid = conn.execute(_MAX_ROWID_SQL).fetchone()[0]
+        with self._vector_lock:
+            if self._vectors is not None:
+                self._vectors.remove(fact_ids)
+            self._vectors_watermark = min(self._vectors_watermark, max_rowid)
+
+    def _merge_index(self, conn, full: bool) -> int:
+        """
+        Merges the full-text index's segments, MERGE_PAGES pages per transaction, so writers
+        only ever wait for one step. With `full`, every segment is merged (like 'optimize',
+        which reclaims the space of deleted facts), otherwise only as many as FTS5 would merge
+        on its own. Returns the number of steps.
+        """
+        pages = -self.MERGE_PAGES if full else self.MERGE_PAGES
+        for step in range(1, self.MAX_MERGE_STEPS + 1):
+            changes = conn.total_changes
+            with conn:
+                conn.execute("INSERT INTO general_facts(general_facts, rank) VALUES('merge', ?)", (pages,))
+            # A step that merged nothing changes fewer than two rows.
+            if conn.total_changes - changes < 2 or self._maintenance_stop.is_set():
+                return step
+            # Lets writers waiting for the lock in.
+            time.sleep(0.01)
+        return self.MAX_MERGE_STEPS
+
+    def _writes_idle(self) -> bool:
+        """Returns True if no facts are waiting to be written and none were stored recently."""
+        return (
+            self._write_queue.empty()
+            and not self._pending.is_set()
+            and time.monotonic() - self._last_store > self.VACUUM_IDLE_SECONDS
+        )
+
+    def run_maintenance(self, dedup_similarity: float = 95, retention_days: dict | None = None,
+                        half_life_days: dict | None = None, max_facts: int = 0, vacuum: bool = True) -> dict:
+        """
+        Cleans up long-term memory and returns statistics about what was done.
+
+        - Facts with the same normalized text are merged, keeping the newest.
+        - Facts added since the last run are compared to all others, and the older of two facts
+          with a similarity of at least `dedup_similarity` (0-100) is removed.
+        - Facts older than their source's `retention_days` are removed (0 keeps them forever).
+        - If there are more than `max_facts` facts (0 for no limit), the facts with the lowest
+          weight are removed. A fact's weight halves every `half_life_days` of its source.
+        - The full-text index is merged in small steps (fully after deletions), and the database is
+          vacuumed when much of it is free, unless facts have been stored recently or `vacuum` is False.
+
+        `retention_days` and `half_life_days` map a source to days, with 'default' used for other sources.
+        """
+        self.flush()
+        start = time.perf_counter()
+        retention_days = retention_days or {}
+        half_life_days = half_life_days or {}
+        conn = self._connection()
+        size_before = os.path.getsize(self.db_path)
+        facts = conn.execute("SELECT rowid, content, timestamp, source FROM general_facts ORDER BY rowid").fetchall()
+        stats = {"facts_before": len(facts), "duplicates": 0, "near_duplicates": 0, "expired": 0, "evicted": 0}
+        now = time.time()
+        removed = set()
+
+        def timestamp_of(fact):
+            try:
+                return float(fact[2])
+            except (TypeError, ValueError):
+                return 0.0
+
+        # Exact duplicates, keeping the newest of each.
+        newest_by_text = {}
+        for fact in facts:
+            key = _normalize_text(fact[1])
+            previous = newest_by_text.get(key)
+            if previous is not None:
+                older = previous if timestamp_of(previous) <= timestamp_of(fact) else fact
+                removed.add(older[0])
+                stats["duplicates"] += 1
+                if older is previous:
+                    newest_by_text[key] = fact
+            else:
+                newest_by_text[key] = fact
+
+        # Near duplicates, only checked for facts added since the last run.
+        compacted_rowid = self._get_meta(conn, "compacted_rowid")
+        remaining = {fact[0]: fact for fact in newest_by_text.values()}
+        choices = {fact_id: _normalize_text(fact[1]) for fact_id, fact in remaining.items()}
+        new_ids = sorted(fact_id for fact_id in remaining if fact_id > compacted_rowid)[-self.MAX_NEAR_DUPLICATE_CHECKS:]
+        for fact_id in new_ids:
+            # Closing the store stops maintenance before anything is deleted, so the next run
+            # checks the same facts again.
+            if self._maintenance_stop.is_set():
+                log.info("Memory maintenance stopped because the memory store is closing.")
+                stats["stopped"] = True
+                return stats
+            if fact_id not in choices:
+                continue
+            query = choices.pop(fact_id)
+            match = process.extractOne(query, choices, scorer=fuzz.ratio, processor=None, score_cutoff=dedup_similarity)
+            if match:
+                other_id = match[2]
+                fact, other = remaining[fact_id], remaining[other_id]
+                older = other if timestamp_of(other) <= timestamp_of(fact) else fact
+                removed.add(older[0])
+                stats["near_duplicates"] += 1
+                if older is fact:
+                    continue
+                del choices[other_id]
+            choices[fact_id] = query
+
+        # Retention and age-decayed eviction.
+        kept = []
+        for fact in facts:
+            if fact[0] in removed:
+                continue
+            source = fact[3] or "default"
+            age_days = max(0.0, now - timestamp_of(fact)) / 86400
+            retention = retention_days.get(source, retention_days.get("default", 0))
+            if retention and age_days > retention:
+                removed.add(fact[0])
+                stats["expired"] += 1
+                continue
+            half_life = half_life_days.get(source, half_life_days.get("default", 365)) or 365
+            kept.append((0.5 ** (age_days / half_life), fact[0]))
+        if max_facts and len(kept) > max_facts:
+            kept.sort()
+            evicted = [fact_id for _weight, fact_id in kept[:len(kept) - max_facts]]
+            removed.update(evicted)
+            stats["evicted"] = len(evicted)
+
+        if removed:
+            self._delete_facts(conn, sorted(removed))
+        with conn:
+            self._set_meta(conn, "compacted_rowid", facts[-1][0] if facts else compacted_rowid)
+            self._set_meta(conn, "last_maintenance", int(now))
+
+        stats["merge_steps"] = self._merge_index(conn, full=bool(removed))
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        total_pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        stats["vacuumed"] = False
+        if total_pages > 0 and free_pages / total_pages > 0.2:
+            if vacuum and self._writes_idle():
+                conn.execute("VACUUM")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                stats["vacuumed"] = True
+            else:
+                log.info("Memory maintenance skipped VACUUM because facts are being stored. The next run will try again.")
+
+        stats["facts_after"] = len(facts) - len(removed)
+        stats["size_before"] = size_before
+        stats["size_after"] = os.path.getsize(self.db_path)
+        stats["seconds"] = round(time.perf_counter() - start, 3)
+        self.last_maintenance_stats = stats
+        log.info(
+            f"Memory maintenance: {stats['facts_before']} -> {stats['facts_after']} facts "
+            f"({stats['duplicates']} duplicates, {stats['near_duplicates']} near duplicates, "
+            f"{stats['expired']} expired, {stats['evicted']} evicted), "
+            f"{stats['size_before'] // 1024} KB -> {stats['size_after'] // 1024} KB in {stats['seconds']}s."
+        )
+        return stats
+
+    def start_maintenance(self, interval_hours: float = 24, startup_delay: float = 600, **options):
+        """
+        Runs `run_maintenance(**options)` on a background thread every `interval_hours`.
+        The first run waits at least `startup_delay` seconds, so it never slows down startup.
+        """
+        if self._maintenance_thread is not None:
+            return
+        self._maintenance_stop.clear()
+
+        def _loop():
+            interval = interval_hours * 3600
+            last_run = self._get_meta(self._connection(), "last_maintenance")
+            delay = max(startup_delay, last_run + interval - time.time())
+            while not self._maintenance_stop.wait(delay):
+                try:
+                    self.run_maintenance(**options)
+                except Exception as e:
+                    log.error(f"Memory maintenance failed: {e}", exc_info=True)
+                delay = interval
+
+        self._maintenance_thread = threading.Thread(target=_loop, daemon=True, name="memory-maintenance")
+        self._maintenance_thread.start()
+        log.info(f"Memory maintenance scheduled every {interval_hours} hours.")
+
+    def close(self):
+        """Writes any queued facts and closes every connection of the store."""
+        if self._pid != os.getpid():
+            # A forked child never used the store. Its connections belong to the parent.
+            self._connections = []
+            self._writer = None
+            self._maintenance_thread = None
+            self.is_open = False
+            return
+        if self._maintenance_thread is not None:
+            self._maintenance_stop.set()
+            self._maintenance_thread.join()
+            self._maintenance_thread = None
+        if self._writer is not None:
+            self._closing.set()
+            self._pending.set()
+            self._writer.join()
+            self._write_queued()
+            self._writer = None
+        if self._search_executor is not None:
+            self._search_executor.shutdown(wait=True)
+            self._search_executor = None
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+            self.is_open = False
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                log.warning(f"Failed to close a memory database connection: {e}")
+        stats = self.query_cache.stats()
+        log.info(f"Memory store closed. Query cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate).")
+
+# Global instance for easy access across the application
+memory_store = None
+_memory_store_lock = threading.Lock()
+
+def initialize_memory_store() -> MemoryStore:
+    """Initializes and opens the global memory store."""
+    global memory_store
+    with _memory_store_lock:
+        if memory_store is None:
+            store = MemoryStore(
+                DB_PATH,
+                synchronous=config.get('memory.synchronous', 'NORMAL'),
+                write_queue_size=config.get('memory.write_queue_size', 1000),
+                flush_interval=config.get('memory.flush_interval', 0.5),
+                vector_search=config.get('memory.vector_search', True),
+                min_similarity=config.get('memory.min_similarity', 0.35),
+                query_cache_size=config.get('memory.query_cache_size', 256),
+            )
+            store.open()
+            memory_store = store
+    return memory_store
+
+def start_memory_maintenance():
+    """Schedules maintenance of the global memory store, as configured in config.yaml."""
+    if not config.get('memory.maintenance.enabled', True):
+        return
+    initialize_memory_store().start_maintenance(
+        interval_hours=config.get('memory.maintenance.interval_hours', 24),
+        dedup_similarity=config.get('memory.maintenance.dedup_similarity', 95),
+        retention_days=config.get('memory.maintenance.retention_days', {}),
+        half_life_days=config.get('memory.maintenance.half_life_days', {}),
+        max_facts=config.get('memory.maintenance.max_facts', 0),
     )
-    conn.commit()
-    conn.close()
-    log.info(f"Stored new fact from '{source}'.")
+
+def close_memory_store():
+    """Closes the global memory store, if it was opened."""
+    global memory_store
+    with _memory_store_lock:
+        if memory_store is not None:
+            memory_store.close()
+            memory_store = None
+
+def flush_memory_store():
+    """Commits the facts queued in the global memory store, if it was opened."""
+    store = memory_store
+    if store is not None:
+        store.flush()
+
+def memory_cache_stats() -> dict:
+    """Returns the query cache counters of the global memory store, or an empty dictionary if it is not open."""
+    store = memory_store
+    return store.query_cache.stats() if store is not None else {}
+
+def store_fact(content: str, source: str):
+    """Stores a new fact in long-term memory."""
+    initialize_memory_store().store_fact(content, source)
 
 def retrieve_relevant_facts(search_query: str, top_n: int = 3):
-    """Retrieves the most relevant facts from memory using FTS5."""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT content FROM general_facts WHERE general_facts MATCH ? ORDER BY rank LIMIT ?", (search_query, top_n))
-        results = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return results
-    except sqlite3.OperationalError as e:
-        log.error(f"Error retrieving facts from memory: {e}", exc_info=True)
-        return []
-
-# Initialize the database when the module is first imported.
-_initialize_db()
\ No newline at end of file
+    """Retrieves the most relevant facts from long-term memory."""
+    return initialize_memory_store().retrieve_relevant_facts(search_query, top_n)
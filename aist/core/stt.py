@@ -1,14 +1,82 @@
 # core/stt.py - Pluggable Speech-to-Text Engine Manager
 
 import logging
+import re
 import threading
 import importlib
+from rapidfuzz import fuzz
 from aist.core.log_setup import console_log
 from aist.core.config_manager import config
 from aist.core.ipc.protocol import INIT_STATUS_UPDATE # New import
 
 log = logging.getLogger(__name__)
 
+def _normalize_transcript(text: str) -> str:
+    """Lowercases a transcript and drops its punctuation, so partial and final transcripts compare equal."""
+    return " ".join(re.findall(r"[\w']+", text.lower()))
+
+class PartialTranscriptTracker:
+    """
+    Decides when a partial transcript should be dispatched speculatively, and recognizes the
+    final transcript of an utterance that was already handled from one of its partials.
+
+    A partial is dispatched once the same hypothesis was heard `stable_count` times in a row,
+    since the first hypotheses for a word are often wrong. The final transcript only counts as
+    already handled if it is at least `threshold` percent similar to the handled partial as a
+    whole, so words said after the partial still reach the backend. Partials are published from
+    the STT provider's threads, so all methods are thread-safe.
+    """
+    def __init__(self, stable_count: int = 2, threshold: float = 85):
+        self.stable_count = max(1, stable_count)
+        self.threshold = threshold
+        self._condition = threading.Condition()
+        self._last = ""
+        self._repeats = 0
+        self._pending = False
+        self._handled = None # Normalized partial that was handled for the current utterance.
+
+    def feed(self, text: str) -> str | None:
+        """Records a partial transcript and returns it if it should be dispatched now."""
+        normalized = _normalize_transcript(text)
+        with self._condition:
+            if self._pending or not normalized:
+                return None
+            if self._handled is not None:
+                if normalized.startswith(self._handled):
+                    return None # The rest of an utterance that was already handled.
+                self._handled = None # Its final transcript never came. This is a new utterance.
+            if normalized == self._last:
+                self._repeats += 1
+            else:
+                self._last, self._repeats = normalized, 1
+            if self._repeats != self.stable_count:
+                return None
+            self._pending = True
+            return text
+
+    def resolve(self, text: str, handled: bool):
+        """Records whether the backend handled a partial returned by `feed`."""
+        with self._condition:
+            self._pending = False
+            if handled:
+                self._handled = _normalize_transcript(text)
+            self._condition.notify_all()
+
+    def finish(self, text: str, timeout: float = 5.0) -> bool:
+        """
+        Ends the current utterance with its final transcript. Returns True if the utterance was
+        already handled from a partial, so the final transcript must not be dispatched again.
+        """
+        with self._condition:
+            # Wait for the answer to a partial that is still being dispatched.
+            self._condition.wait_for(lambda: not self._pending, timeout=timeout)
+            handled, self._handled = self._handled, None
+            self._last, self._repeats = "", 0
+        if handled is None:
+            return False
+        final = _normalize_transcript(text)
+        return final == handled or fuzz.ratio(final, handled) >= self.threshold
+
 def initialize_stt_engine(app_state, stt_ready_event: threading.Event, event_broadcaster=None):
     """
     Initializes the configured STT provider and starts it in a background thread.
@@ -1,7 +1,9 @@
 # core/tts.py - Pluggable Text-to-Speech Engine Manager
 import logging
+import re
 import threading
 import importlib
+from queue import Queue
 from aist.core.config_manager import config
 from aist.core.events import bus, TTS_SPEAK
 from aist.core.ipc.protocol import INIT_STATUS_UPDATE # New import
@@ -10,6 +12,36 @@ log = logging.getLogger(__name__)
 
 # Global instance of the TTS provider
 tts_provider = None
+# Phrases the assistant speaks constantly, synthesized into the speech cache at startup.
+DEFAULT_PREWARM_PHRASES = ["Assistant is online.", "Listening.", "Okay.", "Goodbye."]
+# Speak requests are played one at a time, in order, by a single worker thread.
+_speak_queue = Queue()
+_speak_worker = None
+
+# A sentence ends at '.', '!' or '?' (optionally followed by closing quotes/brackets)
+# when it is followed by whitespace.
+_SENTENCE_END_RE = re.compile(r'(?:(?<=[.!?])|(?<=[.!?]["\')\]]))\s+')
+
+class SentenceChunker:
+    """
+    Accumulates streamed text and hands back complete sentences as soon as they end.
+    Used to start speaking an LLM response before the whole response has been generated.
+    """
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text: str) -> list[str]:
+        """Adds text to the buffer and returns any sentences that are now complete."""
+        self._buffer += text
+        parts = _SENTENCE_END_RE.split(self._buffer)
+        self._buffer = parts.pop()
+        return [part.strip() for part in parts if part.strip()]
+
+    def flush(self) -> str:
+        """Returns whatever text is left in the buffer and resets it."""
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        return remainder
 
 def initialize_tts_engine(event_broadcaster=None):
     """
@@ -29,6 +61,9 @@ def initialize_tts_engine(event_broadcaster=None):
             ProviderClass = getattr(provider_module, f"{provider_name.capitalize()}Provider")
         tts_provider = ProviderClass()
         log.info(f"TTS provider '{provider_name}' initialized.")
+        # Pre-warm the speech cache in the background so startup isn't delayed.
+        prewarm_phrases = config.get('models.tts.cache.prewarm_phrases', DEFAULT_PREWARM_PHRASES)
+        threading.Thread(target=tts_provider.prewarm, args=(prewarm_phrases,), daemon=True).start()
         if event_broadcaster:
             event_broadcaster.broadcast(INIT_STATUS_UPDATE, {"component": "tts", "status": "initialized"}) # Send update
     except (ImportError, AttributeError) as e:
@@ -43,14 +78,29 @@ def initialize_tts_engine(event_broadcaster=None):
             event_broadcaster.broadcast(INIT_STATUS_UPDATE, {"component": "tts", "status": "failed", "error": str(e)}) # Send error update
     return tts_provider
 
+def _speak_worker_loop():
+    """Plays queued speak requests one after another."""
+    while True:
+        text = _speak_queue.get()
+        try:
+            tts_provider.speak(text)
+        except Exception as e:
+            log.error(f"Unhandled error while speaking: {e}", exc_info=True)
+
 def _handle_speak_request(text: str):
     """
     Handles a speak request from the event bus.
-    Runs the actual speaking in a separate thread to avoid blocking the bus.
+    The text is queued for the speak worker thread to avoid blocking the bus. Queuing
+    (rather than a thread per request) keeps streamed sentences in order and prevents
+    them from playing over each other.
     """
+    global _speak_worker
     if not text or not tts_provider:
         return
-    threading.Thread(target=tts_provider.speak, args=(text,), daemon=True).start()
+    if _speak_worker is None:
+        _speak_worker = threading.Thread(target=_speak_worker_loop, daemon=True)
+        _speak_worker.start()
+    _speak_queue.put(text)
 
 def subscribe_to_events():
     """Subscribes the TTS engine to the event bus."""
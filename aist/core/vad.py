@@ -0,0 +1,201 @@
+# aist/core/vad.py
+import logging
+import time
+from collections import deque
+import numpy as np
+from aist.core.config_manager import config
+from aist.core.events import bus, VAD_STATUS_CHANGED
+
+log = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2 # 16-bit PCM
+
+class EnergyClassifier:
+    """Classifies a frame as speech when its RMS energy is above a fixed threshold. Needs no extra dependencies."""
+    frame_samples = 480 # 30 ms
+
+    def __init__(self, threshold: float = 300):
+        self.threshold = threshold
+
+    def is_speech(self, frame: bytes) -> bool:
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float64)
+        return np.sqrt(np.mean(samples ** 2)) > self.threshold
+
+class WebRTCClassifier:
+    """
+    The WebRTC voice activity detector: a small GMM classifier that tells speech from
+    steady noise much better than an energy threshold, at a few microseconds per frame.
+    `aggressiveness` goes from 0 (lets the most audio through) to 3 (filters the most non-speech).
+    """
+    frame_samples = 480 # 30 ms, the longest frame it accepts.
+
+    def __init__(self, aggressiveness: int = 2):
+        # Imported here so the rest of the application works without the optional dependency.
+        import webrtcvad
+        self.vad = webrtcvad.Vad(aggressiveness)
+
+    def is_speech(self, frame: bytes) -> bool:
+        # It only accepts read-only buffers, and frames can be views into the capture ring.
+        return self.vad.is_speech(bytes(frame), SAMPLE_RATE)
+
+class SileroClassifier:
+    """
+    The Silero neural VAD. The most robust to background noise and chatter, at about a
+    millisecond of CPU per frame. A frame is speech when its probability reaches `threshold`.
+    """
+    frame_samples = 512 # 32 ms, the frame size the model was trained on at 16 kHz.
+
+    def __init__(self, threshold: float = 0.5):
+        # Imported here so the rest of the application works without the optional dependencies.
+        import torch
+        from silero_vad import load_silero_vad
+        torch.set_num_threads(1)
+        self.torch = torch
+        self.model = load_silero_vad()
+        self.threshold = threshold
+
+    def is_speech(self, frame: bytes) -> bool:
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32) / 32768.0
+        with self.torch.no_grad():
+            probability = self.model(self.torch.from_numpy(samples), SAMPLE_RATE).item()
+        return probability >= self.threshold
+
+    def reset(self):
+        """Clears the model's state, which carries over from frame to frame."""
+        self.model.reset_states()
+
+class VoiceActivityDetector:
+    """
+    Splits 16 kHz, 16-bit mono audio into frames, classifies each one and turns the frame
+    decisions into utterances, publishing VAD_STATUS_CHANGED when speech starts and stops.
+
+    - Speech starts after `start_ms` of consecutive speech frames, so clicks and bumps are
+      ignored. The `pre_roll_ms` of audio before that is kept and handed out with it, so the
+      first syllable isn't cut off.
+    - Speech stops after `hangover_ms` of consecutive non-speech frames, so short pauses
+      between words don't split an utterance.
+    - If classifying a frame takes longer than `frame_budget_ms` on average, only every
+      second (third, ...) frame is classified and the others reuse its decision, so a slow
+      classifier can't make the audio fall behind.
+    """
+    def __init__(self, classifier, pre_roll_ms: int = 300, hangover_ms: int = 400, start_ms: int = 60,
+                 frame_budget_ms: float = 5.0, publish_events: bool = True):
+        self.classifier = classifier
+        self.frame_bytes = classifier.frame_samples * SAMPLE_WIDTH
+        frame_ms = classifier.frame_samples * 1000 / SAMPLE_RATE
+        self.start_frames = max(1, round(start_ms / frame_ms))
+        self.hangover_frames = max(1, round(hangover_ms / frame_ms))
+        self.frame_budget = frame_budget_ms / 1000
+        self.publish_events = publish_events
+        self._pre_roll = deque(maxlen=max(1, round(pre_roll_ms / frame_ms)))
+        self._remainder = b""
+        self._in_speech = False
+        self._run = 0 # Consecutive frames that disagree with the current state.
+        self._stride = 1
+        self._skipped = 0
+        self._last_decision = False
+        self._average_cost = 0.0
+
+    @property
+    def in_speech(self) -> bool:
+        return self._in_speech
+
+    def _classify(self, frame: bytes) -> bool:
+        """Classifies a frame, or reuses the last decision if the classifier is over its budget."""
+        if self._skipped + 1 < self._stride:
+            self._skipped += 1
+            return self._last_decision
+        self._skipped = 0
+        start = time.perf_counter()
+        self._last_decision = self.classifier.is_speech(frame)
+        cost = time.perf_counter() - start
+        self._average_cost = 0.95 * self._average_cost + 0.05 * cost
+        stride = min(4, max(1, int(self._average_cost / self.frame_budget) + 1)) if self.frame_budget > 0 else 1
+        if stride != self._stride:
+            log.warning(f"VAD classifier takes {self._average_cost * 1000:.1f} ms per frame (budget {self.frame_budget * 1000:.1f} ms). Classifying every {stride} frame(s).")
+            self._stride = stride
+        return self._last_decision
+
+    def _set_status(self, in_speech: bool):
+        self._in_speech = in_speech
+        self._run = 0
+        if self.publish_events:
+            bus.sendMessage(VAD_STATUS_CHANGED, status="speech" if in_speech else "silence")
+
+    def process(self, chunk: bytes) -> list[tuple[bytes, bool]]:
+        """
+        Feeds a chunk of audio of any length. Returns the speech in it as (audio, ended) pieces:
+        the audio to pass to a recognizer (with the pre-roll when an utterance starts) and whether
+        the utterance ended with it. Most chunks produce one piece or none; a new utterance that
+        starts in the same chunk as the previous one ended gets a piece of its own.
+        """
+        # Chunks are usually memoryviews into the capture ring, which are sliced into frames without copying.
+        data = memoryview(self._remainder + chunk if self._remainder else chunk).cast('B')
+        usable = len(data) - len(data) % self.frame_bytes
+        self._remainder = bytes(data[usable:])
+
+        pieces = []
+        speech = []
+        for offset in range(0, usable, self.frame_bytes):
+            frame = data[offset:offset + self.frame_bytes]
+            is_speech = self._classify(frame)
+
+            if not self._in_speech:
+                self._pre_roll.append(frame)
+                self._run = self._run + 1 if is_speech else 0
+                if self._run >= self.start_frames:
+                    speech.extend(self._pre_roll)
+                    self._pre_roll.clear()
+                    self._set_status(True)
+                continue
+
+            speech.append(frame)
+            self._run = self._run + 1 if not is_speech else 0
+            if self._run >= self.hangover_frames:
+                pieces.append((b"".join(speech), True))
+                speech = []
+                self._set_status(False)
+
+        if speech:
+            pieces.append((b"".join(speech), False))
+        return pieces
+
+    def reset(self):
+        """Drops buffered audio and ends the current utterance, if any, without returning it."""
+        self._remainder = b""
+        self._pre_roll.clear()
+        if self._in_speech:
+            self._set_status(False)
+        self._run = 0
+        if hasattr(self.classifier, "reset"):
+            self.classifier.reset()
+
+def create_classifier():
+    """Creates the frame classifier configured in config.yaml, falling back to the energy classifier."""
+    engine = config.get('audio.vad.engine', 'webrtc')
+    try:
+        if engine == "webrtc":
+            return WebRTCClassifier(config.get('audio.vad.aggressiveness', 2))
+        if engine == "silero":
+            return SileroClassifier(config.get('audio.vad.silero_threshold', 0.5))
+        if engine != "energy":
+            log.warning(f"Unknown VAD engine '{engine}'. Using the energy threshold.")
+    except ImportError as e:
+        log.warning(f"The '{engine}' VAD is not installed ({e}). Using the energy threshold.")
+    except Exception as e:
+        log.error(f"Failed to load the '{engine}' VAD: {e}. Using the energy threshold.", exc_info=True)
+    return EnergyClassifier(config.get('audio.vad.energy_threshold', 300))
+
+def create_vad(publish_events: bool = True) -> VoiceActivityDetector:
+    """Creates a voice activity detector with the classifier and timings configured in config.yaml."""
+    classifier = create_classifier()
+    log.info(f"Voice activity detection uses {type(classifier).__name__}.")
+    return VoiceActivityDetector(
+        classifier,
+        pre_roll_ms=config.get('audio.vad.pre_roll_ms', 300),
+        hangover_ms=config.get('audio.vad.hangover_ms', 400),
+        start_ms=config.get('audio.vad.start_ms', 60),
+        frame_budget_ms=config.get('audio.vad.frame_budget_ms', 5.0),
+        publish_events=publish_events,
+    )
@@ -0,0 +1,60 @@
+# aist/core/vector_index.py
+import numpy as np
+
+class VectorIndex:
+    """
+    An in-memory index of L2-normalized float32 vectors with integer ids, for exact cosine top-k search.
+
+    The vectors are kept in one contiguous matrix that grows by doubling, so adding vectors is
+    amortized O(1) and a search is a single matrix-vector product followed by a partial sort.
+    The index is not thread-safe; callers serialize access to it.
+    """
+    def __init__(self, dimension: int, capacity: int = 1024):
+        self.dimension = dimension
+        self._matrix = np.zeros((capacity, dimension), dtype=np.float32)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, size: int):
+        capacity = len(self._ids)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        matrix = np.zeros((capacity, self.dimension), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._ids = matrix, ids
+
+    def add(self, ids, vectors: np.ndarray):
+        """Adds vectors with the given ids. Ids are expected to be new to the index."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        end = self._size + len(vectors)
+        self._reserve(end)
+        self._matrix[self._size:end] = vectors
+        self._ids[self._size:end] = ids
+        self._size = end
+
+    def remove(self, ids):
+        """Removes the vectors with the given ids."""
+        keep = ~np.isin(self._ids[:self._size], np.asarray(list(ids), dtype=np.int64))
+        kept = int(keep.sum())
+        self._matrix[:kept] = self._matrix[:self._size][keep]
+        self._ids[:kept] = self._ids[:self._size][keep]
+        self._size = kept
+
+    def search(self, query: np.ndarray, k: int) -> list[tuple[int, float]]:
+        """Returns up to k (id, cosine similarity) pairs, most similar first."""
+        if self._size == 0 or k <= 0:
+            return []
+        scores = self._matrix[:self._size] @ np.asarray(query, dtype=np.float32)
+        if k < self._size:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(self._size)
+        top = top[np.argsort(-scores[top])]
+        return [(int(self._ids[i]), float(scores[i])) for i in top]
@@ -1,15 +1,15 @@
 # aist/skills/dispatcher.py
 import logging
+import hashlib
 import json
-from thefuzz import fuzz
 import re
-import multiprocessing
-import queue
 from aist.core.config_manager import config
 from aist.core.ipc.protocol import STATE_DORMANT, STATE_LISTENING
-from aist.skills import skill_loader
-from aist.core.llm import process_with_llm, summarize_system_output
+from aist.skills import skill_loader, worker_pool
+from aist.skills.phrase_index import PhraseIndex, normalize_phrase
+from aist.core.llm import process_with_llm, fit_to_prompt, process_with_cached_prefix, process_with_schema, summarize_system_output, router_prefix_cache, GenerationCancelled
 from aist.core.memory import retrieve_relevant_facts, store_fact
+from aist.core.decision_cache import initialize_decision_cache
 
 log = logging.getLogger(__name__)
 
@@ -19,69 +19,58 @@ exit_phrases = config.get('assistant.exit_phrases', [])
 deactivation_phrases = config.get('assistant.deactivation_phrases', [])
 fuzzy_match_threshold = config.get('assistant.fuzzy_match_threshold', 85)
 skill_timeout = config.get('assistant.skill_timeout', 5)
+constrained_routing = config.get('models.llm.constrained_routing', True)
+semantic_match_threshold = config.get('assistant.semantic_match_threshold', 0.75)
 
-def _is_fuzzy_match(text: str, phrases: list[str]) -> bool:
-    """Checks if the text is a fuzzy match for any of the provided phrases."""
-    if not text or not phrases:
-        return False
-    # We use partial_ratio to be more forgiving of extra words.
-    # token_set_ratio is better for matching phrases with different word order.
-    for phrase in phrases:
-        similarity = fuzz.token_set_ratio(text.lower(), phrase.lower())
-        if similarity >= fuzzy_match_threshold:
-            log.info(f"Fuzzy match successful for '{text}' with '{phrase}' (Similarity: {similarity}%)")
-            return True
+# Control phrases are fixed by the config, so their indexes are built once.
+exit_index = PhraseIndex.from_phrases(exit_phrases, fuzzy_match_threshold)
+activation_index = PhraseIndex.from_phrases(activation_phrases, fuzzy_match_threshold)
+deactivation_index = PhraseIndex.from_phrases(deactivation_phrases, fuzzy_match_threshold)
+summarize_index = PhraseIndex.from_phrases(["summarize this conversation", "what have we talked about", "give me a summary"], fuzzy_match_threshold)
+
+def _is_fuzzy_match(query: str, index: PhraseIndex, strict: bool = False) -> bool:
+    """Checks if the normalized query is a fuzzy match for any phrase in the index."""
+    match = index.match(query, strict)
+    if match:
+        _label, similarity, phrase = match
+        log.info(f"Fuzzy match successful for '{query}' with '{phrase}' (Similarity: {similarity:.0f}%)")
+        return True
     return False
 
-def _find_fast_path_intent(command_text: str):
+def _find_fast_path_intent(query: str, strict: bool = False):
     """
-    Checks if the command text is a fuzzy match for any registered intent phrases.
+    Checks if the normalized query is a fuzzy match for any registered intent phrases.
     This is the "fast path" that avoids using the LLM for simple, known commands.
     """
-    for intent_name, intent_data in skill_loader.skill_manager.intents.items():
-        if _is_fuzzy_match(command_text, intent_data.get("phrases", [])):
-            log.info(f"Fast-path intent match found: '{intent_name}'")
-            return intent_name, intent_data
-    return None, None
+    match = skill_loader.skill_manager.phrase_index.match(query, strict)
+    if not match:
+        return None, None
+    intent_name, similarity, phrase = match
+    log.info(f"Fast-path intent match found: '{intent_name}' ('{phrase}', Similarity: {similarity:.0f}%)")
+    return intent_name, skill_loader.skill_manager.intents[intent_name]
 
-def _skill_process_wrapper(skill_id, handler_name, params, result_queue):
+def _find_semantic_intent(command_text: str):
     """
-    This function runs in a separate process to execute a skill handler.
-    It isolates the skill from the main backend process and captures exceptions.
+    Checks if the command is semantically close to a registered intent phrase, using embeddings.
+    This catches paraphrases of known commands that the fuzzy fast path misses, without an LLM call.
+    Intents that declare parameters are left to the LLM, which can extract them.
     """
-    # Re-setup logging for this process to ensure errors are captured.
-    from aist.core.log_setup import setup_logging
-    import importlib
-    import logging
-    setup_logging(is_skill_process=True) # Ensure logging is set up first and correctly configured for a skill process
-    log = logging.getLogger(__name__)
-    log.info(f"Skill process wrapper started for skill: {skill_id}") # Added log
-
-    try:
-        log.info(f"Attempting to load skill module: {skill_id}") # Added log
-        # We need to re-import and create the skill in the new process
-        module_path = f"aist.skills.{skill_id}"
-        skill_module = importlib.import_module(module_path)
-        
-        if not hasattr(skill_module, 'create_skill'):
-            raise RuntimeError(f"Skill '{skill_id}' has no create_skill() function.")
-
-        skill_instance = skill_module.create_skill()
-        skill_instance._register(skill_id) # Properly initialize the skill with its ID
-        handler = getattr(skill_instance, handler_name)
-        log.info(f"Executing handler {handler_name} for skill {skill_id}") # Added log
-        
-        result = handler(params)
-        result_queue.put({"status": "success", "output": result})
-        log.info(f"Skill {skill_id} handler {handler_name} completed successfully.") # Added log
-    except Exception as e:
-        # Log the full error in the child process for debugging
-        log.error(f"Skill '{skill_id}' crashed in isolated process.", exc_info=True)
-        result_queue.put({"status": "error", "output": str(e)})
+    classifier = skill_loader.skill_manager.intent_classifier
+    if classifier is None or not classifier.is_available:
+        return None, None
+    intent_name, score = classifier.classify(command_text)
+    if intent_name is None or score < semantic_match_threshold:
+        log.debug(f"No semantic intent match (best: '{intent_name}', score: {score:.2f}).")
+        return None, None
+    intent_data = skill_loader.skill_manager.intents.get(intent_name)
+    if not intent_data or intent_data.get("parameters"):
+        return None, None
+    log.info(f"Semantic intent match found: '{intent_name}' (score: {score:.2f})")
+    return intent_name, intent_data
 
 def _execute_skill(intent_name: str, intent_data: dict, params: dict, llm, original_command: str):
     """
-    Executes a skill's intent handler in a sandboxed process
+    Executes a skill's intent handler in a sandboxed worker process
     with a timeout and returns a response dictionary.
     """
     skill_id = intent_data.get("skill_id")
@@ -92,28 +81,22 @@ def _execute_skill(intent_name: str, intent_data: dict, params: dict, llm, origi
         log.error(f"Could not execute skill. Invalid intent data: {intent_data}")
         return {"action": "COMMAND", "speak": "I had a problem running that command.", "intent": response_intent}
     
-    result_queue = multiprocessing.Queue()
-    process = multiprocessing.Process(
-        target=_skill_process_wrapper,
-        args=(skill_id, handler.__name__, params, result_queue),
-        daemon=False # Child process should not outlive parent
-    )
-    
-    log.info(f"Executing skill '{skill_id}' in a sandboxed process.")
-    process.start()
-    process.join(timeout=skill_timeout)
-
-    if process.is_alive():
-        log.warning(f"Skill '{skill_id}' timed out after {skill_timeout} seconds. Terminating.")
-        process.terminate()
-        process.join() # Clean up the terminated process
-        return {"action": "COMMAND", "speak": f"The {skill_id} skill took too long to respond.", "intent": response_intent}
+    pool = worker_pool.skill_worker_pool or worker_pool.initialize_skill_worker_pool(list(skill_loader.skill_manager.skills))
 
     try:
-        result = result_queue.get_nowait()
+        log.info(f"Executing skill '{skill_id}' in a sandboxed worker.")
+        result = pool.run(skill_id, handler.__name__, params, timeout=skill_timeout)
         status = result.get("status")
         output = result.get("output")
 
+        if status == "timeout":
+            log.warning(f"Skill '{skill_id}' timed out after {skill_timeout} seconds. Worker terminated.")
+            return {"action": "COMMAND", "speak": f"The {skill_id} skill took too long to respond.", "intent": response_intent}
+
+        if status == "crash":
+            log.error(f"Skill '{skill_id}' terminated unexpectedly without a result (crash). Exit code: {result.get('exitcode')}")
+            return {"action": "COMMAND", "speak": f"The {skill_id} skill crashed.", "intent": response_intent}
+
         if status == "error":
             log.error(f"Skill '{skill_id}' executed with an error: {output}")
             return {"action": "COMMAND", "speak": f"I encountered an error with the {skill_id} skill.", "intent": response_intent}
@@ -127,15 +110,18 @@ def _execute_skill(intent_name: str, intent_data: dict, params: dict, llm, origi
 
         return {"action": "COMMAND", "speak": speak_text, "intent": response_intent}
 
-    except queue.Empty:
-        log.error(f"Skill '{skill_id}' terminated unexpectedly without a result (crash). Exit code: {process.exitcode}")
-        return {"action": "COMMAND", "speak": f"The {skill_id} skill crashed.", "intent": response_intent}
+    except GenerationCancelled:
+        raise
     except Exception as e:
         log.error(f"An unexpected error occurred while running skill '{skill_id}': {e}", exc_info=True)
         return {"action": "COMMAND", "speak": f"I had a problem running the {skill_id} skill.", "intent": response_intent}
 
-def _get_llm_decision(command_text: str, llm, conversation_history: list):
-    """Asks the LLM to decide which skill to use by returning a JSON object."""
+def _build_router_preamble() -> str:
+    """
+    Builds the static part of the skill-router prompt from the registered intents.
+    It only depends on the skill registry, so it is placed at the start of the prompt
+    where the LLM layer can keep it evaluated between commands.
+    """
     # Build a list of dictionaries representing the available functions.
     # This is safer than manual string formatting as it handles escaping automatically.
     prompt_functions_data = []
@@ -159,7 +145,7 @@ def _get_llm_decision(command_text: str, llm, conversation_history: list):
     # Convert the list of dictionaries to a nicely formatted JSON string for the prompt
     functions_json_string = json.dumps(prompt_functions_data, indent=2)
 
-    system_prompt = f"""You are an expert command router. Your job is to determine the user's intent and map it to one of the available functions by generating a JSON object.
+    return f"""[INST] You are an expert command router. Your job is to determine the user's intent and map it to one of the available functions by generating a JSON object.
 Respond with a single, valid JSON object and nothing else.
 
 Here are the available functions in JSON format:
@@ -169,13 +155,96 @@ Example of how to respond:
 User's command: "what is the current time?"
 Your JSON response: {{"function": "get_current_time", "parameters": {{}}}}
 
-Now, process the following command.
 IMPORTANT: If the user is making a statement or asking a general question that does not map to a function, you MUST use the 'chat' function.
 Do NOT call a function unless the user's intent is explicit.
 Based on the user's command, choose the single best function to call.
 Your response must be a single JSON object containing the function's name and a dictionary of any extracted parameters.
-Your JSON response:"""
-    response_text = process_with_llm(llm, command_text, conversation_history, [], system_prompt_override=system_prompt)
+"""
+
+def _build_router_schema() -> dict[str, list[str]]:
+    """
+    Builds the schema for constrained routing: each function name mapped to its parameter names.
+    'chat' takes no parameters here because the dispatcher always uses the original command for it.
+    """
+    schema = {
+        name: [p["name"] for p in data.get('parameters', [])]
+        for name, data in skill_loader.skill_manager.intents.items()
+    }
+    schema["chat"] = []
+    return schema
+
+# The router preamble and schema, cached together with the registry version they were built for.
+_router_preamble = (None, "", {}, "")
+
+def _get_router_preamble():
+    """
+    Returns the registry version, the router preamble, the router schema and a fingerprint
+    of the catalog, rebuilding them if the registry changed.
+    """
+    global _router_preamble
+    version = skill_loader.skill_manager.version
+    if _router_preamble[0] != version:
+        preamble, schema = _build_router_preamble(), _build_router_schema()
+        # Unlike the version, the fingerprint stays the same across restarts while the
+        # catalog and the model don't change, so persisted decisions remain valid.
+        material = json.dumps([config.get('models.llm.path', ''), preamble, schema], sort_keys=True)
+        _router_preamble = (version, preamble, schema, hashlib.sha256(material.encode('utf-8')).hexdigest())
+    return _router_preamble
+
+def _router_suffix_head(earlier_messages: list) -> str:
+    """Returns the start of the router suffix: everything before the command itself."""
+    history_text = ""
+    if earlier_messages:
+        history_text = "Recent conversation:\n" + "\n".join(f"{msg['role']}: {msg['content']}" for msg in earlier_messages) + "\n\n"
+    return f"""
+Now, process the following command.
+{history_text}"""
+
+def prime_router(llm, conversation_history: list):
+    """
+    Evaluates the router prompt up to where the next command goes, so routing the next
+    command only evaluates the command itself. Call it while the assistant is idle.
+    """
+    if llm is None or not skill_loader.skill_manager:
+        return
+    version, preamble, _schema, _fingerprint = _get_router_preamble()
+    router_prefix_cache.get_tokens(llm, version, preamble)
+    router_prefix_cache.prime(llm, _router_suffix_head(conversation_history))
+
+def _get_llm_decision(command_text: str, llm, conversation_history: list):
+    """
+    Asks the LLM to decide which skill to use by returning a JSON object.
+    Decisions are cached, so a repeated command skips the LLM.
+    """
+    version, preamble, schema, fingerprint = _get_router_preamble()
+
+    # Only the history and the command change between requests. The server has already
+    # added the current command to the history, so it is not repeated here.
+    earlier_messages = conversation_history
+    if earlier_messages and earlier_messages[-1].get("role") == "user" and earlier_messages[-1].get("content") == command_text:
+        earlier_messages = earlier_messages[:-1]
+
+    cache = initialize_decision_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(fingerprint, normalize_phrase(command_text), earlier_messages)
+        decision = cache.get(cache_key)
+        if decision is not None:
+            log.info(f"Using cached router decision for '{command_text}': {json.dumps(decision)}")
+            return decision
+
+    suffix = f"""{_router_suffix_head(earlier_messages)}User's command: "{command_text}"
+Your JSON response: [/INST]"""
+
+    if constrained_routing:
+        decision = process_with_schema(llm, version, preamble, suffix, schema)
+        if decision is not None:
+            if cache_key is not None:
+                cache.put(cache_key, decision)
+            return decision
+        log.warning("Constrained routing failed. Falling back to free-form generation.")
+
+    response_text = process_with_cached_prefix(llm, version, preamble, suffix)
     try:
         # Use a regex to find the first JSON object in the response. This is more
         # robust than string stripping, as it handles markdown and other text.
@@ -183,74 +252,118 @@ Your JSON response:"""
         if not json_match:
             raise json.JSONDecodeError("No JSON object found in LLM response", response_text, 0)
         decision = json.loads(json_match.group(0))
+        # Only decisions for known functions are worth repeating.
+        if cache_key is not None and isinstance(decision, dict) and decision.get("function") in schema:
+            cache.put(cache_key, decision)
         return decision
     except (json.JSONDecodeError, TypeError):
         log.warning(f"LLM did not return valid JSON for skill selection. Output: '{response_text}'")
         # Fallback to chat if the LLM fails to produce valid JSON
         return {"function": "chat", "parameters": {"user_query": command_text}}
 
-def command_dispatcher(command_text: str, state: str, llm, conversation_history: list):
+def _chat_response(command_text: str, llm, conversation_history: list, on_token=None):
     """
-    The main dispatcher for routing user commands based on state and intent.
+    Answers the command conversationally, using relevant facts from memory.
+    If `on_token` is given, the response is streamed and each token is passed to it
+    as soon as it is generated. The full response is still returned in 'speak'.
     """
+    relevant_facts = retrieve_relevant_facts(command_text)
+    response = {"action": "COMMAND", "intent": {"name": "chat", "params": {"user_query": command_text}}}
+    if on_token is None:
+        response["speak"] = process_with_llm(llm, command_text, conversation_history, relevant_facts)
+        return response
+
+    tokens = []
+    for token in process_with_llm(llm, command_text, conversation_history, relevant_facts, stream=True):
+        tokens.append(token)
+        on_token(token)
+    response["speak"] = "".join(tokens)
+    # Tells the frontend that the text has already been delivered as partial responses.
+    response["streamed"] = True
+    return response
+
+def match_quick_command(command_text: str, state: str, llm, partial: bool = False):
+    """
+    Matches the commands that are recognized without the LLM: the exit, activation and
+    deactivation phrases, and fast-path intents. Returns None if the command is none of them.
+    It is also used on partial transcripts (`partial`), to handle these commands before the user
+    has finished speaking. A partial must then match a whole phrase, not just some of its words.
+    """
+    # Normalize once for all fuzzy matching below.
+    query = normalize_phrase(command_text)
+
     # --- Universal Commands (checked in any state) ---
-    if _is_fuzzy_match(command_text, exit_phrases):
+    if _is_fuzzy_match(query, exit_index, partial):
         return {"action": "EXIT", "speak": "Goodbye."}
 
     # --- State-Specific Logic ---
     if state == STATE_DORMANT:
-        if _is_fuzzy_match(command_text, activation_phrases):
+        if _is_fuzzy_match(query, activation_index, partial):
             return {"action": "ACTIVATE", "speak": "Listening."}
-        else:
-            # In dormant state, we ignore anything that isn't an activation or exit phrase.
-            return None
-    
+
     elif state == STATE_LISTENING:
-        if _is_fuzzy_match(command_text, deactivation_phrases):
+        if _is_fuzzy_match(query, deactivation_index, partial):
             return {"action": "DEACTIVATE", "speak": "Okay."}
 
-        # --- Skill / Chat Logic ---
-        # 1. Try the fast path first for simple, registered commands.
-        fast_path_intent_name, fast_path_intent_data = _find_fast_path_intent(command_text)
+        # The fast path handles simple, registered commands.
+        fast_path_intent_name, fast_path_intent_data = _find_fast_path_intent(query, partial)
         if fast_path_intent_data:
             return _execute_skill(fast_path_intent_name, fast_path_intent_data, {}, llm, command_text)
-        
+
+    return None
+
+def command_dispatcher(command_text: str, state: str, llm, conversation_history: list, on_token=None):
+    """
+    The main dispatcher for routing user commands based on state and intent.
+    If `on_token` is given, conversational responses are streamed through it token by token.
+    """
+    # 1. Try the commands that don't need the LLM first.
+    response = match_quick_command(command_text, state, llm)
+    if response is not None:
+        return response
+
+    # In dormant state, we ignore anything that isn't an activation or exit phrase.
+    if state == STATE_LISTENING:
+        # --- Skill / Chat Logic ---
+        query = normalize_phrase(command_text)
+
         # --- Special Case: Summarization ---
         # This is a core function that needs access to the conversation and LLM,
         # so we handle it here instead of in a sandboxed skill process.
-        summarize_phrases = ["summarize this conversation", "what have we talked about", "give me a summary"]
-        if _is_fuzzy_match(command_text, summarize_phrases):
+        if _is_fuzzy_match(query, summarize_index):
             log.info("Handling special case: summarize_conversation")
             if not conversation_history:
                 return {"action": "COMMAND", "speak": "There's nothing to summarize yet."}
             conversation_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in conversation_history])
-            prompt = f"Summarize the following conversation and extract any key facts to be stored in long-term memory:\n{conversation_text}"
-            summary = process_with_llm(llm, prompt, conversation_history, [])
+            # A long conversation loses its oldest turns, never the instruction.
+            prompt = fit_to_prompt(llm, "Summarize the following conversation and extract any key facts to be stored in long-term memory:\n{text}", conversation_text, keep_end=True)
+            summary = process_with_llm(llm, prompt, conversation_history, [], fit_command=False)
             store_fact(f"The user and I had a conversation, which was summarized as: {summary}", source="summarize_conversation")
             return {"action": "COMMAND", "speak": "Okay, I've summarized our conversation and stored the key points in my long-term memory.", "intent": {"name": "summarize_conversation", "params": {}}}
 
-        # 2. If no fast path, use the LLM for complex routing.
+        # 2. Try matching paraphrases of registered commands by embedding similarity.
+        semantic_intent_name, semantic_intent_data = _find_semantic_intent(command_text)
+        if semantic_intent_data:
+            return _execute_skill(semantic_intent_name, semantic_intent_data, {}, llm, command_text)
+
+        # 3. If nothing matched, use the LLM for complex routing.
         log.info("No fast-path match. Consulting LLM for intent...")
         decision = _get_llm_decision(command_text, llm, conversation_history)
         intent_name = decision.get("function")
         params = decision.get("parameters", {})
 
         if intent_name == "chat":
-            relevant_facts = retrieve_relevant_facts(command_text)
-            chat_response = process_with_llm(llm, command_text, conversation_history, relevant_facts)
-            return {"action": "COMMAND", "speak": chat_response, "intent": {"name": "chat", "params": {"user_query": command_text}}}
+            return _chat_response(command_text, llm, conversation_history, on_token)
         
-        # 3. Execute the skill chosen by the LLM.
+        # 4. Execute the skill chosen by the LLM.
         chosen_intent = skill_loader.skill_manager.intents.get(intent_name)
         if chosen_intent:
             return _execute_skill(intent_name, chosen_intent, params, llm, command_text)
         
     
 
-        # 4. Fallback if the LLM hallucinates a function name.
+        # 5. Fallback if the LLM hallucinates a function name.
         log.warning(f"LLM chose a non-existent function: '{intent_name}'. Falling back to chat.")
-        relevant_facts = retrieve_relevant_facts(command_text)
-        chat_response = process_with_llm(llm, command_text, conversation_history, relevant_facts)
-        return {"action": "COMMAND", "speak": chat_response, "intent": {"name": "chat", "params": {"user_query": command_text}}}
+        return _chat_response(command_text, llm, conversation_history, on_token)
 
     return None # Default case, should not be reached
\ No newline at end of file
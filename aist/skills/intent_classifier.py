@@ -0,0 +1,44 @@
+# aist/skills/intent_classifier.py
+import logging
+import numpy as np
+from aist.core.embeddings import get_embedder
+
+log = logging.getLogger(__name__)
+
+class IntentClassifier:
+    """
+    Matches commands to intents by the cosine similarity of sentence embeddings.
+    Every registered intent phrase is embedded once into a single matrix, so classifying
+    a command costs one embedding and one matrix-vector product.
+    """
+    def __init__(self, intents: dict):
+        self.embedder = get_embedder()
+        self.intent_names = []
+        self.phrase_owners = np.zeros(0, dtype=np.int64)
+        self.matrix = None
+        if self.embedder is None:
+            return
+
+        phrases = []
+        owners = []
+        for intent_name, intent_data in intents.items():
+            self.intent_names.append(intent_name)
+            for phrase in intent_data.get("phrases", []):
+                phrases.append(phrase.lower())
+                owners.append(len(self.intent_names) - 1)
+        self.phrase_owners = np.array(owners, dtype=np.int64)
+        self.matrix = self.embedder.embed(phrases)
+        log.info(f"Intent classifier built with {len(phrases)} phrases for {len(self.intent_names)} intents.")
+
+    @property
+    def is_available(self) -> bool:
+        return self.matrix is not None and len(self.matrix) > 0
+
+    def classify(self, text: str) -> tuple[str | None, float]:
+        """Returns the best matching intent name and its cosine similarity."""
+        if not self.is_available or not text:
+            return None, 0.0
+        query = self.embedder.embed([text.lower()])[0]
+        scores = self.matrix @ query
+        best = int(np.argmax(scores))
+        return self.intent_names[self.phrase_owners[best]], float(scores[best])
@@ -0,0 +1,78 @@
+# aist/skills/phrase_index.py
+import logging
+from collections import defaultdict
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+
+log = logging.getLogger(__name__)
+
+def normalize_phrase(text: str) -> str:
+    """Lowercases the text, replaces punctuation with spaces and trims it."""
+    return default_process(text or "")
+
+class PhraseIndex:
+    """
+    A precompiled index of phrases for fuzzy matching, each phrase labelled with the
+    intent (or command group) it belongs to.
+
+    Phrases are normalized once when they are added. Matching first scores the phrases that
+    share a word with the text (found through an inverted word index), and only scores every
+    phrase when none of those match, since a misheard command may share no word with its
+    phrase. Scoring is done in one batch call per pass.
+    """
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.phrases = []
+        self.labels = []
+        self.token_index = defaultdict(set)
+
+    @classmethod
+    def from_phrases(cls, phrases: list[str], threshold: float, label: str = None) -> "PhraseIndex":
+        """Builds an index where every phrase has the same label."""
+        index = cls(threshold)
+        index.add(label, phrases)
+        return index
+
+    def add(self, label, phrases: list[str]):
+        """Adds phrases for the given label."""
+        for phrase in phrases:
+            normalized = normalize_phrase(phrase)
+            if not normalized:
+                continue
+            for token in set(normalized.split()):
+                self.token_index[token].add(len(self.phrases))
+            self.phrases.append(normalized)
+            self.labels.append(label)
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def match(self, query: str, strict: bool = False):
+        """
+        Finds the best matching phrase for an already normalized query (see `normalize_phrase`).
+        Returns a (label, score, phrase) tuple, or None if no phrase reaches the threshold.
+
+        By default the words of the query and the phrase are compared as sets, so a phrase also
+        matches a query that only contains some of its words ("assist" matches "assist exit").
+        With `strict`, the whole query is compared to the whole phrase, which partial transcripts
+        need: they are the start of a command, not the command.
+        """
+        if not query or not self.phrases:
+            return None
+
+        scorer = fuzz.ratio if strict else fuzz.token_set_ratio
+        candidates = set()
+        for token in set(query.split()):
+            candidates.update(self.token_index.get(token, ()))
+        result = None
+        if candidates:
+            choices = {i: self.phrases[i] for i in candidates}
+            result = process.extractOne(query, choices, scorer=scorer, processor=None, score_cutoff=self.threshold)
+        if result is None and len(candidates) < len(self.phrases):
+            # Fuzzy matches don't always share a whole word with their phrase (e.g. misheard
+            # words), so the other phrases are scored too.
+            result = process.extractOne(query, self.phrases, scorer=scorer, processor=None, score_cutoff=self.threshold)
+        if result:
+            phrase, score, i = result
+            return self.labels[i], score, phrase
+        return None
@@ -1,10 +1,14 @@
 # aist/skills/skill_loader.py
 import os
+import hashlib
 import importlib
 import json
 import logging
 from pathlib import Path
 from aist.core.ipc.protocol import INIT_STATUS_UPDATE # New import
+from aist.core.config_manager import config
+from aist.skills.intent_classifier import IntentClassifier
+from aist.skills.phrase_index import PhraseIndex
 
 log = logging.getLogger(__name__)
 
@@ -13,8 +17,39 @@ class SkillManager:
         self.skills_dir = Path(skills_dir)
         self.skills = {}
         self.intents = {}
+        # A hash of the registered intent definitions, so caches built from the registry are
+        # invalidated whenever an intent, its phrases or its parameters change.
+        self.version = self._compute_version()
         self.event_broadcaster = event_broadcaster # Store the broadcaster
+        self.intent_classifier = None
+        self.phrase_index = None
         self._load_skills()
+        self._build_phrase_index()
+        self._build_intent_classifier()
+
+    def _build_phrase_index(self):
+        """Compiles all registered intent phrases into one index for the dispatcher's fast path."""
+        self.phrase_index = PhraseIndex(config.get('assistant.fuzzy_match_threshold', 85))
+        for intent_name, intent_data in self.intents.items():
+            self.phrase_index.add(intent_name, intent_data["phrases"])
+        log.info(f"Phrase index built with {len(self.phrase_index)} phrases.")
+
+    def _build_intent_classifier(self):
+        """Embeds all registered intent phrases for the dispatcher's semantic matching tier."""
+        try:
+            self.intent_classifier = IntentClassifier(self.intents)
+        except Exception as e:
+            log.error(f"Failed to build the intent classifier: {e}", exc_info=True)
+            self.intent_classifier = None
+
+    def _compute_version(self) -> str:
+        """Hashes everything about the registered intents except their handlers."""
+        definitions = [
+            [name, data["skill_id"], data["phrases"], data["parameters"]]
+            for name, data in sorted(self.intents.items())
+        ]
+        material = json.dumps(definitions, sort_keys=True, default=str)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()[:16]
 
     def _register_intent(self, skill_id, intent_name, intent_data):
         """Internal method to register an intent from a skill."""
@@ -30,6 +65,7 @@ class SkillManager:
             "handler": handler,
             "parameters": intent_data.get("parameters", [])
         }
+        self.version = self._compute_version()
         log.info(f"Registered intent '{intent_name}' for skill '{skill_id}'.")
 
     def _load_skills(self):
@@ -0,0 +1,215 @@
+# aist/skills/worker_pool.py
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from aist.core.config_manager import config
+
+log = logging.getLogger(__name__)
+
+# Seconds to wait before trying again when a replacement worker fails to start.
+SPAWN_RETRY_DELAY = 1.0
+
+def _worker_main(conn, skill_ids):
+    """
+    The main loop of a sandboxed skill worker process.
+    It sets up logging and loads the skills once, then runs skill handlers for jobs
+    received over the pipe until it receives None or the pipe is closed.
+    """
+    # Re-setup logging for this process to ensure errors are captured.
+    from aist.core.log_setup import setup_logging
+    from aist.core import memory
+    import importlib
+    import logging
+    setup_logging(is_skill_process=True)
+    log = logging.getLogger(__name__)
+
+    skills = {}
+    def _get_skill(skill_id):
+        if skill_id not in skills:
+            skill_module = importlib.import_module(f"aist.skills.{skill_id}")
+            if not hasattr(skill_module, 'create_skill'):
+                raise RuntimeError(f"Skill '{skill_id}' has no create_skill() function.")
+            skill_instance = skill_module.create_skill()
+            skill_instance._register(skill_id) # Properly initialize the skill with its ID
+            skills[skill_id] = skill_instance
+        return skills[skill_id]
+
+    for skill_id in skill_ids:
+        try:
+            _get_skill(skill_id)
+        except Exception:
+            log.error(f"Skill worker failed to preload skill '{skill_id}'.", exc_info=True)
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+
+        skill_id, handler_name, params = job
+        try:
+            handler = getattr(_get_skill(skill_id), handler_name)
+            log.info(f"Executing handler {handler_name} for skill {skill_id}")
+            result = {"status": "success", "output": handler(params)}
+        except Exception as e:
+            # Log the full error in the child process for debugging
+            log.error(f"Skill '{skill_id}' crashed in isolated process.", exc_info=True)
+            result = {"status": "error", "output": str(e)}
+        # Facts stored by the skill are committed before the result is returned,
+        # so the backend can read them right away.
+        try:
+            memory.flush_memory_store()
+        except Exception:
+            log.error("Skill worker failed to write stored facts to memory.", exc_info=True)
+        conn.send(result)
+
+    memory.close_memory_store()
+
+class _SkillWorker:
+    """A single pre-started skill worker process and the parent's end of its pipe."""
+    def __init__(self, skill_ids):
+        self.conn, child_conn = multiprocessing.Pipe()
+        # Daemonic, so a worker the pool didn't get to stop is terminated when the backend exits
+        # instead of keeping it alive (the exit would wait for it).
+        self.process = multiprocessing.Process(target=_worker_main, args=(child_conn, skill_ids), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs_done = 0
+
+    def stop(self):
+        """Asks the worker to exit, terminating it if it does not."""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+class SkillWorkerPool:
+    """
+    A pool of warm, sandboxed worker processes for running skill handlers.
+
+    Workers keep their skill instances loaded between jobs, so a skill call costs a pipe
+    round trip instead of a process start. A worker that times out or crashes is killed
+    and replaced, and every worker is replaced after a number of jobs to limit the impact
+    of leaks in skills. Workers are replaced in the background, after the result has been
+    returned, so the command that triggered it doesn't wait for the new process to start.
+    """
+    def __init__(self, skill_ids: list[str], size: int = 2, max_jobs_per_worker: int = 100):
+        self.skill_ids = list(skill_ids)
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._idle = queue.Queue()
+        self._replacements = []
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(max(1, size)):
+            self._idle.put(_SkillWorker(self.skill_ids))
+        log.info(f"Skill worker pool started with {max(1, size)} workers.")
+
+    def _replace(self, worker: _SkillWorker, kill: bool):
+        """Stops a worker and starts a new one in its place on a background thread."""
+        def _run():
+            if kill:
+                worker.kill()
+            else:
+                worker.stop()
+            while True:
+                with self._lock:
+                    if self._closed:
+                        return
+                    try:
+                        new_worker = _SkillWorker(self.skill_ids)
+                        break
+                    except Exception:
+                        log.error("Failed to start a replacement skill worker. Retrying.", exc_info=True)
+                time.sleep(SPAWN_RETRY_DELAY)
+            self._idle.put(new_worker)
+
+        thread = threading.Thread(target=_run, daemon=True)
+        with self._lock:
+            self._replacements = [t for t in self._replacements if t.is_alive()]
+            self._replacements.append(thread)
+        thread.start()
+
+    def run(self, skill_id: str, handler_name: str, params: dict, timeout: float) -> dict:
+        """
+        Runs a skill handler on an idle worker and returns a result dictionary with a
+        'status' of 'success', 'error', 'timeout' or 'crash'. If no worker becomes idle within
+        `timeout`, e.g. because replacements fail to start, the result is a 'crash'.
+        """
+        if self._closed:
+            return {"status": "error", "output": "The skill worker pool has been shut down."}
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            log.error(f"No skill worker became available within {timeout} seconds.")
+            return {"status": "crash", "exitcode": None}
+        with self._lock:
+            closed = self._closed
+        if closed:
+            # The pool was shut down while this job waited, and has already stopped its idle workers.
+            worker.stop()
+            return {"status": "error", "output": "The skill worker pool has been shut down."}
+        try:
+            worker.conn.send((skill_id, handler_name, params))
+            if not worker.conn.poll(timeout):
+                self._replace(worker, kill=True)
+                return {"status": "timeout"}
+            result = worker.conn.recv()
+        except (EOFError, OSError):
+            # The worker has usually exited already, so this doesn't wait.
+            worker.process.join(timeout=0.1)
+            exitcode = worker.process.exitcode
+            self._replace(worker, kill=True)
+            return {"status": "crash", "exitcode": exitcode}
+        worker.jobs_done += 1
+        if worker.jobs_done >= self.max_jobs_per_worker:
+            log.debug("Recycling skill worker after reaching its job limit.")
+            self._replace(worker, kill=False)
+            return result
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._idle.put(worker)
+        if closed:
+            worker.stop()
+        return result
+
+    def shutdown(self):
+        """Stops all idle workers and the workers being replaced."""
+        with self._lock:
+            self._closed = True
+            replacements = list(self._replacements)
+        for thread in replacements:
+            thread.join(timeout=2)
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
+        log.info("Skill worker pool stopped.")
+
+# Global instance for easy access across the application
+skill_worker_pool = None
+
+def initialize_skill_worker_pool(skill_ids: list[str]):
+    """Initializes the global skill worker pool."""
+    global skill_worker_pool
+    if skill_worker_pool is None:
+        skill_worker_pool = SkillWorkerPool(
+            skill_ids,
+            size=config.get('assistant.skill_workers', 2),
+            max_jobs_per_worker=config.get('assistant.skill_worker_max_jobs', 100),
+        )
+    return skill_worker_pool
@@ -2,13 +2,12 @@
 import logging
 import json
 import os
-import pyaudio
 import vosk
-import numpy as np
 import time
 
 from aist.core.audio import audio_manager
-from aist.core.events import bus, STT_TRANSCRIBED, TTS_STARTED, TTS_FINISHED, STATE_CHANGED, VAD_STATUS_CHANGED
+from aist.core.events import bus, STT_TRANSCRIBED, STT_PARTIAL, TTS_STARTED, TTS_FINISHED, STATE_CHANGED
+from aist.core.vad import create_vad
 from aist.core.config_manager import config
 from .base import BaseSTTProvider
 
@@ -78,11 +77,6 @@ class VoskProvider(BaseSTTProvider):
         current_recognizer = recognizer_dormant
         current_state = STATE_DORMANT
 
-        p = audio_manager.get_pyaudio()
-        if not p:
-            log.error("PyAudio instance not available. Cannot start listening.")
-            return
-
         def _pause_listening():
             nonlocal is_tts_active
             is_tts_active = True
@@ -103,17 +97,14 @@ class VoskProvider(BaseSTTProvider):
             elif state == STATE_DORMANT:
                 current_recognizer = recognizer_dormant
 
-        stream = None
-        try:
-            try:
-                stream = p.open(format=pyaudio.paInt16, channels=1, rate=16000, input=True, frames_per_buffer=4096)
-            except OSError as e:
-                log.fatal(f"FATAL: Could not open microphone stream: {e}")
-                log.fatal("Please ensure you have a microphone connected and configured as the default input device.")
-                return
+        # The microphone is captured once for the whole application. Vosk reads it at its own pace.
+        reader = audio_manager.open_reader()
+        if not reader:
+            log.error("Microphone capture not available. Cannot start listening.")
+            return
 
-            stream.start_stream()
-            log.info("Microphone stream opened for Vosk.")
+        try:
+            log.info("Reading the microphone for Vosk.")
 
             bus.subscribe(_pause_listening, TTS_STARTED)
             bus.subscribe(_resume_listening, TTS_FINISHED)
@@ -122,68 +113,63 @@ class VoskProvider(BaseSTTProvider):
             # Signal that the STT provider is initialized and ready to receive events.
             self.stt_ready_event.set()
 
-            energy_threshold = config.get('audio.stt.energy_threshold', 300)
-            last_vad_status = "silence"
+            vad = create_vad()
+            publish_partials = config.get('audio.stt.partials.enabled', True)
+
+            def _publish_result(result_json: str):
+                result_dict = json.loads(result_json)
+
+                # Only perform a strict confidence check when actively listening for commands.
+                # For the DORMANT state, we allow lower-confidence results to pass through
+                # to the fuzzy matcher, which is better at handling wake-word variations.
+                words = result_dict.get('result', [])
+                if words and current_state == STATE_LISTENING:
+                    total_confidence = sum(item['conf'] for item in words)
+                    average_confidence = total_confidence / len(words)
+
+                    confidence_threshold = config.get('audio.stt.confidence_threshold', 0.85)
+                    if average_confidence < confidence_threshold:
+                        log.warning(f"Low confidence transcription ignored (conf: {average_confidence:.2f}): '{result_dict.get('text', '')}'")
+                        return
+
+                transcribed_text = result_dict.get('text', '').strip().lower()
+                
+                if transcribed_text:
+                    log.info(f"Heard with high confidence: '{transcribed_text}'")
+                    bus.sendMessage(STT_TRANSCRIBED, text=transcribed_text)
 
             while self.app_state.is_running:
-                data = stream.read(2048, exception_on_overflow=False)
+                data = reader.read(2048, timeout=0.5)
+                if not data and reader.ring.closed:
+                    log.info("The audio source was closed.")
+                    break
 
                 if is_tts_active:
+                    vad.reset()
                     continue
 
                 if not data:
                     continue
-                
-                audio_chunk_np = np.frombuffer(data, dtype=np.int16)
-                if audio_chunk_np.size == 0:
-                    continue
-                
-                try:
-                    energy = np.sqrt(np.mean(audio_chunk_np.astype(np.float64)**2))
-                except RuntimeWarning:
-                    energy = 0.0
-                
-                if energy > energy_threshold:
-                    if last_vad_status == "silence":
-                        bus.sendMessage(VAD_STATUS_CHANGED, status="speech")
-                        last_vad_status = "speech"
-                else:
-                    if last_vad_status == "speech":
-                        bus.sendMessage(VAD_STATUS_CHANGED, status="silence")
-                        last_vad_status = "silence"
-                    continue
 
-                if current_recognizer.AcceptWaveform(data):
-                    result_json = current_recognizer.Result()
-                    result_dict = json.loads(result_json)
-
-                    # Only perform a strict confidence check when actively listening for commands.
-                    # For the DORMANT state, we allow lower-confidence results to pass through
-                    # to the fuzzy matcher, which is better at handling wake-word variations.
-                    words = result_dict.get('result', [])
-                    if words and current_state == STATE_LISTENING:
-                        total_confidence = sum(item['conf'] for item in words)
-                        average_confidence = total_confidence / len(words)
-
-                        confidence_threshold = config.get('audio.stt.confidence_threshold', 0.85)
-                        if average_confidence < confidence_threshold:
-                            log.warning(f"Low confidence transcription ignored (conf: {average_confidence:.2f}): '{result_dict.get('text', '')}'")
-                            continue
-
-                    transcribed_text = result_dict.get('text', '').strip().lower()
-                    
-                    if transcribed_text:
-                        log.info(f"Heard with high confidence: '{transcribed_text}'")
-                        bus.sendMessage(STT_TRANSCRIBED, text=transcribed_text)
+                # Only speech reaches the recognizer. The VAD publishes VAD_STATUS_CHANGED itself.
+                for speech, ended in vad.process(data):
+                    if current_recognizer.AcceptWaveform(speech):
+                        _publish_result(current_recognizer.Result())
+                    elif publish_partials and not ended:
+                        # The utterance isn't over yet. Publish the recognizer's current hypothesis
+                        # after every chunk, so commands can be matched once it stops changing.
+                        partial_text = json.loads(current_recognizer.PartialResult()).get('partial', '').strip().lower()
+                        if partial_text:
+                            bus.sendMessage(STT_PARTIAL, text=partial_text)
+
+                    if ended:
+                        # The VAD heard the end of the utterance, so it is finished right away
+                        # instead of when the recognizer hears the next one.
+                        _publish_result(current_recognizer.FinalResult())
 
         except Exception as e:
             log.error(f"An error occurred in the Vosk listening loop: {e}", exc_info=True)
         finally:
-            if stream:
-                stream.stop_stream()
-                stream.close()
-                log.info("Microphone stream closed.")
-            
             bus.unsubscribe(_pause_listening, TTS_STARTED)
             bus.unsubscribe(_resume_listening, TTS_FINISHED)
             bus.unsubscribe(_handle_state_change, STATE_CHANGED)
\ No newline at end of file
@@ -1,24 +1,31 @@
 # aist/stt_providers/whisper_provider.py
 import logging
-import torch
-import whisper
 import numpy as np
 import threading
 import time
 import os
 from queue import Queue, Empty
-import speech_recognition as sr
 import noisereduce as nr
 import soundfile as sf
 import tempfile
 from scipy.io.wavfile import write as write_wav
 
-from aist.core.events import bus, STT_TRANSCRIBED, TTS_STARTED, TTS_FINISHED, VAD_STATUS_CHANGED
+from aist.core.events import bus, STT_TRANSCRIBED, STT_PARTIAL, TTS_STARTED, TTS_FINISHED
+from aist.core.vad import create_vad
+from aist.core.audio import audio_manager, CAPTURE_SAMPLE_RATE, CAPTURE_SAMPLE_WIDTH
 from aist.core.config_manager import config
 from .base import BaseSTTProvider
+from .whisper_backends import load_whisper_backend
 
 log = logging.getLogger(__name__)
 
+# Whisper decodes at most 30 seconds of audio at a time. With partial transcripts, phrases are
+# only cut there, since a shorter cut would end most commands before a partial is stable.
+MAX_PHRASE_SECONDS = 30
+
+class PhraseTimeoutError(Exception):
+    """Raised when no phrase starts within the listen timeout."""
+
 class WhisperProvider(BaseSTTProvider):
     """
     The Whisper STT engine provider. It uses a more advanced VAD (Voice Activity Detection)
@@ -29,10 +36,19 @@ class WhisperProvider(BaseSTTProvider):
         super().__init__(app_state, stt_ready_event)
         self.model = self._load_model()
         self.audio_queue = Queue()
-        self.recognizer = sr.Recognizer()
-        self.microphone = sr.Microphone() # Initialize the Microphone once
+        # The microphone is captured once for the whole application. Whisper reads it at its own pace.
+        self.reader = audio_manager.open_reader()
         self.noise_profile = None
         self._calibrate_noise() # Calibrate noise on initialization
+        # Partial transcripts are decoded by their own worker, which only ever works on the newest audio.
+        self._partial_condition = threading.Condition()
+        self._partial_audio = None
+        self._utterance = 0
+        # Speech the VAD returned after the end of the last phrase, which belongs to the next one.
+        self._leftover_pieces = []
+        # The final transcription and partial decodes share the model, which can run as many
+        # transcriptions at once as its backend allows (faster-whisper's num_workers).
+        self._model_slots = threading.BoundedSemaphore(getattr(self.model, "max_concurrency", 1))
 
     def _calibrate_noise(self):
         """
@@ -65,18 +81,18 @@ class WhisperProvider(BaseSTTProvider):
 
         log.info(f"No noise profile found or failed to load. Calibrating noise for {noise_calibration_duration} seconds. Please be quiet.")
         try:
-            with self.microphone as source:
-                # Adjust for ambient noise for a brief moment before recording the profile
-                self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
-                log.info("Recording ambient noise...")
-                audio = self.recognizer.listen(source, duration=noise_calibration_duration, timeout=noise_calibration_duration + 1)
+            if not self.reader:
+                raise RuntimeError("Microphone capture not available.")
+            log.info("Recording ambient noise...")
+            samples = self.reader.read_exactly(int(noise_calibration_duration * CAPTURE_SAMPLE_RATE), timeout=noise_calibration_duration + 1)
+            if len(samples) == 0:
+                raise PhraseTimeoutError()
             
             # Convert audio data to numpy array for noisereduce
-            # speech_recognition AudioData object needs to be converted to numpy array
-            audio_data_np = np.frombuffer(audio.get_raw_data(), dtype=np.int16).astype(np.float32) / 32768.0
+            audio_data_np = samples.astype(np.float32) / 32768.0
             
             # Save the captured noise to the specified path
-            write_wav(noise_profile_path, audio.sample_rate, audio_data_np)
+            write_wav(noise_profile_path, CAPTURE_SAMPLE_RATE, audio_data_np)
 
             # Load with soundfile for noisereduce compatibility
             data, rate = sf.read(noise_profile_path)
@@ -84,7 +100,7 @@ class WhisperProvider(BaseSTTProvider):
 
             log.info(f"Noise profile created and saved to {noise_profile_path}")
 
-        except sr.WaitTimeoutError:
+        except PhraseTimeoutError:
             log.warning("No ambient noise detected during calibration within the timeout. Noise profile may not be accurate.")
             self.noise_profile = None
         except Exception as e:
@@ -92,28 +108,13 @@ class WhisperProvider(BaseSTTProvider):
             self.noise_profile = None
 
     def _load_model(self):
-        """Loads the Whisper model based on configuration."""
-        model_name = config.get('models.stt.whisper_model_name', 'tiny.en')
-        device = config.get('models.stt.whisper_device', 'cpu')
-        
-        # Set custom cache directory for Whisper models
-        cache_dir = "data/models/stt"
-        os.makedirs(cache_dir, exist_ok=True)
-        # Set WHISPER_MODEL_DIR to manage cache location explicitly
-        os.environ['WHISPER_MODEL_DIR'] = os.path.abspath(cache_dir)
-        
-        log.info(f"Checking for CUDA availability... torch.cuda.is_available() = {torch.cuda.is_available()}")
-        if device == "cuda" and not torch.cuda.is_available():
-            log.warning("CUDA device specified but not available. Falling back to CPU.")
-            device = "cpu"
-        
-        log.info(f"Loading Whisper model '{model_name}' on device '{device}'... This may take a moment.")
-        log.info(f"Model cache directory: {os.environ['WHISPER_MODEL_DIR']}")
+        """Loads the Whisper model with the backend configured in config.yaml."""
         try:
-            model = whisper.load_model(model_name, device=device)
+            model = load_whisper_backend()
             log.info("Whisper model loaded successfully.")
             return model
         except Exception as e:
+            model_name = config.get('models.stt.whisper_model_name', 'tiny.en')
             log.fatal(f"Failed to load Whisper model '{model_name}': {e}", exc_info=True)
             return None
 
@@ -137,8 +138,8 @@ class WhisperProvider(BaseSTTProvider):
                 audio_np = audio_data
 
                 # Transcribe the audio.
-                result = self.model.transcribe(audio_np, fp16=torch.cuda.is_available(), language=config.get('audio.stt.language', 'en'))
-                text = result['text'].strip()
+                with self._model_slots:
+                    text = self.model.transcribe(audio_np)
 
                 # Filter out junk transcriptions that are common with silence.
                 # We check if there is at least one alphabetic character.
@@ -152,6 +153,106 @@ class WhisperProvider(BaseSTTProvider):
             except Exception as e:
                 log.error(f"Error in Whisper transcription worker: {e}", exc_info=True)
 
+    def _prepare_audio(self, raw_audio: bytes, sample_rate: int) -> np.ndarray:
+        """Converts 16-bit PCM audio to the float32 samples Whisper expects, reducing noise if enabled."""
+        audio_data_np = np.frombuffer(raw_audio, dtype=np.int16)
+
+        # Apply noise reduction if enabled and profile exists
+        use_noise_cancellation = config.get('audio.stt.use_noise_cancellation', False)
+        if use_noise_cancellation and self.noise_profile is not None:
+            log.debug("Applying noise reduction...")
+            # noisereduce expects float64, so convert
+            audio_data_float = audio_data_np.astype(np.float64) / 32768.0
+            
+            # Ensure the noise profile matches the sample rate if necessary
+            # For simplicity, assuming sample rates match after calibration.
+            reduced_noise_audio = nr.reduce_noise(y=audio_data_float, sr=sample_rate, y_noise=self.noise_profile, prop_decrease=1.0)
+            
+            # Convert back to float32 for Whisper (expected by model.transcribe)
+            processed_audio = (reduced_noise_audio * 32768.0).astype(np.float32) / 32768.0
+            log.debug("Noise reduction applied.")
+        else:
+            processed_audio = audio_data_np.astype(np.float32) / 32768.0
+            if use_noise_cancellation and self.noise_profile is None:
+                log.warning("Noise cancellation enabled but no profile available. Skipping noise reduction.")
+        return processed_audio
+
+    def _request_partial(self, raw_audio: bytes, sample_rate: int, sample_width: int):
+        """Hands the newest window of the utterance being spoken to the partial worker, replacing any older one."""
+        window_bytes = int(config.get('audio.stt.partials.whisper_window', 4.0) * sample_rate) * sample_width
+        with self._partial_condition:
+            self._partial_audio = (self._utterance, raw_audio[-window_bytes:], sample_rate)
+            self._partial_condition.notify()
+
+    def _partial_worker(self):
+        """
+        Decodes the latest window of the utterance being spoken and publishes it as a partial
+        transcript. Windows that arrive while a decode is running replace each other, so the
+        worker never falls behind the speaker.
+        """
+        while self.app_state.is_running:
+            with self._partial_condition:
+                self._partial_condition.wait_for(lambda: self._partial_audio is not None or not self.app_state.is_running, timeout=1)
+                request, self._partial_audio = self._partial_audio, None
+            if request is None:
+                continue
+            utterance, raw_audio, sample_rate = request
+
+            try:
+                audio = self._prepare_audio(raw_audio, sample_rate)
+                with self._model_slots:
+                    if utterance != self._utterance:
+                        continue # The utterance ended while this window was waiting.
+                    text = self.model.transcribe(audio)
+                if text and any(c.isalpha() for c in text) and utterance == self._utterance:
+                    log.debug(f"Whisper partial: '{text}'")
+                    bus.sendMessage(STT_PARTIAL, text=text)
+            except Exception as e:
+                log.error(f"Error in Whisper partial transcription worker: {e}", exc_info=True)
+
+    def _listen_phrase(self, vad, phrase_time_limit, listen_timeout) -> bytes:
+        """
+        Records one phrase, as delimited by the VAD, and returns its 16-bit PCM audio.
+        Raises PhraseTimeoutError if no speech starts within `listen_timeout` seconds, and cuts
+        phrases at `phrase_time_limit` seconds. While the phrase is spoken, a window of it is
+        decoded every `whisper_interval` seconds for partial transcripts.
+        """
+        bytes_per_second = CAPTURE_SAMPLE_RATE * CAPTURE_SAMPLE_WIDTH
+        interval_bytes = int(config.get('audio.stt.partials.whisper_interval', 0.5) * CAPTURE_SAMPLE_RATE) * CAPTURE_SAMPLE_WIDTH
+        chunks = []
+        size = 0
+        next_partial = interval_bytes
+        waited = 0
+        pieces, self._leftover_pieces = self._leftover_pieces, []
+        while self.app_state.is_running:
+            data = b""
+            if not pieces:
+                data = self.reader.read(1024, timeout=0.5)
+                if not data and self.reader.ring.closed:
+                    break
+                pieces = vad.process(data)
+            # One chunk can end a phrase and start the next, so what follows the end is kept for the next call.
+            for i, (speech, ended) in enumerate(pieces):
+                chunks.append(speech)
+                size += len(speech)
+                if ended:
+                    self._leftover_pieces = pieces[i + 1:]
+                    return b"".join(chunks)
+            pieces = []
+
+            if not chunks:
+                waited += len(data)
+                if listen_timeout and waited > listen_timeout * bytes_per_second:
+                    raise PhraseTimeoutError("listening timed out while waiting for phrase to start")
+                continue
+            if self._stream_partials and size >= next_partial:
+                next_partial = size + interval_bytes
+                self._request_partial(b"".join(chunks), CAPTURE_SAMPLE_RATE, CAPTURE_SAMPLE_WIDTH)
+            if phrase_time_limit and size >= phrase_time_limit * bytes_per_second:
+                vad.reset()
+                return b"".join(chunks)
+        return b""
+
     def run(self):
         """The core loop that listens for voice activity and queues audio for transcription."""
         if not self.model:
@@ -162,6 +263,12 @@ class WhisperProvider(BaseSTTProvider):
         worker_thread = threading.Thread(target=self._transcription_worker, daemon=True)
         worker_thread.start()
 
+        self._stream_partials = config.get('audio.stt.partials.enabled', True)
+        partial_thread = None
+        if self._stream_partials:
+            partial_thread = threading.Thread(target=self._partial_worker, daemon=True)
+            partial_thread.start()
+
         is_tts_active = False
         def _pause_listening():
             nonlocal is_tts_active
@@ -179,105 +286,69 @@ class WhisperProvider(BaseSTTProvider):
         # Signal that the STT provider is initialized and ready to receive events.
         self.stt_ready_event.set()
 
-        # Configure recognizer with settings from config.yaml
-        use_dynamic_energy = config.get('audio.stt.use_dynamic_energy', False)
-        energy_threshold = config.get('audio.stt.whisper_vad.energy_threshold', None) # Can be None for dynamic
-        self.recognizer.pause_threshold = config.get('audio.stt.pause_threshold', 0.8)
-        phrase_time_limit = config.get('audio.stt.whisper_vad.phrase_timeout', 1.0) # Used for sr.listen
+        # Phrases are delimited by the shared VAD, which publishes VAD_STATUS_CHANGED itself.
+        vad = create_vad()
+        phrase_time_limit = config.get('audio.stt.whisper_vad.phrase_timeout', 1.0) # Maximum duration of a phrase
+        if self._stream_partials:
+            phrase_time_limit = MAX_PHRASE_SECONDS
         listen_timeout = config.get('audio.stt.listen_timeout', 1.6)
 
-        last_vad_status = "silence"
-
         try:
-            with self.microphone as source:
-                # Adjust for ambient noise if dynamic energy is enabled
-                if use_dynamic_energy:
-                    log.info("Adjusting for ambient noise...")
-                    self.recognizer.adjust_for_ambient_noise(source)
-                    log.info(f"Set energy threshold to {self.recognizer.energy_threshold} (dynamically adjusted).")
-                elif energy_threshold is not None:
-                    self.recognizer.energy_threshold = energy_threshold
-                    log.info(f"Using manual energy threshold: {self.recognizer.energy_threshold}.")
-                else:
-                    log.info("Using default SpeechRecognition energy threshold (no dynamic adjustment or manual override).")
-
-                log.info(f"Whisper STT listening with pause_threshold={self.recognizer.pause_threshold}, phrase_time_limit={phrase_time_limit}, listen_timeout={listen_timeout}")
-
-                while self.app_state.is_running:
-                    if is_tts_active:
-                        # If TTS is active, don't listen to avoid self-transcription
-                        time.sleep(0.1)
-                        continue
+            if not self.reader:
+                log.error("Microphone capture not available. Cannot start listening.")
+                return
 
-                    try:
-                        # Use listen() with phrase_time_limit and timeout
-                        # The timeout argument in listen() specifies how long to wait for a phrase to start.
-                        # If nothing is said, it returns sr.WaitTimeoutError.
-                        # phrase_time_limit specifies the maximum duration of a phrase.
-                        log.debug("Listening for speech...")
-                        audio = self.recognizer.listen(
-                            source, 
-                            phrase_time_limit=phrase_time_limit,
-                            timeout=listen_timeout # How long to wait for a phrase to start
-                        )
-                        
-                        # If we get here, speech was detected and captured.
-                        # Broadcast VAD status change if it was previously silent.
-                        if last_vad_status == "silence":
-                            bus.sendMessage(VAD_STATUS_CHANGED, status="speech")
-                            last_vad_status = "speech"
-                        
-                        log.debug("Speech detected, processing audio...")
-                        
-                        # Convert AudioData to NumPy array for processing
-                        audio_data_np = np.frombuffer(audio.get_raw_data(), dtype=np.int16)
-                        sample_rate = audio.sample_rate
-
-                        # Apply noise reduction if enabled and profile exists
-                        use_noise_cancellation = config.get('audio.stt.use_noise_cancellation', False)
-                        if use_noise_cancellation and self.noise_profile is not None:
-                            log.debug("Applying noise reduction...")
-                            # noisereduce expects float64, so convert
-                            audio_data_float = audio_data_np.astype(np.float64) / 32768.0
-                            
-                            # Ensure the noise profile matches the sample rate if necessary
-                            # For simplicity, assuming sample rates match after calibration.
-                            reduced_noise_audio = nr.reduce_noise(y=audio_data_float, sr=sample_rate, y_noise=self.noise_profile, prop_decrease=1.0)
-                            
-                            # Convert back to float32 for Whisper (expected by model.transcribe)
-                            processed_audio = (reduced_noise_audio * 32768.0).astype(np.float32) / 32768.0
-                            log.debug("Noise reduction applied.")
-                        else:
-                            processed_audio = audio_data_np.astype(np.float32) / 32768.0
-                            if use_noise_cancellation and self.noise_profile is None:
-                                log.warning("Noise cancellation enabled but no profile available. Skipping noise reduction.")
-
-                        self.audio_queue.put(processed_audio) # Queue the processed audio for transcription
-
-                    except sr.UnknownValueError:
-                        log.debug("SpeechRecognition could not understand audio (too quiet, garbled, etc.).")
-                        # If it was previously speech, now it's effectively silence
-                        if last_vad_status == "speech":
-                            bus.sendMessage(VAD_STATUS_CHANGED, status="silence")
-                            last_vad_status = "silence"
-                    except sr.WaitTimeoutError:
-                        log.debug("No speech detected within timeout period.")
-                        # If it was previously speech, now it's effectively silence
-                        if last_vad_status == "speech":
-                            bus.sendMessage(VAD_STATUS_CHANGED, status="silence")
-                            last_vad_status = "silence"
-                    except Exception as e:
-                        log.error(f"An error occurred during audio capture: {e}", exc_info=True)
-                        # Ensure VAD status reflects potential silence after an error
-                        if last_vad_status == "speech":
-                            bus.sendMessage(VAD_STATUS_CHANGED, status="silence")
-                            last_vad_status = "silence"
+            log.info(f"Whisper STT listening with phrase_time_limit={phrase_time_limit}, listen_timeout={listen_timeout}")
+
+            while self.app_state.is_running:
+                if is_tts_active:
+                    # If TTS is active, don't listen to avoid self-transcription
+                    vad.reset()
+                    self._leftover_pieces = []
+                    self.reader.skip()
+                    time.sleep(0.1)
+                    continue
+
+                try:
+                    # The listen timeout specifies how long to wait for a phrase to start.
+                    # If nothing is said, it raises PhraseTimeoutError.
+                    # phrase_time_limit specifies the maximum duration of a phrase.
+                    log.debug("Listening for speech...")
+                    raw_audio = self._listen_phrase(
+                        vad,
+                        phrase_time_limit=phrase_time_limit,
+                        listen_timeout=listen_timeout # How long to wait for a phrase to start
+                    )
+                    # Partials of the finished phrase that haven't been decoded yet are dropped.
+                    self._utterance += 1
+                    if not raw_audio:
+                        if self.reader.ring.closed:
+                            log.info("The audio source was closed.")
+                            break
+                        continue
+                    
+                    log.debug("Speech detected, processing audio...")
+                    
+                    processed_audio = self._prepare_audio(raw_audio, CAPTURE_SAMPLE_RATE)
+                    self.audio_queue.put(processed_audio) # Queue the processed audio for transcription
+
+                except PhraseTimeoutError:
+                    log.debug("No speech detected within timeout period.")
+                except Exception as e:
+                    log.error(f"An error occurred during audio capture: {e}", exc_info=True)
+                    # Ensure VAD status reflects potential silence after an error
+                    vad.reset()
+                    self._leftover_pieces = []
 
         except Exception as e:
             log.error(f"An unrecoverable error occurred in the Whisper listening loop: {e}", exc_info=True)
         finally:
             self.audio_queue.put(None) # Signal worker thread to exit
             worker_thread.join()
+            if partial_thread:
+                with self._partial_condition:
+                    self._partial_condition.notify()
+                partial_thread.join()
             bus.unsubscribe(_pause_listening, TTS_STARTED)
             bus.unsubscribe(_resume_listening, TTS_FINISHED)
             log.info("Whisper provider stopped.")
\ No newline at end of file
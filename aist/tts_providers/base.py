@@ -16,4 +16,11 @@ class BaseTTSProvider(ABC):
         """
         Synthesizes the given text into speech and plays it.
         """
+        pass
+
+    def prewarm(self, phrases: list[str]):
+        """
+        Prepares speech for phrases that are spoken often, so they can be played instantly.
+        Providers without a speech cache can ignore this.
+        """
         pass
\ No newline at end of file
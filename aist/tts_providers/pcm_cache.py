@@ -0,0 +1,133 @@
+# aist/tts_providers/pcm_cache.py
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+class PCMCache:
+    """
+    A content-addressed cache of synthesized speech as raw PCM.
+
+    Entries are keyed by a hash of the voice model, the text and the synthesis parameters,
+    and stored as one raw PCM file each. Recently used entries are kept memory-mapped in an
+    LRU, so a hit can be played back without reading or decoding anything. The size of the
+    files is tracked as they are written, and the least recently used ones (by modification
+    time, which every hit refreshes) are deleted once it is over the disk limit.
+    """
+    def __init__(self, cache_dir: str, max_memory_bytes: int, max_disk_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict() # key -> (mmap, memoryview)
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._disk_lock:
+            self._prune_disk()
+
+    @staticmethod
+    def make_key(voice_id: str, text: str, params: dict) -> str:
+        """Builds the cache key for a piece of speech."""
+        material = json.dumps([voice_id, text, params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pcm")
+
+    def get(self, key: str) -> memoryview | None:
+        """Returns the cached PCM for the key, or None on a miss."""
+        with self._lock:
+            path = self._path(key)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._touch(path)
+                return entry[1]
+
+            if not os.path.exists(path):
+                return None
+            self._touch(path)
+            try:
+                with open(path, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                # ValueError is raised for empty files, which can't be mapped.
+                log.warning(f"Could not load cached speech '{path}': {e}")
+                return None
+            pcm = memoryview(mapped)
+            self._add_entry(key, mapped, pcm)
+            return pcm
+
+    @staticmethod
+    def _touch(path: str):
+        """Marks a cache file as recently used, so disk pruning deletes it last."""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def put(self, key: str, pcm: bytes):
+        """Stores PCM for the key on disk and in memory."""
+        if not pcm:
+            return
+        path = self._path(key)
+        temp_path = f"{path}.tmp"
+        with self._disk_lock:
+            try:
+                replaced = os.path.getsize(path) if os.path.exists(path) else 0
+                with open(temp_path, 'wb') as f:
+                    f.write(pcm)
+                os.replace(temp_path, path)
+            except OSError as e:
+                log.warning(f"Could not write cached speech '{path}': {e}")
+                return
+            self._disk_bytes += len(pcm) - replaced
+            if self._disk_bytes > self.max_disk_bytes:
+                self._prune_disk()
+        with self._lock:
+            if key not in self._entries:
+                self._add_entry(key, None, memoryview(bytes(pcm)))
+
+    def _add_entry(self, key, mapped, pcm: memoryview):
+        """Adds an entry to the in-memory LRU, evicting the least recently used entries. Requires the lock."""
+        self._entries[key] = (mapped, pcm)
+        self._memory_bytes += pcm.nbytes
+        while self._memory_bytes > self.max_memory_bytes and len(self._entries) > 1:
+            # The mapping is closed once nothing (e.g. a playback in progress) references it anymore.
+            _old_key, (_old_mapped, old_pcm) = self._entries.popitem(last=False)
+            self._memory_bytes -= old_pcm.nbytes
+
+    def _prune_disk(self):
+        """
+        Deletes the oldest cache files while the cache is larger than its disk limit, and
+        recounts its size. Requires the disk lock.
+        """
+        try:
+            files = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".pcm"):
+                    path = os.path.join(self.cache_dir, name)
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, stat.st_size, path))
+        except OSError as e:
+            log.warning(f"Could not prune the speech cache: {e}")
+            return
+        files.sort()
+        total = sum(size for _mtime, size, _path in files)
+        for _mtime, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError as e:
+                # e.g. a file that is memory-mapped on Windows.
+                log.debug(f"Could not delete cached speech '{path}': {e}")
+        self._disk_bytes = total
@@ -1,16 +1,23 @@
 # aist/tts_providers/piper_provider.py
 import os
 import logging
-import io
-import wave
+import threading
+from collections import OrderedDict
+from queue import Queue
+from piper.config import SynthesisConfig
 from piper.voice import PiperVoice
 from aist.core.audio import audio_manager
 from aist.core.events import bus, TTS_STARTED, TTS_FINISHED
 from aist.core.config_manager import config
 from .base import BaseTTSProvider
+from .pcm_cache import PCMCache
 
 log = logging.getLogger(__name__)
 
+# How many texts spoken once are remembered. A text is only cached the second time it is
+# spoken, so one-off sentences (e.g. of streamed LLM answers) don't fill the cache.
+SEEN_TEXTS = 4096
+
 class PiperProvider(BaseTTSProvider):
     """The Piper TTS engine provider."""
 
@@ -18,6 +25,20 @@ class PiperProvider(BaseTTSProvider):
         super().__init__()
         self.voice = self._load_voice()
         self.p = audio_manager.get_pyaudio()
+        # The output stream is opened on first use and kept open between utterances.
+        self.stream = None
+        # Optional synthesis parameters (length_scale, noise_scale, noise_w_scale, volume, ...).
+        self.synthesis_params = config.get('models.tts.piper_synthesis', {}) or {}
+        self.syn_config = SynthesisConfig(**self.synthesis_params)
+        self.cache = None
+        if config.get('models.tts.cache.enabled', True):
+            self.cache = PCMCache(
+                cache_dir=config.get('models.tts.cache.folder', 'data/cache/tts'),
+                max_memory_bytes=config.get('models.tts.cache.max_memory_mb', 64) * 1024 * 1024,
+                max_disk_bytes=config.get('models.tts.cache.max_disk_mb', 256) * 1024 * 1024,
+            )
+        self.cache_max_text_length = config.get('models.tts.cache.max_text_length', 200)
+        self._seen_once = OrderedDict()
 
     def _load_voice(self):
         """Loads the Piper voice model from the path specified in the config."""
@@ -41,8 +62,75 @@ class PiperProvider(BaseTTSProvider):
             log.error(f"Error initializing Piper TTS engine for model '{model_path}': {e}", exc_info=True)
         return voice
 
+    def _get_stream(self):
+        """Returns the long-lived output stream, opening it if needed."""
+        if self.stream is None:
+            self.stream = self.p.open(
+                format=self.p.get_format_from_width(2),
+                channels=1,
+                rate=self.voice.config.sample_rate,
+                output=True
+            )
+        return self.stream
+
+    def _cache_key(self, text: str) -> str | None:
+        """Returns the speech cache key for the text, or None if it should not be cached."""
+        if self.cache is None or len(text) > self.cache_max_text_length:
+            return None
+        return PCMCache.make_key(config.get('models.tts.piper_voice_model'), text, self.synthesis_params)
+
+    def _admit(self, cache_key: str) -> bool:
+        """Returns True if speech for the key should be stored, i.e. if it was spoken before."""
+        if cache_key in self._seen_once:
+            del self._seen_once[cache_key]
+            return True
+        self._seen_once[cache_key] = None
+        if len(self._seen_once) > SEEN_TEXTS:
+            self._seen_once.popitem(last=False)
+        return False
+
+    def _synthesize_chunks(self, text: str, chunk_queue: Queue, cache_key: str | None):
+        """
+        Synthesizes the text one sentence at a time, queuing the raw PCM of each sentence.
+        Runs on a worker thread, so the next sentence is synthesized while the previous one plays.
+        A None item marks the end of the text. The complete speech is stored in the cache if a key is given.
+        """
+        chunks = []
+        try:
+            for audio_chunk in self.voice.synthesize(text, syn_config=self.syn_config):
+                pcm = audio_chunk.audio_int16_bytes
+                chunks.append(pcm)
+                chunk_queue.put(pcm)
+            if cache_key:
+                self.cache.put(cache_key, b"".join(chunks))
+        except Exception as e:
+            log.error(f"Error during TTS synthesis: {e}", exc_info=True)
+        finally:
+            chunk_queue.put(None)
+
+    def prewarm(self, phrases: list[str]):
+        """Synthesizes phrases into the speech cache ahead of time, without playing them."""
+        if not self.voice or self.cache is None:
+            return
+        for text in phrases:
+            cache_key = self._cache_key(text)
+            if not cache_key or self.cache.get(cache_key) is not None:
+                continue
+            try:
+                pcm = b"".join(chunk.audio_int16_bytes for chunk in self.voice.synthesize(text, syn_config=self.syn_config))
+                self.cache.put(cache_key, pcm)
+            except Exception as e:
+                log.warning(f"Could not pre-warm speech for '{text}': {e}")
+        log.info(f"Speech cache pre-warmed with {len(phrases)} phrases.")
+
+    def _play_cached(self, stream, pcm: memoryview):
+        """Plays cached PCM in small slices of the memory-mapped buffer."""
+        slice_bytes = 2 * self.voice.config.sample_rate // 10
+        for start in range(0, pcm.nbytes, slice_bytes):
+            stream.write(pcm[start:start + slice_bytes].tobytes())
+
     def speak(self, text: str):
-        """Synthesizes text and plays the audio."""
+        """Synthesizes text and plays the audio, starting as soon as the first sentence is ready."""
         if not self.voice:
             log.error("TTS engine (Piper) not available. Cannot play audio.")
             return
@@ -54,23 +142,36 @@ class PiperProvider(BaseTTSProvider):
             log.error("PyAudio instance not available. Cannot play audio.")
             return
 
-        stream = None
+        cache_key = self._cache_key(text)
+        cached_pcm = self.cache.get(cache_key) if cache_key else None
+        chunk_queue = None
+        pcm = None
+        if cached_pcm is None:
+            # Only keep a sentence or two ahead of playback.
+            chunk_queue = Queue(maxsize=2)
+            store_key = cache_key if cache_key and self._admit(cache_key) else None
+            threading.Thread(target=self._synthesize_chunks, args=(text, chunk_queue, store_key), daemon=True).start()
+            pcm = b""
         try:
             bus.sendMessage(TTS_STARTED)
-            wav_buffer = io.BytesIO()
-            with wave.open(wav_buffer, "wb") as wav_file_writer:
-                self.voice.synthesize_wav(text, wav_file=wav_file_writer)
-            wav_buffer.seek(0)
-            with wave.open(wav_buffer, 'rb') as wf:
-                stream = self.p.open(format=self.p.get_format_from_width(wf.getsampwidth()), channels=wf.getnchannels(), rate=wf.getframerate(), output=True)
-                data = wf.readframes(1024)
-                while data:
-                    stream.write(data)
-                    data = wf.readframes(1024)
+            stream = self._get_stream()
+            if cached_pcm is not None:
+                self._play_cached(stream, cached_pcm)
+            else:
+                pcm = chunk_queue.get()
+                while pcm is not None:
+                    stream.write(pcm)
+                    pcm = chunk_queue.get()
+            # The stream stays open, so push the end of the speech out of the output buffer with
+            # silence before reporting that playback is finished.
+            stream.write(bytes(2 * int(stream.get_output_latency() * self.voice.config.sample_rate)))
         except Exception as e:
             log.error(f"Error during TTS playback: {e}", exc_info=True)
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+            # Let the synthesis thread finish if it is blocked on a full queue.
+            while pcm is not None:
+                pcm = chunk_queue.get()
         finally:
-            if stream:
-                stream.stop_stream()
-                stream.close()
-            bus.sendMessage(TTS_FINISHED)
\ No newline at end of file
+            bus.sendMessage(TTS_FINISHED)
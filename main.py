@@ -12,9 +12,9 @@ from typing import Callable, Dict, Any
 from aist.core.audio import audio_manager
 import keyboard
 import zmq
-from aist.core.events import bus, STT_TRANSCRIBED, TTS_SPEAK, STATE_CHANGED, VAD_STATUS_CHANGED
-from aist.core.tts import initialize_tts_engine, subscribe_to_events
-from aist.core.stt import initialize_stt_engine
+from aist.core.events import bus, STT_TRANSCRIBED, STT_PARTIAL, TTS_SPEAK, STATE_CHANGED, VAD_STATUS_CHANGED
+from aist.core.tts import initialize_tts_engine, subscribe_to_events, SentenceChunker
+from aist.core.stt import initialize_stt_engine, PartialTranscriptTracker
 from aist.core.ipc.client import IPCClient
 from aist.core.ipc.protocol import STATE_DORMANT, STATE_LISTENING
 from aist.core.log_setup import setup_logging, console_log, Colors
@@ -89,6 +89,7 @@ def main():
         ipc_client.stop()
         event_broadcaster.stop()
 
+        audio_manager.stop_capture()
         p = audio_manager.get_pyaudio()
         if p:
             p.terminate()
@@ -110,23 +111,52 @@ def main():
     menu = (item('Quit AIST', lambda icon, item: shutdown_app()),)
     tray_icon = icon("AIST", image, "AIST Assistant", menu)
 
-    # --- Event Handler for Transcribed Text ---
-    def _handle_transcription(text: str):
-        nonlocal assistant_state
+    # --- Event Handlers for Transcribed Text ---
+    partial_tracker = PartialTranscriptTracker(config.get('audio.stt.partials.stable_count', 2),
+                                              config.get('assistant.fuzzy_match_threshold', 85))
+    # Number of commands waiting for their response. Partials are not sent meanwhile.
+    commands_in_flight = 0
+    commands_lock = threading.Lock()
+
+    def _run_command(text: str):
+        nonlocal commands_in_flight
         if not app_state.is_active():  # Use thread-safe check
             return
 
         console_log(f"'{text}'", prefix="HEARD", color=Colors.CYAN)
         
         # The frontend no longer makes decisions. It just sends the input and its state to the backend.
-        response = ipc_client.send_command(text, assistant_state)
+        # Streamed responses are spoken sentence by sentence while the LLM is still generating.
+        chunker = SentenceChunker()
+        def _speak_partial(token: str):
+            for sentence in chunker.feed(token):
+                bus.sendMessage(TTS_SPEAK, text=sentence)
+
+        on_partial = _speak_partial if config.get('models.llm.stream_responses', True) else None
+        with commands_lock:
+            commands_in_flight += 1
+        try:
+            response = ipc_client.send_command(text, assistant_state, on_partial=on_partial)
+        finally:
+            with commands_lock:
+                commands_in_flight -= 1
 
         if not response:
             log.info("Received an empty or null response from backend (e.g., ignored command). Continuing.")
             return
 
-        action = response.get("action")
+        if response.get("cancelled"):
+            log.info("The command was cancelled before it finished.")
+            return
+
         text_to_speak = response.get("speak")
+        if response.get("streamed"):
+            # Everything but the final, unterminated sentence has already been spoken.
+            text_to_speak = chunker.flush()
+        _handle_response(response, text_to_speak)
+
+    def _handle_response(response: dict, text_to_speak: str | None):
+        action = response.get("action")
 
         intent_info = response.get("intent")
         if intent_info:
@@ -143,9 +173,50 @@ def main():
             time.sleep(1.5)
             shutdown_app()
 
+    def _handle_transcription(text: str):
+        if partial_tracker.finish(text):
+            log.info(f"'{text}' was already handled from a partial transcript.")
+            return
+        _run_command(text)
+
+    def _handle_partial_transcription(text: str):
+        """
+        Sends a stable partial transcript to the backend, which handles it right away if it is
+        an activation, exit or fast-path command, before the user has even stopped speaking.
+        Partials are published from the STT provider's capture thread, so they are sent from
+        another thread, and not at all while a command is still waiting for its response.
+        """
+        if not app_state.is_active():
+            return
+        with commands_lock:
+            if commands_in_flight:
+                return
+        candidate = partial_tracker.feed(text)
+        if candidate is None:
+            return
+        # The tracker doesn't return another partial until this one is resolved, so at most one is sent at a time.
+        threading.Thread(target=_send_partial, args=(candidate,), daemon=True).start()
+
+    def _send_partial(candidate: str):
+        response = None
+        try:
+            response = ipc_client.send_command(candidate, assistant_state, partial=True)
+        finally:
+            handled = bool(response) and bool(response.get("partial"))
+            partial_tracker.resolve(candidate, handled)
+        if not handled:
+            return
+
+        console_log(f"'{candidate}'", prefix="HEARD", color=Colors.CYAN)
+        _handle_response(response, response.get("speak"))
+
     def _handle_vad_status(status: str):
-        """Broadcasts the VAD status to the GUI."""
+        """Broadcasts the VAD status to the GUI, and lets the user interrupt a command still being answered."""
         event_broadcaster.broadcast("vad:status_changed", {"status": status.upper()})
+        # Barge-in: speaking while the backend is still working on a command abandons it,
+        # so the model is free for whatever the user says next.
+        if status == "speech" and config.get('assistant.barge_in', True):
+            ipc_client.cancel()
     
     def setup_services(icon):
         icon.visible = True
@@ -169,7 +240,7 @@ def main():
                     if socket.poll(1000):
                         command_text = socket.recv_string()
                         log.info(f"Received text command: '{command_text}'")
-                        _handle_transcription(command_text)
+                        _run_command(command_text)
                 except zmq.ZMQError as e:
                     if e.errno == zmq.ETERM:
                         break
@@ -191,6 +262,7 @@ def main():
 
         initialize_stt_engine(app_state, stt_ready_event, event_broadcaster)
         bus.subscribe(_handle_transcription, STT_TRANSCRIBED)
+        bus.subscribe(_handle_partial_transcription, STT_PARTIAL)
         bus.subscribe(_handle_vad_status, VAD_STATUS_CHANGED)
 
         console_log("Waiting for STT engine to be ready...", prefix="INIT")
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency benchmark for the command pipeline, using stub models.
+
+Replays a corpus of commands through a scripted STT provider, the IPC client, a real
+IPCServer with the real dispatcher, skills and skill workers, a deterministic fake LLM
+and a stub TTS provider, and reports p50/p95/p99 latencies for each stage.
+
+Usage:
+    python test_tools/benchmark.py
+    python test_tools/benchmark.py --iterations 20 --token-ms 20
+    python test_tools/benchmark.py --json results.json
+    python test_tools/benchmark.py --baseline results.json   # Exits with 1 on a p95 regression
+    python test_tools/benchmark.py --router-cache            # Also reports the router cache hit rate
+
+The backend's IPC port from config.yaml is used, so the assistant must not be running.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to Python path so 'aist' module can be imported
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format='[%(levelname)-7s] %(name)s - %(message)s'
+)
+log = logging.getLogger(__name__)
+
+from aist.core import decision_cache, memory
+from aist.core.config_manager import config
+from aist.core.events import bus, STT_TRANSCRIBED, TTS_SPEAK
+from aist.core.ipc import server as ipc_server
+from aist.core.ipc.client import IPCClient
+from aist.core.tts import SentenceChunker
+from aist.skills import dispatcher
+from test_tools.stubs import FakeLLM, BenchmarkState, ScriptedSTTProvider, StubTTSProvider, RecordingBroadcaster
+
+DEFAULT_CORPUS = Path(__file__).parent / "benchmark_corpus.json"
+
+# Stages in report order, with what they measure.
+STAGES = {
+    "fast_path": "Dispatcher time for commands handled without the LLM (skill execution excluded)",
+    "llm_routing": "Time for the LLM to choose a skill",
+    "skill_execution": "Time to run a skill handler in a skill worker",
+    "chat_first_token": "From sending a chat command to its first streamed token",
+    "ipc_round_trip": "From sending a command to receiving its full response",
+    "ipc_overhead": "IPC round trip minus the time spent in the dispatcher",
+    "first_speech": "From a transcription to the first text handed to TTS",
+}
+
+class StageRecorder:
+    """Collects latency samples per stage by timing functions of the pipeline."""
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Commands are replayed one at a time, so this always belongs to the latest command.
+        self.last_dispatch_time = 0.0
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples[stage].append(seconds * 1000)
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+
+    def instrument(self):
+        """Wraps the dispatcher's stages with timers. Commands run on the server's worker threads."""
+        original_dispatcher = ipc_server.command_dispatcher
+        original_decision = dispatcher._get_llm_decision
+        original_execute = dispatcher._execute_skill
+
+        def timed_dispatcher(*args, **kwargs):
+            self._local.used_llm = False
+            self._local.skill_time = 0.0
+            start = time.perf_counter()
+            try:
+                return original_dispatcher(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.last_dispatch_time = elapsed
+                if not self._local.used_llm:
+                    self.record("fast_path", elapsed - self._local.skill_time)
+
+        def timed_decision(*args, **kwargs):
+            self._local.used_llm = True
+            start = time.perf_counter()
+            try:
+                return original_decision(*args, **kwargs)
+            finally:
+                self.record("llm_routing", time.perf_counter() - start)
+
+        def timed_execute(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original_execute(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._local.skill_time += elapsed
+                self.record("skill_execution", elapsed)
+
+        ipc_server.command_dispatcher = timed_dispatcher
+        dispatcher._get_llm_decision = timed_decision
+        dispatcher._execute_skill = timed_execute
+
+    def summary(self) -> dict:
+        """Returns the count and percentiles (in milliseconds) of each stage that has samples."""
+        result = {}
+        for stage in STAGES:
+            values = self.samples.get(stage)
+            if not values:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            result[stage] = {"count": len(values), "p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
+        return result
+
+class Benchmark:
+    """Drives the corpus through the frontend and backend and records each stage."""
+    def __init__(self, corpus: list[dict], llm: FakeLLM, recorder: StageRecorder, pause: float = 0.0):
+        self.corpus = corpus
+        self.pause = pause
+        self.recorder = recorder
+        self.tts = StubTTSProvider()
+        self.server = ipc_server.IPCServer(RecordingBroadcaster())
+        self.server.llm = llm
+        self.client = IPCClient()
+        self._pending = []
+        self._heard_at = None
+        self._first_speech_recorded = False
+
+    def start(self):
+        self.server.is_running = True
+        self.server.thread = threading.Thread(target=self.server._serve_forever, daemon=False)
+        self.server.thread.start()
+        self.client.start()
+        bus.subscribe(self._handle_transcription, STT_TRANSCRIBED)
+        bus.subscribe(self._handle_speak, TTS_SPEAK)
+
+    def stop(self):
+        bus.unsubscribe(self._handle_transcription, STT_TRANSCRIBED)
+        bus.unsubscribe(self._handle_speak, TTS_SPEAK)
+        self.client.stop()
+        self.server.stop()
+
+    def _handle_speak(self, text: str):
+        if not self._first_speech_recorded:
+            self._first_speech_recorded = True
+            self.recorder.record("first_speech", time.perf_counter() - self._heard_at)
+        self.tts.speak(text)
+
+    def _handle_transcription(self, text: str):
+        """Does what the frontend does with a transcription, with timers around it."""
+        entry = self._pending.pop(0)
+        self._heard_at = time.perf_counter()
+        self._first_speech_recorded = False
+        first_token_at = []
+
+        chunker = SentenceChunker()
+        def _speak_partial(token: str):
+            if not first_token_at:
+                first_token_at.append(time.perf_counter())
+            for sentence in chunker.feed(token):
+                bus.sendMessage(TTS_SPEAK, text=sentence)
+
+        start = time.perf_counter()
+        response = self.client.send_command(text, entry["state"], on_partial=_speak_partial)
+        elapsed = time.perf_counter() - start
+        self.recorder.record("ipc_round_trip", elapsed)
+        self.recorder.record("ipc_overhead", elapsed - self.recorder.last_dispatch_time)
+        if first_token_at:
+            self.recorder.record("chat_first_token", first_token_at[0] - start)
+
+        if not response:
+            return
+        text_to_speak = chunker.flush() if response.get("streamed") else response.get("speak")
+        if text_to_speak:
+            bus.sendMessage(TTS_SPEAK, text=text_to_speak)
+
+    def run_pass(self):
+        """Replays the whole corpus once."""
+        self._pending = list(self.corpus)
+        self.server.conversation_manager.clear()
+        stt = ScriptedSTTProvider(BenchmarkState(), threading.Event(), [entry["text"] for entry in self.corpus], pause=self.pause)
+        stt.run()
+
+def load_corpus(path: str) -> list[dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    for entry in corpus:
+        if entry.get("state") not in ("DORMANT", "LISTENING"):
+            raise ValueError(f"Corpus entry '{entry.get('text')}' must have a state of DORMANT or LISTENING.")
+    return corpus
+
+def print_report(summary: dict):
+    print()
+    print(f"{'Stage':<18} {'Count':>6} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    print("-" * 58)
+    for stage, stats in summary.items():
+        print(f"{stage:<18} {stats['count']:>6} {stats['p50']:>10.2f} {stats['p95']:>10.2f} {stats['p99']:>10.2f}")
+    print()
+    for stage in summary:
+        print(f"  {stage}: {STAGES[stage]}")
+    print()
+
+def compare_to_baseline(summary: dict, baseline_path: str, tolerance: float) -> list[str]:
+    """Returns a description of every stage whose p95 is more than `tolerance` slower than in the baseline."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)["stages"]
+    regressions = []
+    for stage, stats in summary.items():
+        if stage not in baseline:
+            continue
+        allowed = baseline[stage]["p95"] * (1 + tolerance)
+        if stats["p95"] > allowed:
+            regressions.append(f"{stage}: p95 {stats['p95']:.2f} ms > {allowed:.2f} ms (baseline {baseline[stage]['p95']:.2f} ms)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency benchmark with stub models.")
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS), help="JSON file with the commands to replay.")
+    parser.add_argument("--iterations", type=int, default=10, help="How many times to replay the corpus.")
+    parser.add_argument("--warmup", type=int, default=1, help="Replays to run before measuring.")
+    parser.add_argument("--token-ms", type=float, default=5.0, help="Fake LLM latency per generated token, in milliseconds.")
+    parser.add_argument("--prompt-token-ms", type=float, default=0.05, help="Fake LLM latency per prompt token, in milliseconds.")
+    parser.add_argument("--pause-ms", type=float, default=0.0, help="Pause between commands, in milliseconds, like a user listening to the answer.")
+    parser.add_argument("--json", dest="json_path", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Results JSON to compare against. Exits with 1 if any stage's p95 regressed.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed p95 regression against the baseline (0.10 = 10%%).")
+    parser.add_argument("--router-cache", action="store_true", help="Cache router decisions, so repeated commands skip the LLM.")
+    parser.add_argument("--verbose", action="store_true", help="Show the backend's console output for every command.")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    routes = {entry["text"]: entry["route"] for entry in corpus if "route" in entry}
+    llm = FakeLLM(token_latency=args.token_ms / 1000, prompt_token_latency=args.prompt_token_ms / 1000, routes=routes)
+
+    if not args.verbose:
+        ipc_server.console_log = lambda *a, **kw: None
+
+    # The fake model's decisions must never end up in the real router cache, so the
+    # benchmark uses a temporary one, which stores nothing unless it is enabled.
+    cache_dir = tempfile.TemporaryDirectory()
+    cache = decision_cache.DecisionCache(os.path.join(cache_dir.name, "router_decisions.db"), max_entries=512 if args.router_cache else 0)
+    cache.open()
+    decision_cache.decision_cache = cache
+
+    # Likewise, facts stored while benchmarking go to a temporary memory store, which the
+    # server uses instead of data/memory/memory.db. Forked skill workers inherit the path.
+    memory.DB_PATH = os.path.join(cache_dir.name, "memory.db")
+    config.set('memory.maintenance.enabled', False)
+    memory.initialize_memory_store()
+
+    recorder = StageRecorder()
+    recorder.instrument()
+    benchmark = Benchmark(corpus, llm, recorder, pause=args.pause_ms / 1000)
+    benchmark.start()
+    try:
+        for _ in range(args.warmup):
+            benchmark.run_pass()
+        recorder.reset()
+        start = time.perf_counter()
+        for i in range(args.iterations):
+            benchmark.run_pass()
+            print(f"Pass {i + 1}/{args.iterations} done.", end="\r")
+        total = time.perf_counter() - start
+    finally:
+        cache_stats = cache.stats()
+        benchmark.stop()
+        cache_dir.cleanup()
+
+    summary = recorder.summary()
+    print(f"Replayed {len(corpus)} commands {args.iterations} times in {total:.1f}s.")
+    print_report(summary)
+    if args.router_cache:
+        print(f"Router cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate, warmup included).")
+        print()
+
+    if args.json_path:
+        results = {
+            "settings": {
+                "corpus": args.corpus,
+                "iterations": args.iterations,
+                "token_ms": args.token_ms,
+                "prompt_token_ms": args.prompt_token_ms,
+                "pause_ms": args.pause_ms,
+                "router_cache": args.router_cache,
+            },
+            "stages": summary,
+        }
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json_path}")
+
+    if args.baseline:
+        regressions = compare_to_baseline(summary, args.baseline, args.tolerance)
+        if regressions:
+            print("Latency regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No latency regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -52,7 +52,7 @@ class ConversationTester:
         log.info(f"  LLM GPU Layers: {config.get('models.llm.gpu_layers')}")
         log.info(f"  TTS Provider: {config.get('models.tts.provider')}")
         log.info(f"  STT Provider: {config.get('models.stt.provider')}")
-        log.info(f"  Energy Threshold: {config.get('audio.stt.energy_threshold')}")
+        log.info(f"  Energy Threshold: {config.get('audio.vad.energy_threshold')}")
         log.info("")
         
         # Initialize LLM
@@ -146,7 +146,7 @@ class ConversationTester:
         print("=" * 60)
         print(f"STT Provider: {config.get('models.stt.provider')}")
         print(f"STT Model: {config.get('models.stt.whisper_model_name')}")
-        print(f"Energy Threshold: {config.get('audio.stt.energy_threshold')}")
+        print(f"Energy Threshold: {config.get('audio.vad.energy_threshold')}")
         print(f"Confidence Threshold: {config.get('audio.stt.confidence_threshold')}")
         print(f"TTS Provider: {config.get('models.tts.provider')}")
         print(f"LLM GPU Layers: {config.get('models.llm.gpu_layers')}")
@@ -59,7 +59,7 @@ class TestFrontend:
         print("\n⚙️  Configuration:")
         print(f"   STT Provider:    {config.get('models.stt.provider')}")
         print(f"   STT Model:       {config.get('models.stt.whisper_model_name')}")
-        print(f"   Energy Thresh:   {config.get('audio.stt.energy_threshold')}")
+        print(f"   Energy Thresh:   {config.get('audio.vad.energy_threshold')}")
         print(f"   Confidence:      {config.get('audio.stt.confidence_threshold')}")
         print(f"   TTS Provider:    {config.get('models.tts.provider')}")
         print(f"   LLM:             {config.get('models.llm.path').split('/')[-1]}")
@@ -77,7 +77,7 @@ class TestFrontend:
         print("=" * 70)
         print(f"STT Provider:         {config.get('models.stt.provider')}")
         print(f"STT Model:            {config.get('models.stt.whisper_model_name')}")
-        print(f"Energy Threshold:     {config.get('audio.stt.energy_threshold')}")
+        print(f"Energy Threshold:     {config.get('audio.vad.energy_threshold')}")
         print(f"Confidence Threshold: {config.get('audio.stt.confidence_threshold')}")
         print(f"TTS Provider:         {config.get('models.tts.provider')}")
         print(f"LLM GPU Layers:       {config.get('models.llm.gpu_layers')}")
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Speech-to-text benchmark on recorded audio, without a microphone.
+
+Replays a corpus of utterances through the real STT providers, in place of the microphone,
+and reports for each provider and model:
+- WER: word error rate of the transcripts against the reference texts
+- RTF: real-time factor, the time spent replaying and transcribing divided by the duration
+  of the audio (below 1 is faster than real time). Only meaningful with --speed 0.
+- Latency: from the end of an utterance's audio to its last STT_TRANSCRIBED event. Only measured
+  when replaying in real time or slower: faster (e.g. with --speed 0), the audio ends before the
+  provider has read it, so it is left out.
+- CPU: process CPU seconds per second of audio
+
+The corpus is either a JSON manifest, a list of {"audio": "file.wav", "text": "reference"}
+with paths relative to the manifest, or a directory of WAV files with the reference text of
+each in a .txt file of the same name. WAV files are converted to 16 kHz mono; other files
+are read as raw 16 kHz, 16-bit mono PCM. Partial transcripts are turned off, so only the final
+transcription is measured.
+
+Usage:
+    python test_tools/stt_benchmark.py --corpus data/stt_corpus
+    python test_tools/stt_benchmark.py --corpus corpus.json --run vosk --run whisper:tiny.en --run whisper:base.en
+    python test_tools/stt_benchmark.py --corpus corpus.json --run whisper:small.en --whisper-backend faster_whisper --speed 0
+    python test_tools/stt_benchmark.py --corpus corpus.json --json stt_results.json
+
+Each utterance is followed by --gap seconds of silence, so the VAD can end it, and the next one
+is only played once its transcript has arrived (or --timeout has passed).
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to Python path so 'aist' module can be imported
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format='[%(levelname)-7s] %(name)s - %(message)s'
+)
+log = logging.getLogger(__name__)
+
+from aist.core.audio import audio_manager, FileAudioSource
+from aist.core.config_manager import config
+from aist.core.events import bus, STT_TRANSCRIBED
+from test_tools.stubs import BenchmarkState
+
+# The config key that selects the model of each provider.
+MODEL_KEYS = {
+    "vosk": "models.stt.vosk_model_path",
+    "whisper": "models.stt.whisper_model_name",
+}
+
+def normalize_words(text: str) -> list[str]:
+    """Lowercases a transcript and splits it into words, without punctuation."""
+    return re.findall(r"[\w']+", text.lower())
+
+def word_errors(reference: list[str], hypothesis: list[str]) -> int:
+    """Returns the word-level edit distance (substitutions, deletions and insertions)."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word))
+        previous = current
+    return previous[-1]
+
+def load_corpus(path: str) -> list[dict]:
+    """Loads a manifest or a directory of audio files with .txt references."""
+    if os.path.isdir(path):
+        corpus = []
+        for name in sorted(os.listdir(path)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() not in (".wav", ".pcm", ".raw"):
+                continue
+            text_path = os.path.join(path, stem + ".txt")
+            text = Path(text_path).read_text(encoding='utf-8').strip() if os.path.exists(text_path) else ""
+            corpus.append({"audio": os.path.join(path, name), "text": text})
+        return corpus
+
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    return [{"audio": os.path.join(base, entry["audio"]), "text": entry.get("text", "")} for entry in entries]
+
+class ProviderRun:
+    """Replays the corpus through one STT provider and model, and collects its transcripts."""
+    def __init__(self, provider_name: str, model: str | None, corpus: list[dict], speed: float, gap: float, timeout: float, settle: float):
+        self.provider_name = provider_name
+        self.model = model
+        self.corpus = corpus
+        self.speed = speed
+        self.gap = gap
+        self.timeout = timeout
+        self.settle = settle
+        self.transcripts = [[] for _ in corpus] # (time, text) per utterance
+        self.finished = [0.0] * len(corpus)
+        self._current = 0
+        self._condition = threading.Condition()
+
+    def _on_transcribed(self, text: str):
+        with self._condition:
+            if self._current < len(self.transcripts):
+                self.transcripts[self._current].append((time.perf_counter(), text))
+            self._condition.notify_all()
+
+    def _wait_for_transcript(self, index: int, utterance: dict):
+        """Called by the audio source after each utterance. Holds the next one back until this one is transcribed."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.transcripts[index], timeout=self.timeout)
+            # Some providers split an utterance into several transcripts. Wait until they stop coming.
+            while self.transcripts[index]:
+                count = len(self.transcripts[index])
+                if not self._condition.wait_for(lambda: len(self.transcripts[index]) > count, timeout=self.settle):
+                    break
+            received = self.transcripts[index]
+            self.finished[index] = received[-1][0] if received else time.perf_counter()
+            self._current = index + 1
+
+    def run(self) -> dict:
+        if self.model:
+            config.set(MODEL_KEYS[self.provider_name], self.model)
+        # Calibrating the noise profile would record the start of the corpus.
+        config.set('audio.stt.use_noise_cancellation', False)
+        # Partial decodes compete with the final transcription for the CPU and the model.
+        config.set('audio.stt.partials.enabled', False)
+
+        source = FileAudioSource([entry["audio"] for entry in self.corpus], speed=self.speed, gap_seconds=self.gap,
+                                 on_utterance_end=self._wait_for_transcript)
+        audio_manager.use_source(source)
+        bus.subscribe(self._on_transcribed, STT_TRANSCRIBED)
+
+        app_state = BenchmarkState()
+        ready = threading.Event()
+        provider_module = importlib.import_module(f"aist.stt_providers.{self.provider_name}_provider")
+        ProviderClass = getattr(provider_module, f"{self.provider_name.capitalize()}Provider")
+        load_start = time.perf_counter()
+        provider = ProviderClass(app_state, ready)
+        thread = threading.Thread(target=provider.run, daemon=True)
+        thread.start()
+        try:
+            # A provider that fails to load logs the error and returns without becoming ready.
+            while not ready.wait(timeout=0.5):
+                if not thread.is_alive():
+                    raise RuntimeError(f"The {self.provider_name} provider failed to load. See the errors above.")
+            load_time = time.perf_counter() - load_start
+
+            cpu_start = time.process_time()
+            source.start()
+            source.wait()
+            cpu_time = time.process_time() - cpu_start
+        finally:
+            app_state.is_running = False
+            source.stop()
+            thread.join(timeout=30)
+            bus.unsubscribe(self._on_transcribed, STT_TRANSCRIBED)
+            audio_manager.use_source(None)
+
+        return self._summarize(source.utterances, load_time, cpu_time)
+
+    def _summarize(self, utterances: list[dict], load_time: float, cpu_time: float) -> dict:
+        errors = 0
+        reference_words = 0
+        latencies = []
+        transcribed = 0
+        # Replayed faster than real time, an utterance's audio "ends" before the provider has read it.
+        measure_latency = 0 < self.speed <= 1
+        processing_time = 0.0
+        audio_time = 0.0
+        results = []
+        for entry, utterance, transcripts, finished in zip(self.corpus, utterances, self.transcripts, self.finished):
+            hypothesis = " ".join(text for _, text in transcripts)
+            reference = normalize_words(entry["text"])
+            utterance_errors = word_errors(reference, normalize_words(hypothesis))
+            errors += utterance_errors
+            reference_words += len(reference)
+            transcribed += bool(transcripts)
+            latency = transcripts[-1][0] - utterance["speech_end"] if transcripts and measure_latency else None
+            if latency is not None:
+                latencies.append(latency * 1000)
+            processing_time += finished - utterance["start"]
+            audio_time += utterance["duration"] + self.gap
+            results.append({"audio": entry["audio"], "reference": entry["text"], "hypothesis": hypothesis,
+                            "errors": utterance_errors, "latency_ms": latency * 1000 if latency is not None else None})
+
+        return {
+            "provider": self.provider_name,
+            "model": self.model or config.get(MODEL_KEYS[self.provider_name]),
+            "utterances": len(results),
+            "transcribed": transcribed,
+            "wer": errors / reference_words if reference_words else 0.0,
+            "rtf": processing_time / audio_time if audio_time else 0.0,
+            "latency_p50_ms": float(np.percentile(latencies, 50)) if latencies else None,
+            "latency_p95_ms": float(np.percentile(latencies, 95)) if latencies else None,
+            "cpu_per_audio_second": cpu_time / audio_time if audio_time else 0.0,
+            "load_time_s": load_time,
+            "results": results,
+        }
+
+def print_report(summaries: list[dict]):
+    def ms(value):
+        return f"{value:.0f}" if value is not None else "-"
+    print()
+    print(f"{'Provider':<10} {'Model':<28} {'Utts':>5} {'WER':>7} {'RTF':>6} {'p50 ms':>8} {'p95 ms':>8} {'CPU s/s':>8} {'Load s':>7}")
+    print("-" * 94)
+    for s in summaries:
+        model = str(s['model'])[-28:]
+        print(f"{s['provider']:<10} {model:<28} {s['transcribed']:>2}/{s['utterances']:<2} {s['wer']:>7.1%} {s['rtf']:>6.2f} "
+              f"{ms(s['latency_p50_ms']):>8} {ms(s['latency_p95_ms']):>8} {s['cpu_per_audio_second']:>8.2f} {s['load_time_s']:>7.1f}")
+    print()
+    print("  Latency: from the end of an utterance's audio to its last transcript (includes the VAD hangover),")
+    print("  only measured at --speed 1 or slower")
+    print("  RTF and CPU are per second of audio, silence gaps included")
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description="STT accuracy and latency benchmark on recorded audio.")
+    parser.add_argument("--corpus", required=True, help="JSON manifest, or directory of audio files with .txt references.")
+    parser.add_argument("--run", action="append", dest="runs", metavar="PROVIDER[:MODEL]",
+                        help="Provider and model to benchmark, e.g. 'vosk' or 'whisper:base.en'. Can be repeated. Defaults to the configured provider.")
+    parser.add_argument("--whisper-backend", help="Whisper backend to use ('openai' or 'faster_whisper'). Defaults to the configured one.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, as a multiple of real time. 0 replays as fast as the provider reads.")
+    parser.add_argument("--gap", type=float, default=1.0, help="Seconds of silence played after each utterance.")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Seconds to wait for an utterance's transcript.")
+    parser.add_argument("--settle", type=float, default=0.3, help="Seconds without new transcripts before an utterance counts as done.")
+    parser.add_argument("--json", dest="json_path", help="Write the results, with every transcript, to this JSON file.")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print(f"No audio found in '{args.corpus}'.")
+        sys.exit(1)
+    if args.whisper_backend:
+        config.set('models.stt.whisper_backend', args.whisper_backend)
+
+    summaries = []
+    for run in args.runs or [config.get('models.stt.provider', 'vosk')]:
+        provider_name, _, model = run.partition(":")
+        if provider_name not in MODEL_KEYS:
+            print(f"Unknown provider '{provider_name}'. Choose from: {', '.join(MODEL_KEYS)}.")
+            sys.exit(1)
+        print(f"Benchmarking {provider_name}{' (' + model + ')' if model else ''} on {len(corpus)} utterances...")
+        summaries.append(ProviderRun(provider_name, model or None, corpus, args.speed, args.gap, args.timeout, args.settle).run())
+
+    print_report(summaries)
+
+    if args.json_path:
+        results = {
+            "settings": {
+                "corpus": args.corpus,
+                "speed": args.speed,
+                "gap": args.gap,
+                "whisper_backend": config.get('models.stt.whisper_backend', 'openai'),
+                "vad_engine": config.get('audio.vad.engine', 'webrtc'),
+            },
+            "runs": summaries,
+        }
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Deterministic stand-ins for the models, for benchmarking and testing the pipeline
+without loading an LLM, a microphone or a speaker.
+
+- FakeLLM mimics the parts of the ctransformers API that AIST uses, with a configurable
+  latency per evaluated token. It answers router prompts with scripted decisions and
+  everything else with a canned chat response.
+- ScriptedSTTProvider publishes a list of utterances as transcriptions.
+- StubTTSProvider records what it is asked to speak instead of playing it.
+"""
+
+import json
+import re
+import string
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Add parent directory to Python path so 'aist' module can be imported
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from aist.core.events import bus, STT_TRANSCRIBED
+from aist.stt_providers.base import BaseSTTProvider
+from aist.tts_providers.base import BaseTTSProvider
+
+DEFAULT_CHAT_RESPONSE = (
+    "Sure, here is a short answer. "
+    "It is generated by the benchmark model, one character at a time. "
+    "That makes its timing easy to reason about."
+)
+
+# Matches the end of a skill-router prompt and captures the command being routed.
+_ROUTER_PROMPT_RE = re.compile(r'User\'s command: "(.*)"\nYour JSON response: \[/INST\]\s*$')
+
+class FakeLLM:
+    """
+    A deterministic, character-level stand-in for a ctransformers model.
+
+    Every printable character is one token. After a prompt is evaluated, the model picks
+    a script for its answer, and its logits always favour the next character of that
+    script, so free-form, streamed and constrained decoding all produce the same output.
+    Evaluating tokens sleeps for `prompt_token_latency` seconds per prompt token and
+    `token_latency` seconds per generated token. Like ctransformers, the model keeps the
+    tokens it has evaluated in `_context` and only evaluates what follows the longest
+    common prefix with a new prompt.
+    """
+    UNK_TOKEN = 0
+    BOS_TOKEN = 1
+    EOS_TOKEN = 2
+
+    def __init__(self, token_latency: float = 0.005, prompt_token_latency: float = 0.00005,
+                 routes: dict | None = None, chat_response: str = DEFAULT_CHAT_RESPONSE):
+        self.token_latency = token_latency
+        self.prompt_token_latency = prompt_token_latency
+        # Maps a command to the decision the router should return for it. Other commands are routed to chat.
+        self.routes = routes or {}
+        self.chat_response = chat_response
+        self.vocab = ["", "", ""] + list(string.printable)
+        self.vocab_size = len(self.vocab)
+        self._token_ids = {text: token_id for token_id, text in enumerate(self.vocab) if token_id > self.EOS_TOKEN}
+        self._context = []
+        self._script = ""
+        self._position = 0
+        self._new_prompt = False
+        self.tokens_evaluated = 0
+
+    def tokenize(self, text: str, add_bos_token: bool | None = None) -> list[int]:
+        tokens = [self._token_ids.get(c, self.UNK_TOKEN) for c in text]
+        if add_bos_token is None or add_bos_token:
+            tokens.insert(0, self.BOS_TOKEN)
+        return tokens
+
+    def detokenize(self, tokens: list[int], decode: bool = True) -> str | bytes:
+        text = "".join(self.vocab[token] for token in tokens)
+        return text if decode else text.encode()
+
+    def is_eos_token(self, token: int) -> bool:
+        return token == self.EOS_TOKEN
+
+    def _respond(self, prompt: str) -> str:
+        """Returns the scripted answer to a prompt."""
+        match = _ROUTER_PROMPT_RE.search(prompt)
+        if not match:
+            return self.chat_response
+        decision = self.routes.get(match.group(1), {"function": "chat", "parameters": {}})
+        return json.dumps(decision)
+
+    def prepare_inputs_for_generation(self, tokens: list[int]) -> list[int]:
+        """Keeps the longest common prefix of the context and the tokens, and returns the rest."""
+        n_past = 0
+        for context_token, token in zip(self._context, tokens):
+            if context_token != token:
+                break
+            n_past += 1
+        # At least one token is always evaluated, so the logits belong to the new prompt.
+        n_past = min(n_past, len(tokens) - 1)
+        self._context = self._context[:n_past]
+        self._new_prompt = True
+        return tokens[n_past:]
+
+    def eval(self, tokens: list[int], **kwargs):
+        self._context.extend(tokens)
+        self.tokens_evaluated += len(tokens)
+        # The prompt may be evaluated in several chunks. It is complete once the logits are read.
+        if self._new_prompt:
+            time.sleep(len(tokens) * self.prompt_token_latency)
+        else:
+            time.sleep(len(tokens) * self.token_latency)
+            self._position += len(self.detokenize(tokens))
+
+    @property
+    def logits(self) -> list[float]:
+        if self._new_prompt:
+            self._new_prompt = False
+            self._script = self._respond(self.detokenize(self._context))
+            self._position = 0
+        logits = [0.0] * self.vocab_size
+        if self._position < len(self._script):
+            logits[self._token_ids.get(self._script[self._position], self.UNK_TOKEN)] = 10.0
+        else:
+            logits[self.EOS_TOKEN] = 10.0
+        return logits
+
+    def sample(self, **kwargs) -> int:
+        logits = self.logits
+        return logits.index(max(logits))
+
+    def generate(self, tokens: list[int], **kwargs):
+        self.eval(self.prepare_inputs_for_generation(tokens))
+        while True:
+            token = self.sample()
+            if self.is_eos_token(token):
+                return
+            yield token
+            self.eval([token])
+
+    def _stream(self, prompt: str, max_new_tokens: int):
+        for count, token in enumerate(self.generate(self.tokenize(prompt)), start=1):
+            yield self.detokenize([token])
+            if count >= max_new_tokens:
+                return
+
+    def __call__(self, prompt: str, max_new_tokens: int = 256, stream: bool = False, **kwargs):
+        tokens = self._stream(prompt, max_new_tokens)
+        return tokens if stream else "".join(tokens)
+
+class BenchmarkState:
+    """The minimal application state the STT providers need."""
+    def __init__(self):
+        self.is_running = True
+
+    def is_active(self) -> bool:
+        return self.is_running
+
+class ScriptedSTTProvider(BaseSTTProvider):
+    """
+    An STT provider that "hears" a fixed list of utterances, publishing each one as a transcription.
+    Subscribers run on the publishing thread, so the next utterance is only published once the
+    previous one has been handled.
+    """
+    def __init__(self, app_state, stt_ready_event: threading.Event, utterances: list[str], pause: float = 0.0):
+        super().__init__(app_state, stt_ready_event)
+        self.utterances = list(utterances)
+        self.pause = pause
+
+    def run(self):
+        self.stt_ready_event.set()
+        for text in self.utterances:
+            if not self.app_state.is_active():
+                break
+            bus.sendMessage(STT_TRANSCRIBED, text=text)
+            time.sleep(self.pause)
+
+class StubTTSProvider(BaseTTSProvider):
+    """A TTS provider that records each text it is asked to speak, with the time of the request."""
+    def __init__(self, latency_per_char: float = 0.0):
+        super().__init__()
+        self.latency_per_char = latency_per_char
+        self.spoken = []
+
+    def speak(self, text: str):
+        self.spoken.append((time.perf_counter(), text))
+        time.sleep(len(text) * self.latency_per_char)
+
+class RecordingBroadcaster:
+    """Stands in for the EventBroadcaster, keeping the events instead of publishing them over ZMQ."""
+    def __init__(self):
+        self.events = []
+
+    def broadcast(self, event_type: str, payload: dict):
+        self.events.append((event_type, payload))
+
+    def stop(self):
+        pass